@@ -3,13 +3,103 @@ from dotenv import load_dotenv
 import os
 
 
-def create_app():
+def create_app(config=None):
     load_dotenv()
 
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
 
+    # connection pool (per worker process)
+    app.config['DB_POOL_MIN_SIZE'] = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    app.config['DB_POOL_MAX_SIZE'] = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    app.config['DB_POOL_TIMEOUT'] = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+
+    # read replicas: GET / HEAD requests read from one of these libpq DSNs
+    # (separated by ';'); after a write the session reads its own writes
+    # ("pin": from the primary, "lsn": from replicas that replayed it, "off")
+    app.config['DB_REPLICA_DSNS'] = [dsn.strip() for dsn in os.getenv("DB_REPLICA_DSNS", "").split(";")
+                                     if dsn.strip()]
+    app.config['DB_READ_YOUR_WRITES'] = os.getenv("DB_READ_YOUR_WRITES", "pin")
+    app.config['DB_READ_YOUR_WRITES_WINDOW'] = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+    app.config['DB_REPLICA_WAIT'] = float(os.getenv("DB_REPLICA_WAIT", "0.5"))
+    app.config['DB_REPLICA_RETRY'] = float(os.getenv("DB_REPLICA_RETRY", "30"))
+
+    # reference-data cache (departments, semesters, instructor pickers)
+    app.config['REFERENCE_CACHE_TTL'] = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+    app.config['REFERENCE_CACHE_MAX_SIZE'] = int(os.getenv("REFERENCE_CACHE_MAX_SIZE", "64"))
+
+    # cross-worker invalidation via LISTEN/NOTIFY; TTL used while it is down
+    app.config['CACHE_INVALIDATION_LISTENER'] = os.getenv("CACHE_INVALIDATION_LISTENER", "1") == "1"
+    app.config['CACHE_FALLBACK_TTL'] = float(os.getenv("CACHE_FALLBACK_TTL", "30"))
+
+    # ETag / Last-Modified on list and detail pages
+    app.config['CONDITIONAL_GET'] = os.getenv("CONDITIONAL_GET", "1") == "1"
+    app.config['ETAG_SALT'] = os.getenv("ETAG_SALT", "")
+
+    # named prepared statements for the hot read queries, per pooled connection
+    app.config['PREPARED_STATEMENTS'] = os.getenv("PREPARED_STATEMENTS", "1") == "1"
+    app.config['PREPARED_STATEMENTS_MAX'] = int(os.getenv("PREPARED_STATEMENTS_MAX", "200"))
+
+    # report views (db/migrations/0008): refreshed REPORTS_REFRESH_DELAY
+    # seconds after grades are posted and whenever older than
+    # REPORTS_REFRESH_INTERVAL seconds (0 = only after grades / by cron)
+    app.config['REPORTS_REFRESH_AFTER_GRADES'] = os.getenv("REPORTS_REFRESH_AFTER_GRADES", "1") == "1"
+    app.config['REPORTS_REFRESH_DELAY'] = float(os.getenv("REPORTS_REFRESH_DELAY", "30"))
+    app.config['REPORTS_REFRESH_INTERVAL'] = float(os.getenv("REPORTS_REFRESH_INTERVAL", "3600"))
+
+    # what-if GPA scenarios (/reports/what-if): seconds the per-process copy
+    # of enrollments and grades is reused before it is read again
+    app.config['WHATIF_CACHE_TTL'] = float(os.getenv("WHATIF_CACHE_TTL", "600"))
+
+    # query instrumentation: /metrics, optional Server-Timing header
+    app.config['QUERY_METRICS'] = os.getenv("QUERY_METRICS", "1") == "1"
+    app.config['SERVER_TIMING'] = os.getenv("SERVER_TIMING", "0") == "1"
+    # directory shared by the workers of one server: each writes its metrics
+    # there every METRICS_WRITE_INTERVAL seconds and /metrics sums them all
+    # ("" = /metrics reports only the worker that answers)
+    app.config['METRICS_DIR'] = os.getenv("METRICS_DIR", "")
+    app.config['METRICS_WRITE_INTERVAL'] = float(os.getenv("METRICS_WRITE_INTERVAL", "1"))
+
+    # slow-query log with sampled EXPLAIN capture (needs QUERY_METRICS)
+    app.config['SLOW_QUERY_MS'] = float(os.getenv("SLOW_QUERY_MS", "250"))
+    app.config['SLOW_QUERY_EXPLAIN_SAMPLE'] = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.2"))
+    app.config['SLOW_QUERY_EXPLAIN_INTERVAL'] = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+    app.config['SLOW_QUERY_EXPLAIN_TIMEOUT'] = float(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "10"))
+    app.config['SLOW_QUERY_ANALYZE_WRITES'] = os.getenv("SLOW_QUERY_ANALYZE_WRITES", "0") == "1"
+    app.config['SLOW_QUERY_REDACT_PARAMS'] = os.getenv("SLOW_QUERY_REDACT_PARAMS", "1") == "1"
+    app.config['SLOW_QUERY_LOG'] = os.getenv(
+        "SLOW_QUERY_LOG", os.path.join(app.instance_path, "slow_queries.jsonl"))
+    app.config['SLOW_QUERY_LOG_MAX_BYTES'] = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+    app.config['SLOW_QUERY_LOG_BACKUPS'] = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "3"))
+
+    if config:
+        app.config.update(config)
+
+    from .models import init_db
+    init_db(app)
+
+    if app.config['QUERY_METRICS']:
+        from .instrumentation import init_instrumentation
+        init_instrumentation(app)
+
+        if app.config['SLOW_QUERY_MS'] > 0:
+            from .slowlog import init_slow_log
+            init_slow_log(app)
+
+    from .cache import init_cache, reference_cache
+    init_cache(app)
+
+    if app.config['CACHE_INVALIDATION_LISTENER']:
+        from .invalidation import start_listener
+        start_listener(reference_cache, app.config)
+
     from .routes import main
     app.register_blueprint(main)
 
+    from .reports import init_reports
+    init_reports(app)
+
+    from .commands import init_commands
+    init_commands(app)
+
     return app
@@ -0,0 +1,376 @@
+import csv
+import io
+import re
+
+
+class CsvFormatError(ValueError):
+    """The uploaded file cannot be read as the expected CSV layout."""
+
+
+# -----------------------------
+# CSV helpers
+# -----------------------------
+def read_csv(stream):
+    """Return a DictReader over an uploaded file with normalized headers."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    if not reader.fieldnames:
+        raise CsvFormatError("The file is empty.")
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    return reader
+
+
+def copy_rows(cur, table, columns, rows):
+    """Stream `rows` into `table` with a single COPY ... FROM STDIN."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # unquoted empty fields are read back as NULL
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def parse_int(value):
+    value = (value or "").strip()
+    return int(value) if value.isdigit() else None
+
+
+SEMESTER_RE = re.compile(r"^\s*([A-Za-z]+)\s+(\d{4})\s*$")
+
+
+def parse_semester(value):
+    """
+    Accept either a semester_id ("3") or "<term> <year>" ("Fall 2025").
+    Returns (semester_id, term, year); all None when unparseable.
+    """
+    value = (value or "").strip()
+    if value.isdigit():
+        return int(value), None, None
+    match = SEMESTER_RE.match(value)
+    if match:
+        return None, match.group(1).capitalize(), int(match.group(2))
+    return None, None, None
+
+
+# -----------------------------
+# Bulk grade import
+# -----------------------------
+GRADE_COLUMNS_BY_ID = {"enrollment_id", "grade"}
+GRADE_COLUMNS_BY_COURSE = {"student_id", "course_code", "semester", "grade"}
+
+STAGE_GRADE_COLUMNS = ("line_no", "enrollment_id", "student_id", "course_code",
+                       "semester_id", "term", "year", "grade")
+
+
+def parse_grade_rows(reader):
+    """
+    Validate every row of a grade CSV before anything touches the database.
+
+    Rows are keyed either by enrollment_id or by
+    student_id + course_code + semester. Returns (rows, errors) where rows
+    are tuples in STAGE_GRADE_COLUMNS order and errors are (line_no, message).
+    """
+    columns = set(reader.fieldnames)
+    by_id = GRADE_COLUMNS_BY_ID <= columns
+    if not by_id and not GRADE_COLUMNS_BY_COURSE <= columns:
+        raise CsvFormatError(
+            "Expected columns enrollment_id,grade or "
+            "student_id,course_code,semester,grade.")
+
+    rows, errors, seen = [], [], {}
+
+    # line 1 is the header
+    for line_no, rec in enumerate(reader, start=2):
+        grade = (rec.get("grade") or "").strip().upper()
+        problems = []
+
+        if not grade:
+            problems.append("missing grade")
+        elif len(grade) > 5:
+            problems.append("grade longer than 5 characters")
+
+        enrollment_id = student_id = course_code = None
+        semester_id = term = year = None
+
+        if by_id:
+            enrollment_id = parse_int(rec.get("enrollment_id"))
+            if enrollment_id is None:
+                problems.append("enrollment_id must be a positive integer")
+            key = ("id", enrollment_id)
+        else:
+            student_id = parse_int(rec.get("student_id"))
+            course_code = (rec.get("course_code") or "").strip().upper() or None
+            semester_id, term, year = parse_semester(rec.get("semester"))
+            if student_id is None:
+                problems.append("student_id must be a positive integer")
+            if not course_code:
+                problems.append("missing course_code")
+            if semester_id is None and term is None:
+                problems.append('semester must be a semester_id or "<Term> <Year>"')
+            key = ("course", student_id, course_code, semester_id, term, year)
+
+        if not problems and key in seen:
+            problems.append(f"duplicate of line {seen[key]}")
+
+        if problems:
+            errors.append((line_no, "; ".join(problems)))
+            continue
+
+        seen[key] = line_no
+        rows.append((line_no, enrollment_id, student_id, course_code,
+                     semester_id, term, year, grade))
+
+    return rows, errors
+
+
+def import_grades(cur, rows, allow_errors=False, apply=True):
+    """
+    Stage validated grade rows with COPY, check them against the database
+    in a few set-based statements and, if nothing is wrong (or
+    allow_errors is set), apply every valid row with a single
+    UPDATE ... FROM. The statement-level GPA triggers then update each
+    affected student once. With apply=False the rows are only checked.
+
+    Returns a dict with the per-row errors and the applied counts. The
+    caller commits or rolls back.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE grade_import (
+            line_no        INTEGER PRIMARY KEY,
+            enrollment_id  INTEGER,
+            student_id     INTEGER,
+            course_code    VARCHAR(20),
+            semester_id    INTEGER,
+            term           VARCHAR(10),
+            year           INTEGER,
+            grade          VARCHAR(5),
+            error          TEXT
+        ) ON COMMIT DROP
+    """)
+    copy_rows(cur, "grade_import", STAGE_GRADE_COLUMNS, rows)
+    cur.execute("ANALYZE grade_import")
+
+    # resolve "<term> <year>" to semester_id
+    cur.execute("""
+        UPDATE grade_import g
+        SET semester_id = sm.semester_id
+        FROM semesters sm
+        WHERE g.semester_id IS NULL
+          AND g.term IS NOT NULL
+          AND sm.term = g.term
+          AND sm.year = g.year
+    """)
+
+    # resolve student + course + semester to enrollment_id
+    cur.execute("""
+        UPDATE grade_import g
+        SET enrollment_id = e.enrollment_id
+        FROM courses c
+        JOIN enrollments e ON e.course_id = c.course_id
+        WHERE g.enrollment_id IS NULL
+          AND c.course_code = g.course_code
+          AND e.student_id = g.student_id
+          AND e.semester_id = g.semester_id
+    """)
+
+    cur.execute("""
+        UPDATE grade_import g
+        SET error = CASE
+                WHEN g.enrollment_id IS NULL AND g.semester_id IS NULL
+                    THEN 'unknown semester'
+                WHEN e.enrollment_id IS NULL
+                    THEN 'no matching enrollment'
+                WHEN gp.grade IS NULL
+                    THEN 'unknown grade "' || g.grade || '"'
+                WHEN e.status NOT IN ('Enrolled', 'Completed')
+                    THEN 'enrollment is ' || e.status || ' and cannot be graded'
+            END
+        FROM grade_import g2
+        LEFT JOIN enrollments e ON e.enrollment_id = g2.enrollment_id
+        LEFT JOIN grade_points gp ON gp.grade = g2.grade
+        WHERE g.line_no = g2.line_no
+    """)
+
+    # two lines that resolve to the same enrollment: keep the first
+    cur.execute("""
+        UPDATE grade_import g
+        SET error = 'same enrollment as line ' || d.first_line
+        FROM (
+            SELECT enrollment_id, MIN(line_no) AS first_line
+            FROM grade_import
+            WHERE error IS NULL
+            GROUP BY enrollment_id
+            HAVING COUNT(*) > 1
+        ) d
+        WHERE g.enrollment_id = d.enrollment_id
+          AND g.line_no <> d.first_line
+          AND g.error IS NULL
+    """)
+
+    cur.execute("""
+        SELECT line_no, error
+        FROM grade_import
+        WHERE error IS NOT NULL
+        ORDER BY line_no
+    """)
+    errors = [(r["line_no"], r["error"]) for r in cur.fetchall()]
+
+    result = {"errors": errors, "applied": False, "updated": 0, "students": 0}
+    if not apply or (errors and not allow_errors):
+        return result
+
+    cur.execute("""
+        UPDATE enrollments e
+        SET grade = g.grade, status = 'Completed'
+        FROM grade_import g
+        WHERE e.enrollment_id = g.enrollment_id
+          AND g.error IS NULL
+          AND (e.grade IS DISTINCT FROM g.grade OR e.status <> 'Completed')
+        RETURNING e.student_id
+    """)
+    updated = cur.fetchall()
+
+    result.update(applied=True, updated=len(updated),
+                  students=len({r["student_id"] for r in updated}))
+    return result
+
+
+# -----------------------------
+# Bulk (cohort) enrollment
+# -----------------------------
+def parse_student_ids(reader):
+    """
+    Read a one-column CSV of student_id values in upload order.
+    Returns (student_ids, errors) with errors as (line_no, message).
+    """
+    if "student_id" not in reader.fieldnames:
+        raise CsvFormatError("Expected a student_id column.")
+
+    student_ids, errors, seen = [], [], {}
+    for line_no, rec in enumerate(reader, start=2):
+        student_id = parse_int(rec.get("student_id"))
+        if student_id is None:
+            errors.append((line_no, "student_id must be a positive integer"))
+        elif student_id in seen:
+            errors.append((line_no, f"duplicate of line {seen[student_id]}"))
+        else:
+            seen[student_id] = line_no
+            student_ids.append(student_id)
+    return student_ids, errors
+
+
+def enroll_cohort(cur, offering_id, student_ids=None,
+                  department_id=None, enrollment_year=None):
+    """
+    Enroll a cohort into one offering in a single INSERT ... SELECT.
+
+    The cohort is either an explicit list of student_ids (seats go in list
+    order) or every active student matching department_id and/or
+    enrollment_year (seats go in student_id order). Returns None when the
+    offering does not exist, otherwise a dict of the students that were
+    enrolled, already had an enrollment, were ineligible, or did not get a
+    seat because the offering filled up. The caller commits or rolls back.
+    """
+    # The offering row lock serializes this batch with every other
+    # enrollment into the offering (their seat reservation updates the same
+    # row), so the free seat count read here stays exact until commit and
+    # no concurrent insert can slip past the duplicate check below.
+    cur.execute("""
+        SELECT o.offering_id, o.course_id, o.semester_id,
+               o.capacity, o.enrolled_count,
+               c.course_code, c.course_name, sm.term, sm.year
+        FROM course_offerings o
+        JOIN courses c ON c.course_id = o.course_id
+        JOIN semesters sm ON sm.semester_id = o.semester_id
+        WHERE o.offering_id = %s
+        FOR UPDATE OF o
+    """, (offering_id,))
+    offering = cur.fetchone()
+    if offering is None:
+        return None
+
+    cur.execute("""
+        CREATE TEMP TABLE cohort_import (
+            position    INTEGER PRIMARY KEY,
+            student_id  INTEGER NOT NULL
+        ) ON COMMIT DROP
+    """)
+    if student_ids is not None:
+        copy_rows(cur, "cohort_import", ("position", "student_id"),
+                  enumerate(student_ids, start=1))
+    else:
+        conditions, params = ["status = 'Active'"], []
+        if department_id:
+            conditions.append("department_id = %s")
+            params.append(department_id)
+        if enrollment_year:
+            conditions.append("enrollment_year = %s")
+            params.append(enrollment_year)
+        cur.execute(f"""
+            INSERT INTO cohort_import (position, student_id)
+            SELECT ROW_NUMBER() OVER (ORDER BY student_id), student_id
+            FROM students
+            WHERE {" AND ".join(conditions)}
+        """, params)
+    cur.execute("ANALYZE cohort_import")
+
+    free = max(offering["capacity"] - offering["enrolled_count"], 0)
+
+    cur.execute("""
+        WITH candidates AS (
+            SELECT ci.position, ci.student_id,
+                   s.student_id IS NOT NULL AS known,
+                   s.status AS student_status,
+                   e.status AS existing_status
+            FROM cohort_import ci
+            LEFT JOIN students s ON s.student_id = ci.student_id
+            LEFT JOIN enrollments e
+                   ON e.student_id = ci.student_id
+                  AND e.course_id = %(course_id)s
+                  AND e.semester_id = %(semester_id)s
+        ),
+        eligible AS (
+            SELECT position, student_id,
+                   ROW_NUMBER() OVER (ORDER BY position) AS seat
+            FROM candidates
+            WHERE known
+              AND student_status = 'Active'
+              AND existing_status IS NULL
+        ),
+        inserted AS (
+            INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+            SELECT student_id, %(course_id)s, %(semester_id)s, %(offering_id)s, 'Enrolled'
+            FROM eligible
+            WHERE seat <= %(free)s
+            RETURNING student_id
+        )
+        SELECT c.position, c.student_id, c.existing_status,
+               CASE
+                   WHEN i.student_id IS NOT NULL THEN 'enrolled'
+                   WHEN NOT c.known THEN 'unknown'
+                   WHEN c.student_status <> 'Active' THEN 'inactive'
+                   WHEN c.existing_status IS NOT NULL THEN 'already_enrolled'
+                   ELSE 'full'
+               END AS outcome
+        FROM candidates c
+        LEFT JOIN inserted i ON i.student_id = c.student_id
+        ORDER BY c.position
+    """, {"course_id": offering["course_id"], "semester_id": offering["semester_id"],
+          "offering_id": offering["offering_id"], "free": free})
+
+    result = {"offering": dict(offering), "enrolled": [], "already_enrolled": [],
+              "ineligible": [], "full": []}
+    for r in cur.fetchall():
+        if r["outcome"] == "enrolled":
+            result["enrolled"].append(r["student_id"])
+        elif r["outcome"] == "already_enrolled":
+            result["already_enrolled"].append(
+                {"student_id": r["student_id"], "status": r["existing_status"]})
+        elif r["outcome"] == "full":
+            result["full"].append(r["student_id"])
+        else:
+            result["ineligible"].append(
+                {"student_id": r["student_id"], "reason": r["outcome"]})
+    return result
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2.extras import RealDictCursor
+
+from .models import get_db_connection
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Keys are tuples whose first element names the table the value was read
+    from, so invalidate("instructors") drops every instructor entry. The
+    TTL is checked on read, so lowering it (while the invalidation
+    listener is down) applies to existing entries.
+    """
+
+    def __init__(self, maxsize=64, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation, so a load that raced with one is
+        # not stored
+        self._generation = 0
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = (time.monotonic(), value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, *tables):
+        """Drop the entries read from `tables` (everything if none given)."""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if not tables:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k[0] in tables]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+reference_cache = TTLCache()
+
+
+def _fetch_all(sql):
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(sql)
+    rows = [dict(r) for r in cur.fetchall()]
+    cur.close()
+    return rows
+
+
+# -----------------------------
+# Cached lookup sets (form pickers and list filters)
+# -----------------------------
+def get_departments():
+    return reference_cache.get_or_load(("departments",), lambda: _fetch_all("""
+        SELECT department_id, department_code, department_name
+        FROM departments
+        ORDER BY department_name
+    """))
+
+
+def get_semesters():
+    return reference_cache.get_or_load(("semesters",), lambda: _fetch_all("""
+        SELECT semester_id, term, year, start_date, end_date
+        FROM semesters
+        ORDER BY start_date DESC
+    """))
+
+
+def get_instructors(active_only=False):
+    where = "WHERE status = 'Active'" if active_only else ""
+    return reference_cache.get_or_load(("instructors", active_only), lambda: _fetch_all(f"""
+        SELECT instructor_id, first_name, last_name,
+               first_name || ' ' || last_name AS instructor_name,
+               department_id, status
+        FROM instructors
+        {where}
+        ORDER BY last_name, first_name
+    """))
+
+
+def invalidate(*tables):
+    reference_cache.invalidate(*tables)
+
+
+def init_cache(app):
+    reference_cache.ttl = app.config["REFERENCE_CACHE_TTL"]
+    reference_cache.maxsize = app.config["REFERENCE_CACHE_MAX_SIZE"]
@@ -0,0 +1,247 @@
+import sys
+
+import click
+import psycopg2
+from flask.cli import AppGroup
+from psycopg2.extras import RealDictCursor
+
+from . import migrations, partitions, reports
+from .models import get_db_connection
+
+
+# -----------------------------
+# flask seats ...
+# -----------------------------
+seats_cli = AppGroup("seats", help="Maintain the course_offerings.enrolled_count counters.")
+
+
+@seats_cli.command("verify")
+@click.option("--repair", is_flag=True,
+              help="Rewrite drifted counters from a fresh count.")
+def verify_seats(repair):
+    """Recount 'Enrolled' rows per offering and report counter drift."""
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    cur.execute("SELECT * FROM verify_offering_enrolled_counts(%s)", (repair,))
+    drift = cur.fetchall()
+
+    conn.commit()
+    cur.close()
+
+    if not drift:
+        click.echo("All offering counters match.")
+        return
+
+    for row in drift:
+        click.echo(f"{row['course_code']:<12} {row['term']} {row['year']}  "
+                   f"stored={row['stored_count']:<5} actual={row['actual_count']}")
+
+    if repair:
+        click.echo(f"Repaired {len(drift)} offering counter(s).")
+    else:
+        click.echo(f"{len(drift)} offering counter(s) drifted; "
+                   "re-run with --repair to fix.")
+        sys.exit(1)
+
+
+# -----------------------------
+# flask gpa ...
+# -----------------------------
+gpa_cli = AppGroup("gpa", help="Maintain the students' running GPA totals.")
+
+
+@gpa_cli.command("verify")
+@click.option("--repair", is_flag=True,
+              help="Rebuild drifted totals from enrollments (use for backfill).")
+def verify_gpa(repair):
+    """Rebuild GPA totals for all students in one pass and report drift."""
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    cur.execute("SELECT * FROM rebuild_gpa_totals(%s)", (repair,))
+    drift = cur.fetchall()
+
+    conn.commit()
+    cur.close()
+
+    if not drift:
+        click.echo("All student GPA totals match.")
+        return
+
+    for row in drift[:50]:
+        click.echo(f"student {row['student_id']:<8} "
+                   f"points {row['stored_points']} -> {row['actual_points']}  "
+                   f"credits {row['stored_credits']} -> {row['actual_credits']}  "
+                   f"gpa {row['stored_gpa']} -> {row['actual_gpa']}")
+    if len(drift) > 50:
+        click.echo(f"... and {len(drift) - 50} more")
+
+    if repair:
+        click.echo(f"Rebuilt GPA totals for {len(drift)} student(s).")
+    else:
+        click.echo(f"{len(drift)} student(s) drifted; "
+                   "re-run with --repair to fix.")
+        sys.exit(1)
+
+
+# -----------------------------
+# flask db ...
+# -----------------------------
+db_cli = AppGroup("db", help="Apply the versioned migrations in db/migrations.")
+
+
+@db_cli.command("status")
+def migration_status():
+    """List every migration and whether it has been applied."""
+
+    conn = migrations.connect()
+    try:
+        rows = migrations.status(conn)
+    finally:
+        conn.close()
+
+    for migration, applied, changed in rows:
+        state = f"applied {applied['applied_at']:%Y-%m-%d %H:%M}" if applied else "pending"
+        if changed:
+            state += "  (file changed since it was applied)"
+        click.echo(f"{migration.version}  {migration.name:<40} {state}")
+
+
+@db_cli.command("migrate")
+@click.option("--to", "target", metavar="VERSION",
+              help="Stop after this migration (e.g. 0004).")
+def migrate(target):
+    """Apply pending migrations in order; index builds run CONCURRENTLY."""
+
+    conn = migrations.connect()
+    try:
+        done = migrations.migrate(conn, target=target, echo=click.echo)
+    except (migrations.MigrationError, psycopg2.Error) as e:
+        click.echo(f"Migration failed: {e}", err=True)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    click.echo(f"Applied {len(done)} migration(s)." if done else "Nothing to apply.")
+
+
+# -----------------------------
+# flask partitions ...
+# -----------------------------
+partitions_cli = AppGroup("partitions", help="Manage the per-semester enrollments partitions.")
+
+
+@partitions_cli.command("list")
+def list_partitions():
+    """List the live and archived enrollments partitions."""
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    rows = partitions.partitions(cur)
+    conn.commit()
+    cur.close()
+
+    for p in rows:
+        term = f"{p['term']} {p['year']}" if p["semester_id"] is not None else "?"
+        state = "archived" if p["parent"] == "enrollments_archive" else (
+            "open" if p["is_open"] else "live")
+        if p["detach_pending"]:
+            state += " (detach pending)"
+        click.echo(f"{p['name']:<28} {term:<12} {state:<24} "
+                   f"~{p['rows']:>9} rows {p['bytes'] / 2**20:>9.1f} MB")
+
+
+@partitions_cli.command("create")
+@click.option("--add-terms", type=int, default=0, metavar="N",
+              help="Also add semesters from the Spring/Fall calendar until N upcoming terms exist.")
+def create_partitions(add_terms):
+    """Make sure every existing semester has a partition."""
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        created = partitions.create_partitions(cur, add_terms)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        click.echo(f"Creating partitions failed: {e}", err=True)
+        sys.exit(1)
+    finally:
+        cur.close()
+
+    for name in created:
+        click.echo(f"created {name}")
+    click.echo(f"Created {len(created)} partition(s)." if created else "All partitions exist.")
+
+
+@partitions_cli.command("archive")
+@click.option("--keep", type=int, default=4, show_default=True,
+              help="Closed terms to keep in the live table.")
+@click.option("--dry-run", is_flag=True, help="Only list the partitions that would move.")
+def archive_partitions(keep, dry_run):
+    """Move closed terms' partitions to enrollments_archive."""
+
+    conn = migrations.connect()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # a detach interrupted by a failure is finished first
+        pending = [p for p in partitions.partitions(cur) if p["detach_pending"]]
+        todo = pending + [p for p in partitions.archivable(cur, keep) if p not in pending]
+        cur.close()
+
+        for p in todo:
+            click.echo(f"{'would archive' if dry_run else 'archiving'} "
+                       f"{p['name']} ({p['term']} {p['year']}, ~{p['rows']} rows)")
+            if not dry_run:
+                partitions.archive_partition(conn, p)
+    except (partitions.PartitionError, psycopg2.Error) as e:
+        click.echo(f"Archiving failed: {e}", err=True)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    if not todo:
+        click.echo("Nothing to archive.")
+
+
+# -----------------------------
+# flask reports ...
+# -----------------------------
+reports_cli = AppGroup("reports", help="Refresh the precomputed report views.")
+
+
+@reports_cli.command("refresh")
+@click.option("--view", "views", multiple=True, type=click.Choice(reports.VIEWS),
+              help="Refresh only this view (repeatable).")
+@click.option("--older-than", type=float, metavar="SECONDS",
+              help="Skip views refreshed more recently than this.")
+def refresh_reports(views, older_than):
+    """REFRESH MATERIALIZED VIEW CONCURRENTLY the report views (cron-friendly)."""
+
+    conn = reports.connect()
+    try:
+        done = reports.refresh_reports(conn, views or reports.VIEWS, older_than=older_than)
+    except psycopg2.Error as e:
+        click.echo(f"Refresh failed: {e}", err=True)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    if done is None:
+        click.echo("Another refresh is running; skipped.")
+        return
+    for view, rows, ms in done:
+        click.echo(f"{view:<28} {rows:>8} rows  {ms:>6} ms")
+    if not done:
+        click.echo("All report views are fresh.")
+
+
+def init_commands(app):
+    app.cli.add_command(seats_cli)
+    app.cli.add_command(gpa_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(reports_cli)
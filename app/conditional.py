@@ -0,0 +1,86 @@
+import hashlib
+from datetime import date
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from psycopg2.extras import RealDictCursor
+
+from .models import get_db_connection
+
+
+def data_version(tables, entity=None, entity_id=None):
+    """
+    Return (stamp, last_modified) for the given tables and, optionally, one
+    student or course, in a single lookup of the version tables.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    cur.execute("""
+        SELECT table_name AS name, SUM(version) AS version, MAX(updated_at) AS updated_at
+        FROM table_versions
+        WHERE table_name = ANY(%s)
+        GROUP BY table_name
+        UNION ALL
+        SELECT entity, version, updated_at
+        FROM entity_versions
+        WHERE entity = %s AND entity_id = %s
+        ORDER BY name
+    """, (list(tables), entity, entity_id))
+    rows = cur.fetchall()
+
+    cur.close()
+
+    stamp = ";".join(f"{r['name']}={r['version']}" for r in rows)
+    last_modified = max((r["updated_at"] for r in rows), default=None)
+    return stamp, last_modified
+
+
+def conditional(*tables, entity=None):
+    """
+    Answer GETs with 304 Not Modified when nothing the page shows has
+    changed, without running the view.
+
+    `tables` are the tables the page reads; `entity` is an optional
+    (name, view argument) pair such as ("student", "student_id") for a
+    detail page. The ETag also covers the date (pages that use
+    open_semesters change at midnight) and ETAG_SALT (change it on deploys
+    that alter templates).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(**kwargs):
+            # a page that shows flashed messages must not be replayed
+            if not current_app.config["CONDITIONAL_GET"] or "_flashes" in session:
+                return view(**kwargs)
+
+            name, arg = entity or (None, None)
+            stamp, last_modified = data_version(tables, name, kwargs.get(arg))
+            etag = hashlib.sha1(
+                f"{current_app.config['ETAG_SALT']}|{date.today()}|{request.full_path}|{stamp}"
+                .encode()).hexdigest()
+
+            if "If-None-Match" in request.headers:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(since and last_modified
+                                    and last_modified.replace(microsecond=0) <= since)
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapped
+
+    return decorator
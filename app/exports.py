@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import zlib
+
+import psycopg2.extensions
+from flask import Response, stream_with_context
+
+# rows fetched per round trip from the server-side cursor
+EXPORT_ITERSIZE = 2000
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+
+
+def _encode_chunks(rows, columns, fmt):
+    """Turn rows into text chunks of up to EXPORT_ITERSIZE rows each."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+
+    if writer:
+        writer.writerow(columns)
+
+    pending = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), default=str))
+            buffer.write("\n")
+
+        pending += 1
+        if pending == EXPORT_ITERSIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(conn, sql, params, columns, fmt, filename, gzip=False):
+    """
+    Stream the result of `sql` as CSV or JSON Lines.
+
+    The query runs on a named (server-side) cursor, so only EXPORT_ITERSIZE
+    rows are held in memory at a time however large the export is. The
+    generator runs inside stream_with_context, which keeps the request's
+    pooled connection checked out until the last chunk has been sent.
+    """
+
+    def generate():
+        cur = conn.cursor(name="export_rows",
+                          cursor_factory=psycopg2.extensions.cursor)
+        cur.itersize = EXPORT_ITERSIZE
+        try:
+            cur.execute(sql, params)
+            chunks = _encode_chunks(cur, columns, fmt)
+            if gzip:
+                yield from _gzip_chunks(chunks)
+            else:
+                for chunk in chunks:
+                    yield chunk.encode()
+        finally:
+            cur.close()
+            # read-only; end the transaction that held the cursor open
+            conn.rollback()
+
+    filename = f"{filename}.{fmt}" + (".gz" if gzip else "")
+    response = Response(stream_with_context(generate()),
+                        content_type="application/gzip" if gzip else CONTENT_TYPES[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
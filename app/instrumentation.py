@@ -0,0 +1,520 @@
+import bisect
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+import psycopg2.extensions
+from psycopg2 import sql
+from flask import Response, current_app, g, has_app_context, request
+
+
+# -----------------------------
+# Metric types (Prometheus text exposition)
+# -----------------------------
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(values), total] for values, total in self._values.items()]
+
+    @staticmethod
+    def _fold(merged, snapshots):
+        for snapshot in snapshots:
+            for values, total in snapshot:
+                values = tuple(values)
+                merged[values] = merged.get(values, 0) + total
+        return merged
+
+    def _merged(self, snapshots):
+        with self._lock:
+            merged = dict(self._values)
+        return self._fold(merged, snapshots)
+
+    def combine(self, snapshots):
+        """Other processes' `snapshots` as one snapshot (without this process's values)."""
+        return [[list(values), total] for values, total in self._fold({}, snapshots).items()]
+
+    def render(self, snapshots=()):
+        """Exposition lines for this process's values plus other workers' `snapshots`."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._merged(snapshots).items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, label_values=(), value=1):
+        with self._lock:
+            self._values[label_values] = value
+
+    @staticmethod
+    def _fold(merged, snapshots):
+        for snapshot in snapshots:
+            for values, value in snapshot:
+                merged.setdefault(tuple(values), value)
+        return merged
+
+    def render(self, snapshots=()):
+        lines = super().render(snapshots)
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(values), list(series)] for values, series in self._series.items()]
+
+    @staticmethod
+    def _fold(merged, snapshots):
+        for snapshot in snapshots:
+            for values, series in snapshot:
+                values = tuple(values)
+                if values not in merged:
+                    merged[values] = series
+                elif len(series) == len(merged[values]):
+                    merged[values] = [a + b for a, b in zip(merged[values], series)]
+        return merged
+
+    def _merged(self, snapshots):
+        with self._lock:
+            merged = {values: list(series) for values, series in self._series.items()}
+        return self._fold(merged, snapshots)
+
+    def combine(self, snapshots):
+        """Other processes' `snapshots` as one snapshot (without this process's series)."""
+        return [[list(values), series] for values, series in self._fold({}, snapshots).items()]
+
+    def render(self, snapshots=()):
+        """Exposition lines for this process's series plus other workers' `snapshots`."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for values, series in sorted(self._merged(snapshots).items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Latency of single statements.",
+    LATENCY_BUCKETS, labels=("endpoint", "query"))
+QUERY_ROWS = Counter(
+    "db_query_rows_total", "Rows returned or affected by statements.",
+    labels=("endpoint", "query"))
+QUERY_INFO = Gauge(
+    "db_query_info", "Normalized SQL of each query fingerprint.",
+    labels=("query", "sql"))
+REQUEST_QUERIES = Histogram(
+    "db_request_queries", "Statements executed per request.",
+    (0, 1, 2, 3, 5, 8, 13, 21, 34, 55), labels=("endpoint",))
+REQUEST_DB_DURATION = Histogram(
+    "db_request_duration_seconds", "Total statement time per request.",
+    LATENCY_BUCKETS, labels=("endpoint",))
+POOL_CHECKOUT = Histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a pooled connection.",
+    LATENCY_BUCKETS, labels=("endpoint",))
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request start to response.",
+    LATENCY_BUCKETS, labels=("endpoint", "status"))
+
+METRICS = (QUERY_DURATION, QUERY_ROWS, QUERY_INFO, REQUEST_QUERIES,
+           REQUEST_DB_DURATION, POOL_CHECKOUT, REQUEST_DURATION)
+
+
+# -----------------------------
+# Sharing across worker processes
+# -----------------------------
+# metrics-<pid>-<nonce>.json per live process; a later process that reuses
+# the pid has another nonce, so it never takes over an exited one's file
+_PROCESS_FILE = re.compile(r"metrics-(\d+)-[0-9a-f]+\.json(\.tmp)?$")
+_EXITED_FILE = "metrics-exited.json"
+_LOCK_FILE = "metrics.lock"
+
+_process = None
+
+
+def _metrics_file(directory):
+    """This process's file in `directory`."""
+    global _process
+
+    if _process is None or _process[0] != os.getpid():
+        _process = (os.getpid(), uuid.uuid4().hex[:8])
+    return os.path.join(directory, "metrics-{}-{}.json".format(*_process))
+
+
+@contextmanager
+def _locked(directory, operation):
+    """flock() on the directory's lock file: LOCK_SH to read, LOCK_EX to retire."""
+    with open(os.path.join(directory, _LOCK_FILE), "a") as fh:
+        fcntl.flock(fh, operation)
+        yield
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, under another user
+    return True
+
+
+def _read_snapshot(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def write_metrics(directory):
+    """Replace this process's file in `directory` with a snapshot of its metrics."""
+    path = _metrics_file(directory)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({metric.name: metric.snapshot() for metric in METRICS}, fh)
+    os.replace(tmp, path)
+
+
+def retire_exited_metrics(directory):
+    """
+    Add the files of processes that are no longer running to
+    metrics-exited.json and delete them, so their counts stay in the
+    totals while the directory keeps one file per live worker. Returns
+    the names of the files deleted.
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    exited = []
+    for name in names:
+        match = _PROCESS_FILE.match(name)
+        if match and not _running(int(match.group(1))):
+            exited.append(name)
+    if not exited:
+        return []
+
+    retired, snapshots = [], []
+    with _locked(directory, fcntl.LOCK_EX):
+        try:
+            snapshots.append(_read_snapshot(os.path.join(directory, _EXITED_FILE)))
+        except FileNotFoundError:
+            pass
+        for name in exited:
+            path = os.path.join(directory, name)
+            try:
+                if not name.endswith(".tmp"):  # a write cut short: nothing to keep
+                    snapshots.append(_read_snapshot(path))
+            except FileNotFoundError:
+                continue  # another worker retired it first
+            except ValueError:
+                pass
+            retired.append(name)
+        if not retired:
+            return retired
+
+        path = os.path.join(directory, _EXITED_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as fh:
+            json.dump({metric.name: metric.combine([s.get(metric.name, []) for s in snapshots])
+                       for metric in METRICS}, fh)
+        os.replace(f"{path}.tmp", path)
+        for name in retired:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return retired
+
+
+def read_other_metrics(directory):
+    """The snapshots other processes wrote to `directory`, by metric name."""
+    own = os.path.basename(_metrics_file(directory))
+    snapshots = []
+    try:
+        with _locked(directory, fcntl.LOCK_SH):
+            for name in sorted(os.listdir(directory)):
+                if name == own or not (name.startswith("metrics-") and name.endswith(".json")):
+                    continue
+                try:
+                    snapshots.append(_read_snapshot(os.path.join(directory, name)))
+                except (OSError, ValueError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return snapshots
+
+
+class MetricsWriter(threading.Thread):
+    """
+    Writes this process's metrics to METRICS_DIR every `interval` seconds
+    while requests are being served, so the worker that answers a scrape
+    can add them to its own.
+    """
+
+    def __init__(self, directory, interval):
+        super().__init__(name="metrics-writer", daemon=True)
+        self.directory = directory
+        self.interval = interval
+        self.last_error = None
+        self._dirty = threading.Event()
+
+    def touch(self):
+        self._dirty.set()
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            retire_exited_metrics(self.directory)
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            try:
+                write_metrics(self.directory)
+                self.last_error = None
+            except OSError as e:
+                self.last_error = str(e)
+            time.sleep(self.interval)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _metrics_writer(config):
+    """This process's writer, started on first use (threads do not survive fork())."""
+    global _writer
+
+    if _writer is not None and _writer.is_alive():
+        return _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = MetricsWriter(config["METRICS_DIR"], config["METRICS_WRITE_INTERVAL"])
+            _writer.start()
+    return _writer
+
+
+# -----------------------------
+# Statement fingerprints
+# -----------------------------
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query):
+    """Return (fingerprint, normalized SQL) for a query string."""
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    normalized = _WHITESPACE.sub(" ", str(query)).strip()
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    QUERY_INFO.set((digest, normalized[:200]))
+    return digest, normalized
+
+
+# -----------------------------
+# Per-request accounting
+# -----------------------------
+class RequestStats:
+    __slots__ = ("started", "queries", "db_time", "rows", "checkout")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.checkout = 0.0
+
+
+def _endpoint():
+    return request.endpoint or "unmatched"
+
+
+def record_query(query, duration, rowcount):
+    if not has_app_context():
+        return
+    stats = g.get("db_stats")
+    if stats is None:
+        return
+
+    digest, _ = fingerprint(query)
+    endpoint = _endpoint()
+    rows = max(rowcount, 0)
+
+    stats.queries += 1
+    stats.db_time += duration
+    stats.rows += rows
+
+    QUERY_DURATION.observe((endpoint, digest), duration)
+    if rows:
+        QUERY_ROWS.inc((endpoint, digest), rows)
+
+
+def record_checkout(duration):
+    if has_app_context() and g.get("db_stats") is not None:
+        g.db_stats.checkout += duration
+        POOL_CHECKOUT.observe((_endpoint(),), duration)
+
+
+# set by slowlog.init_slow_log(): (threshold in seconds, callback)
+_slow_query_hook = None
+
+
+def set_slow_query_hook(threshold, callback):
+    global _slow_query_hook
+    _slow_query_hook = (threshold, callback)
+
+
+# -----------------------------
+# Connection / cursor wrappers
+# -----------------------------
+class InstrumentedCursorMixin:
+    """Times every execute() / copy_expert() of whatever cursor class it wraps."""
+
+    def execute(self, query, vars=None):
+        if isinstance(query, sql.Composable):
+            # psycopg2.sql queries: fingerprinted and logged as the SQL text
+            query = query.as_string(self)
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            record_query(query, time.perf_counter() - start, -1)
+            raise
+
+        duration = time.perf_counter() - start
+        record_query(query, duration, self.rowcount)
+
+        hook = _slow_query_hook
+        if hook is not None and duration >= hook[0]:
+            hook[1](self, query, vars, duration)
+        return result
+
+    def copy_expert(self, query, file, size=8192):
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(query, file, size)
+        finally:
+            record_query(query, time.perf_counter() - start, self.rowcount)
+
+
+@lru_cache(maxsize=None)
+def instrumented_cursor_class(cursor_class):
+    return type("Instrumented" + cursor_class.__name__,
+                (InstrumentedCursorMixin, cursor_class), {})
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    Connection whose cursors (of any cursor_factory, including the
+    connection default) report their statements to the current request.
+    """
+
+    def cursor(self, *args, **kwargs):
+        factory = (kwargs.get("cursor_factory") or self.cursor_factory
+                   or psycopg2.extensions.cursor)
+        kwargs["cursor_factory"] = instrumented_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+# -----------------------------
+# Flask hooks
+# -----------------------------
+def _start_request():
+    g.db_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop("db_stats", None)
+    if stats is None:
+        return response
+
+    endpoint = _endpoint()
+    elapsed = time.perf_counter() - stats.started
+
+    REQUEST_QUERIES.observe((endpoint,), stats.queries)
+    REQUEST_DB_DURATION.observe((endpoint,), stats.db_time)
+    REQUEST_DURATION.observe((endpoint, str(response.status_code)), elapsed)
+
+    config = current_app.config
+    if config["METRICS_DIR"]:
+        _metrics_writer(config).touch()
+
+    if config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = (
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+            f"pool;dur={stats.checkout * 1000:.1f}, "
+            f"app;dur={elapsed * 1000:.1f}")
+    return response
+
+
+def metrics():
+    """
+    This process's metrics, plus (with METRICS_DIR) the last snapshot of
+    every other process that wrote one, so any worker answers for all.
+    Exited processes' files are retired first.
+    """
+    directory = current_app.config["METRICS_DIR"]
+    others = []
+    if directory:
+        try:
+            retire_exited_metrics(directory)
+        except (OSError, ValueError):
+            pass  # counted as they are; retried on the next scrape
+        others = read_other_metrics(directory)
+    body = "\n".join(line for metric in METRICS
+                     for line in metric.render([o.get(metric.name, []) for o in others])) + "\n"
+    return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def init_instrumentation(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2
+
+from .models import _connect_kwargs
+
+# channel the notify_cache_invalidation() triggers send on
+CHANNEL = "cache_invalidation"
+
+log = logging.getLogger(__name__)
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Background thread that LISTENs for cache invalidations from every worker
+    (and from psql sessions) and evicts the matching cache entries.
+
+    While connected the cache uses its normal TTL. When the connection is
+    lost the TTL drops to `fallback_ttl`, so missed notifications can only
+    leave entries stale for that long, and the thread reconnects with
+    exponential backoff. On every (re)connect the whole cache is flushed,
+    since anything may have changed while nobody was listening.
+    """
+
+    def __init__(self, cache, normal_ttl, fallback_ttl,
+                 poll_interval=5.0, max_backoff=30.0):
+        super().__init__(name="cache-invalidation-listener", daemon=True)
+        self.cache = cache
+        self.normal_ttl = normal_ttl
+        self.fallback_ttl = min(fallback_ttl, normal_ttl)
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+
+        self.connected = False
+        self.connects = 0
+        self.received = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.last_error = None
+        self._stopping = threading.Event()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stopping.is_set():
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                self._mark_down(e)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1.0
+            try:
+                self._listen(conn)
+            except (psycopg2.Error, OSError) as e:
+                self._mark_down(e)
+            finally:
+                if not conn.closed:
+                    conn.close()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _connect(self):
+        conn = psycopg2.connect(**_connect_kwargs(), keepalives=1,
+                                keepalives_idle=30, keepalives_interval=10,
+                                keepalives_count=3)
+        conn.autocommit = True
+        conn.cursor().execute(f"LISTEN {CHANNEL}")
+
+        self.cache.invalidate()
+        self.cache.ttl = self.normal_ttl
+        self.connected = True
+        self.connects += 1
+        log.info("cache invalidation listener connected")
+        return conn
+
+    def _listen(self, conn):
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                # idle: make sure the server is still there
+                conn.cursor().execute("SELECT 1")
+                continue
+
+            conn.poll()
+            while conn.notifies:
+                self._handle(conn.notifies.pop(0))
+
+    def _handle(self, notify):
+        try:
+            message = json.loads(notify.payload)
+            table = message["table"]
+        except (ValueError, KeyError, TypeError):
+            log.warning("ignoring malformed invalidation: %r", notify.payload)
+            return
+
+        self.cache.invalidate(table)
+
+        # time from the writing statement to the eviction here (includes
+        # the rest of the writer's transaction and any clock skew)
+        if message.get("at") is not None:
+            lag = max(time.time() - float(message["at"]), 0.0)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+        self.received += 1
+
+    def _mark_down(self, exc):
+        if self.connected or self.last_error is None:
+            log.warning("cache invalidation listener down, falling back to "
+                        "a %ss TTL: %s", self.fallback_ttl, exc)
+        self.connected = False
+        self.last_error = str(exc).strip()
+        self.cache.ttl = self.fallback_ttl
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "received": self.received,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "avg_lag_seconds": self.total_lag / self.received if self.received else None,
+            "last_error": self.last_error,
+        }
+
+
+_listener = None
+_listener_args = None
+
+
+def _start():
+    global _listener
+    _listener = InvalidationListener(*_listener_args)
+    _listener.start()
+
+
+def start_listener(cache, config):
+    """
+    Start this process's listener (once). Threads do not survive fork(), so
+    every gunicorn worker forked from a --preload master starts its own.
+    """
+    global _listener_args
+
+    if _listener is not None and _listener.is_alive():
+        return _listener
+
+    first_start = _listener_args is None
+    _listener_args = (cache, config["REFERENCE_CACHE_TTL"], config["CACHE_FALLBACK_TTL"])
+    _start()
+
+    if first_start and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_start)
+    return _listener
+
+
+def listener_stats():
+    return _listener.stats() if _listener is not None else None
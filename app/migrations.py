@@ -0,0 +1,190 @@
+import hashlib
+import os
+import re
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from .models import _connect_kwargs
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "db", "migrations")
+
+# first-line marker of migrations that cannot run inside a transaction
+# (CREATE / DROP INDEX CONCURRENTLY); their statements run one by one
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+_FILENAME = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+
+_CREATE_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+    re.IGNORECASE)
+
+# serializes runners across processes and hosts
+_ADVISORY_LOCK = "SELECT pg_advisory_lock(hashtext('schema_migrations'))"
+_ADVISORY_UNLOCK = "SELECT pg_advisory_unlock(hashtext('schema_migrations'))"
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding="utf-8") as fh:
+            self.sql = fh.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """
+        The statements of a no-transaction migration. They are split on a
+        semicolon at the end of a line, so such files hold plain DDL only
+        (no function bodies or string literals containing ';').
+        """
+        body = "\n".join(line for line in self.sql.splitlines()
+                         if not line.lstrip().startswith("--"))
+        return [s.strip() for s in re.split(r";\s*$", body, flags=re.MULTILINE) if s.strip()]
+
+    def concurrent_indexes(self):
+        """Names of the indexes this migration builds CONCURRENTLY."""
+        return _CREATE_INDEX.findall(self.sql)
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".sql"):
+            continue
+        match = _FILENAME.match(filename)
+        if not match:
+            raise MigrationError(f"{filename}: expected NNNN_name.sql")
+        version, name = match.groups()
+        if version in migrations:
+            raise MigrationError(f"{filename}: version {version} is used twice")
+        migrations[version] = Migration(version, name, os.path.join(directory, filename))
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def connect():
+    """A dedicated autocommit connection (CONCURRENTLY needs one, not a pooled one)."""
+    conn = psycopg2.connect(**_connect_kwargs())
+    conn.autocommit = True
+    return conn
+
+
+def ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version      VARCHAR(4) PRIMARY KEY,
+            name         TEXT NOT NULL,
+            checksum     CHAR(64) NOT NULL,
+            applied_at   TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            duration_ms  INTEGER NOT NULL
+        )
+    """)
+
+
+def applied_migrations(cur):
+    ensure_table(cur)
+    cur.execute("SELECT * FROM schema_migrations ORDER BY version")
+    return {r["version"]: r for r in cur.fetchall()}
+
+
+def status(conn, directory=MIGRATIONS_DIR):
+    """[(migration, applied row or None, changed since applied)] for every file."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    applied = applied_migrations(cur)
+    cur.close()
+    return [(m, applied.get(m.version),
+             m.version in applied and applied[m.version]["checksum"] != m.checksum)
+            for m in load_migrations(directory)]
+
+
+def drop_invalid_indexes(cur, names):
+    """
+    Drop the INVALID indexes among `names`: what a CREATE INDEX
+    CONCURRENTLY that failed or was cancelled leaves behind. It is never
+    used for reads but is still maintained on every write, and CREATE
+    INDEX ... IF NOT EXISTS would keep it. Valid indexes are left alone.
+    Returns the dropped names.
+    """
+    if not names:
+        return []
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid
+          AND c.relname = ANY(%s)
+          AND pg_table_is_visible(c.oid)
+    """, (list(names),))
+    invalid = [r[0] for r in cur.fetchall()]
+    for name in invalid:
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    return invalid
+
+
+def apply_migration(conn, migration, echo=print):
+    cur = conn.cursor()
+    start = time.perf_counter()
+
+    if migration.transactional:
+        # the DDL and its schema_migrations row commit together
+        conn.autocommit = False
+        try:
+            cur.execute(migration.sql)
+            cur.execute("""
+                INSERT INTO schema_migrations (version, name, checksum, duration_ms)
+                VALUES (%s, %s, %s, %s)
+            """, (migration.version, migration.name, migration.checksum,
+                  int((time.perf_counter() - start) * 1000)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+    else:
+        # every statement commits on its own; a failure leaves the migration
+        # unrecorded, so the file must be safe to re-run from the top. Its
+        # indexes are created IF NOT EXISTS, and the invalid ones an
+        # interrupted run left are dropped first so they get rebuilt
+        for name in drop_invalid_indexes(cur, migration.concurrent_indexes()):
+            echo(f"  dropped invalid index {name} left by an earlier run")
+        for statement in migration.statements():
+            cur.execute(statement)
+        cur.execute("""
+            INSERT INTO schema_migrations (version, name, checksum, duration_ms)
+            VALUES (%s, %s, %s, %s)
+        """, (migration.version, migration.name, migration.checksum,
+              int((time.perf_counter() - start) * 1000)))
+
+    cur.close()
+    return time.perf_counter() - start
+
+
+def migrate(conn, target=None, directory=MIGRATIONS_DIR, echo=print):
+    """Apply every pending migration up to `target` (inclusive) in version order."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(_ADVISORY_LOCK)
+    try:
+        applied = applied_migrations(cur)
+        done = []
+        for migration in load_migrations(directory):
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                continue
+            echo(f"applying {migration.version}_{migration.name} ...")
+            elapsed = apply_migration(conn, migration, echo)
+            echo(f"  done in {elapsed:.2f}s")
+            done.append(migration)
+        return done
+    finally:
+        cur.execute(_ADVISORY_UNLOCK)
+        cur.close()
@@ -1,19 +1,380 @@
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
+from psycopg2 import pool
+from flask import current_app, g, has_app_context, has_request_context, request, session
 from dotenv import load_dotenv
+import random
+import threading
+import time
 import os
+from contextlib import contextmanager
+
+from .instrumentation import InstrumentedConnection, record_checkout
 
 load_dotenv()  # Load DB credentials from .env
 
 
-def get_db_connection():
+# -----------------------------
+# Connection pool
+# -----------------------------
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that waits up to `timeout` seconds for a free
+    connection instead of raising PoolError as soon as maxconn is reached,
+    and that keeps every returned connection open for reuse. `minconn`
+    only sets how many are opened up front.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, *args, **kwargs):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(
+                f"Timed out after {self.timeout}s waiting for a database connection")
+        try:
+            conn = super().getconn(key)
+            # drop connections the server has already closed
+            if conn.closed:
+                super().putconn(conn, key, close=True)
+                conn = super().getconn(key)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    def _putconn(self, conn, key=None, close=False):
+        # psycopg2 closes a returned connection once minconn are idle, so
+        # under concurrency every connection past the first would be
+        # reopened by the next getconn(); idle ones never exceed maxconn
+        if self.closed:
+            raise pool.PoolError("connection pool is closed")
+
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise pool.PoolError("trying to put unkeyed connection")
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
 
-    conn = psycopg2.connect(
+        if close or conn.closed:
+            conn.close()
+        else:
+            self._pool.append(conn)
+
+        if not self.closed or key in self._used:
+            del self._used[key]
+            del self._rused[id(conn)]
+
+
+_pool = None
+_pool_pid = None
+_replica_pools = []
+_replica_pid = None
+_pool_lock = threading.Lock()
+# replica index -> monotonic time before which it is not tried again
+_replica_down = {}
+# pools inherited through fork(); kept referenced so their sockets are never
+# closed from the child (that would terminate the parent's sessions)
+_inherited_pools = []
+
+
+def _connect_kwargs():
+    return dict(
         host=os.getenv("DB_HOST"),
         database=os.getenv("DB_NAME"),
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD")
     )
 
-    conn.cursor_factory = psycopg2.extras.DictCursor
-    return conn
+
+def _new_pool(minconn, **kwargs):
+    config = current_app.config
+    if config["QUERY_METRICS"]:
+        kwargs["connection_factory"] = InstrumentedConnection
+
+    return BlockingConnectionPool(
+        minconn,
+        config["DB_POOL_MAX_SIZE"],
+        config["DB_POOL_TIMEOUT"],
+        **kwargs
+    )
+
+
+def get_pool():
+    """
+    Return this process's connection pool, creating it on first use.
+
+    The pool is created lazily and keyed on the process id so that every
+    gunicorn worker (forked after the app is imported) owns its own sockets.
+    """
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+
+            _pool = _new_pool(current_app.config["DB_POOL_MIN_SIZE"], **_connect_kwargs())
+            _pool_pid = pid
+
+    return _pool
+
+
+def get_replica_pools():
+    """
+    Return this process's pool slots for the DB_REPLICA_DSNS, one per DSN.
+
+    A slot stays None until the replica is first read from (see
+    _replica_pool), so a replica that is down when the worker starts does
+    not keep the app from serving from the primary.
+    """
+    global _replica_pools, _replica_pid
+
+    pid = os.getpid()
+    if _replica_pid == pid:
+        return _replica_pools
+
+    with _pool_lock:
+        if _replica_pid != pid:
+            _inherited_pools.extend(p for p in _replica_pools if p is not None)
+            _replica_pools = [None] * len(current_app.config["DB_REPLICA_DSNS"])
+            _replica_down.clear()
+            _replica_pid = pid
+
+    return _replica_pools
+
+
+def _replica_pool(i):
+    """
+    The pool of replica `i`, created on first use like the primary's.
+    Raises psycopg2.OperationalError when its first connections cannot be
+    opened; the next attempt creates it again.
+    """
+    pools = get_replica_pools()
+    if pools[i] is None:
+        with _pool_lock:
+            if pools[i] is None:
+                pools[i] = _new_pool(current_app.config["DB_POOL_MIN_SIZE"],
+                                     dsn=current_app.config["DB_REPLICA_DSNS"][i])
+    return pools[i]
+
+
+# -----------------------------
+# Read / write splitting
+# -----------------------------
+def _reads_from_replica():
+    """
+    GET and HEAD requests read from a replica, unless this session wrote
+    within DB_READ_YOUR_WRITES_WINDOW seconds and the mode is "pin". In
+    "lsn" mode the replica is used once it has replayed the session's last
+    write (see _replica_connection).
+    """
+    config = current_app.config
+    if not config["DB_REPLICA_DSNS"] or not has_request_context() \
+            or request.method not in ("GET", "HEAD"):
+        return False
+    return (config["DB_READ_YOUR_WRITES"] != "pin"
+            or session.get("db_primary_until", 0) <= time.time())
+
+
+def _caught_up(conn):
+    """
+    Wait up to DB_REPLICA_WAIT seconds for the replica to replay the WAL
+    position of this session's last write. A server that is not in recovery
+    (one instance posing as primary and replica) is always caught up.
+    """
+    config = current_app.config
+    lsn = session.get("db_write_lsn")
+    if config["DB_READ_YOUR_WRITES"] != "lsn" or not lsn \
+            or session.get("db_primary_until", 0) <= time.time():
+        return True
+
+    deadline = time.monotonic() + config["DB_REPLICA_WAIT"]
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        while True:
+            cur.execute("""
+                SELECT pg_last_wal_replay_lsn() IS NULL
+                    OR pg_last_wal_replay_lsn() >= %s::pg_lsn
+            """, (lsn,))
+            if cur.fetchone()[0]:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+    finally:
+        cur.close()
+
+
+def _replica_connection():
+    """
+    A read-only connection from a randomly chosen replica that is up and has
+    caught up with this session's writes, or (None, None) to use the primary.
+    A replica that refuses connections is skipped for DB_REPLICA_RETRY seconds.
+    """
+    config = current_app.config
+    pools = get_replica_pools()
+    now = time.monotonic()
+    candidates = [i for i in range(len(pools)) if _replica_down.get(i, 0) <= now]
+    random.shuffle(candidates)
+
+    for i in candidates:
+        try:
+            replica = _replica_pool(i)
+            conn = replica.getconn()
+        except psycopg2.OperationalError:
+            _replica_down[i] = now + config["DB_REPLICA_RETRY"]
+            continue
+        except pool.PoolError:
+            # saturated, not down: this request reads from the next one or
+            # from the primary
+            continue
+
+        try:
+            if not conn.readonly:
+                conn.readonly = True
+            caught_up = _caught_up(conn)
+        except psycopg2.Error:
+            replica.putconn(conn, close=True)
+            _replica_down[i] = now + config["DB_REPLICA_RETRY"]
+            continue
+
+        if caught_up:
+            return conn, replica
+        conn.rollback()
+        replica.putconn(conn)
+        # one lagging replica means the others are likely behind too
+        break
+
+    return None, None
+
+
+def _remember_write(response):
+    """
+    After a request that used the primary with a writing method, pin this
+    session to the primary (or, in "lsn" mode, to replicas that have
+    replayed the write) for DB_READ_YOUR_WRITES_WINDOW seconds, so the
+    redirect after a POST shows the new data.
+    """
+    conn = g.get("db_conn")
+    if conn is None or g.get("db_replica") or request.method in ("GET", "HEAD", "OPTIONS"):
+        return response
+
+    config = current_app.config
+    if config["DB_READ_YOUR_WRITES"] == "off":
+        return response
+
+    session["db_primary_until"] = time.time() + config["DB_READ_YOUR_WRITES_WINDOW"]
+    if config["DB_READ_YOUR_WRITES"] == "lsn" and \
+            conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+        try:
+            cur.execute("SELECT pg_current_wal_lsn()::TEXT")
+            session["db_write_lsn"] = cur.fetchone()[0]
+        except psycopg2.Error:
+            # without a position the replicas are trusted once the window ends
+            session.pop("db_write_lsn", None)
+        finally:
+            cur.close()
+    return response
+
+
+def get_db_connection():
+    """
+    Return the database connection for the current request.
+
+    Inside a Flask app context one connection is borrowed from the pool on
+    first use and handed back by release_db_connection() at teardown, so
+    callers must not close it. GET / HEAD requests borrow it from a read
+    replica when DB_REPLICA_DSNS is set (see _reads_from_replica). Outside
+    an app context a standalone connection is opened and the caller owns it.
+    """
+
+    if not has_app_context():
+        conn = psycopg2.connect(**_connect_kwargs())
+        conn.cursor_factory = psycopg2.extras.DictCursor
+        return conn
+
+    if "db_conn" not in g:
+        start = time.perf_counter()
+        conn = source = None
+        if _reads_from_replica():
+            conn, source = _replica_connection()
+        if conn is None:
+            source = get_pool()
+            conn = source.getconn()
+        record_checkout(time.perf_counter() - start)
+        conn.cursor_factory = psycopg2.extras.DictCursor
+        g.db_conn = conn
+        g.db_pool = source
+        g.db_replica = source is not get_pool()
+
+    return g.db_conn
+
+
+@contextmanager
+def single_statement(conn):
+    """
+    Run a write that is one statement in autocommit mode, so that statement
+    is its own transaction: one round trip instead of BEGIN, statement and
+    COMMIT, and its row locks are released as soon as it finishes. If the
+    request already has a transaction open nothing changes and the caller's
+    commit() applies; otherwise commit() / rollback() are no-ops.
+    """
+
+    idle = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    if idle:
+        conn.autocommit = True
+    try:
+        yield conn
+    finally:
+        if idle:
+            conn.autocommit = False
+
+
+def release_db_connection(exc=None):
+    """Teardown hook: roll back anything left open and return the connection."""
+
+    conn = g.pop("db_conn", None)
+    source = g.pop("db_pool", None)
+    g.pop("db_replica", None)
+    if conn is None:
+        return
+
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            broken = True
+
+    source.putconn(conn, close=broken)
+
+
+def init_db(app):
+    app.teardown_appcontext(release_db_connection)
+    if app.config["DB_REPLICA_DSNS"]:
+        app.after_request(_remember_write)
@@ -0,0 +1,134 @@
+import base64
+import binascii
+import json
+
+from flask import request, url_for
+
+from .prepared import execute_prepared
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# integer seek keys are INTEGER (SERIAL) columns; a prepared statement types
+# its parameter from the column, so a larger value would fail to bind
+_INT_RANGE = range(-2 ** 31, 2 ** 31)
+
+
+class KeysetPage:
+    """One page of rows plus the links to the neighbouring pages."""
+
+    def __init__(self, items, next_url=None, prev_url=None, page_size=DEFAULT_PAGE_SIZE):
+        self.items = items
+        self.next_url = next_url
+        self.prev_url = prev_url
+        self.page_size = page_size
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, types):
+    """
+    Decode a cursor produced by encode_cursor(). Tokens that do not hold
+    exactly one value of each of `types` (int or str, the seek key's
+    column types) are ignored, so a crafted ?after= cannot reach the query.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    for value, kind in zip(values, types):
+        if kind is int:
+            valid = type(value) is int and value in _INT_RANGE
+        else:
+            valid = type(value) is str and "\x00" not in value
+        if not valid:
+            return None
+    return values
+
+
+def page_size_arg():
+    size = request.args.get("per_page", DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+def _page_url(**cursor):
+    args = request.args.to_dict()
+    args.pop("after", None)
+    args.pop("before", None)
+    args.update(cursor)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def fetch_keyset_page(cur, base_sql, conditions, params, key_exprs, key_fields, key_types,
+                      prepare=None):
+    """
+    Run `base_sql` (a SELECT ... FROM ... without WHERE/ORDER BY) as a
+    keyset-paginated query.
+
+    key_exprs are the SQL expressions of the (unique) seek key, key_fields
+    the names of the same values in the result rows and key_types their
+    Python types (int or str). The page position comes
+    from the opaque ?after= / ?before= cursor and the size from ?per_page=.
+    Only page_size + 1 rows are read, whatever the table size. With
+    `prepare` (a statement label) the query runs as a prepared statement,
+    one per combination of filters and page direction.
+    """
+    page_size = page_size_arg()
+    width = len(key_exprs)
+    after = decode_cursor(request.args.get("after"), key_types)
+    before = None if after else decode_cursor(request.args.get("before"), key_types)
+
+    conditions = list(conditions)
+    params = list(params)
+    key_row = "(" + ", ".join(key_exprs) + ")"
+    placeholders = "(" + ", ".join(["%s"] * width) + ")"
+
+    if after:
+        conditions.append(f"{key_row} > {placeholders}")
+        params.extend(after)
+    elif before:
+        conditions.append(f"{key_row} < {placeholders}")
+        params.extend(before)
+
+    direction = "DESC" if before else "ASC"
+
+    sql = base_sql
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(f"{e} {direction}" for e in key_exprs)
+    sql += " LIMIT %s"
+    params.append(page_size + 1)
+
+    if prepare:
+        execute_prepared(cur, prepare, sql, params)
+    else:
+        cur.execute(sql, params)
+    rows = cur.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+
+    next_url = prev_url = None
+    if rows:
+        if before or has_more:
+            next_url = _page_url(after=encode_cursor(rows[-1][f] for f in key_fields))
+        if after or (before and has_more):
+            prev_url = _page_url(before=encode_cursor(rows[0][f] for f in key_fields))
+
+    return KeysetPage(rows, next_url=next_url, prev_url=prev_url, page_size=page_size)
@@ -0,0 +1,151 @@
+from datetime import date
+
+import psycopg2.extensions
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+# (term, start month/day, end month/day), in calendar order
+TERMS = [("Spring", (1, 15), (5, 15)), ("Fall", (9, 1), (12, 20))]
+
+
+class PartitionError(Exception):
+    pass
+
+
+def partitions(cur):
+    """
+    Every partition of enrollments and enrollments_archive with its
+    semester, oldest term first. `rows` is the planner's estimate.
+    """
+    cur.execute("""
+        SELECT c.relname AS name,
+               p.relname AS parent,
+               i.inhdetachpending AS detach_pending,
+               GREATEST(c.reltuples, 0)::BIGINT AS rows,
+               pg_total_relation_size(c.oid) AS bytes,
+               sm.semester_id, sm.term, sm.year, sm.start_date, sm.end_date,
+               sm.semester_id IN (SELECT semester_id FROM open_semesters) AS is_open
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        LEFT JOIN semesters sm
+               ON sm.semester_id = substring(pg_get_expr(c.relpartbound, c.oid)
+                                             FROM '\\((\\d+)\\)')::INTEGER
+        WHERE p.relname IN ('enrollments', 'enrollments_archive')
+          AND p.relnamespace = c.relnamespace
+        ORDER BY sm.start_date NULLS FIRST, c.relname
+    """)
+    return cur.fetchall()
+
+
+def next_terms(after, count):
+    """The `count` calendar terms (term, year, start, end) starting after the date `after`."""
+    terms, year = [], after.year
+    while len(terms) < count:
+        for term, (sm, sd), (em, ed) in TERMS:
+            start = date(year, sm, sd)
+            if start > after and len(terms) < count:
+                terms.append((term, year, start, date(year, em, ed)))
+        year += 1
+    return terms
+
+
+def create_partitions(cur, add_terms=0):
+    """
+    Make sure every semester has a partition. Semesters are only created
+    with `add_terms`: then that many terms starting after today must exist,
+    and the missing ones are added from TERMS after the latest semester.
+    Returns the names of the partitions created.
+    """
+    existing = {p["name"] for p in partitions(cur)}
+
+    cur.execute("""
+        SELECT COUNT(*) FILTER (WHERE start_date > CURRENT_DATE) AS upcoming,
+               MAX(start_date) AS latest
+        FROM semesters
+    """)
+    state = cur.fetchone()
+    missing = add_terms - state["upcoming"]
+    if missing > 0:
+        latest = max(state["latest"] or date.today(), date.today())
+        for term, year, start, end in next_terms(latest, missing):
+            # the semesters trigger creates the new term's partition
+            cur.execute("""
+                INSERT INTO semesters (term, year, start_date, end_date)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (term, year) DO NOTHING
+            """, (term, year, start, end))
+
+    cur.execute("""
+        SELECT create_enrollment_partition(semester_id) AS name
+        FROM semesters
+        ORDER BY start_date
+    """)
+    return [r["name"] for r in cur.fetchall() if r["name"] not in existing]
+
+
+def archivable(cur, keep):
+    """Live partitions of terms that have ended, oldest first, except the `keep` latest."""
+    closed = [p for p in partitions(cur)
+              if p["parent"] == "enrollments" and p["semester_id"] is not None
+              and not p["is_open"] and p["end_date"] < date.today()]
+    return closed[:max(len(closed) - keep, 0)]
+
+
+def archive_partition(conn, partition):
+    """
+    Move one closed term's partition from enrollments to enrollments_archive.
+
+    `conn` must be in autocommit mode (migrations.connect()): DETACH
+    PARTITION CONCURRENTLY cannot run in a transaction. It waits for
+    queries that use the partition instead of blocking enrollments, and
+    leaves a CHECK constraint behind that lets the ATTACH skip its
+    validation scan. A detach that was interrupted is finalized. Terms with
+    'Enrolled' rows are refused: their seats are still counted in
+    course_offerings.enrolled_count. Archived rows keep counting towards
+    GPA (see enrollment_history).
+    """
+    name = sql.Identifier(partition["name"])
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        if partition["parent"] == "enrollments":
+            cur.execute(sql.SQL("SELECT COUNT(*) AS n FROM {} WHERE status = 'Enrolled'")
+                        .format(name))
+            enrolled = cur.fetchone()["n"]
+            if enrolled:
+                raise PartitionError(
+                    f"{partition['name']}: {enrolled} enrollment(s) still 'Enrolled'; "
+                    "complete or withdraw them first")
+
+            mode = "FINALIZE" if partition["detach_pending"] else "CONCURRENTLY"
+            cur.execute(sql.SQL("ALTER TABLE enrollments DETACH PARTITION {} " + mode)
+                        .format(name))
+
+        # attaching and invalidating the cached pages commit together
+        conn.autocommit = False
+        cur.execute(sql.SQL("ALTER TABLE enrollments_archive ATTACH PARTITION {} FOR VALUES IN ({})")
+                    .format(name, sql.Literal(partition["semester_id"])))
+        cur.execute("""
+            UPDATE table_versions
+            SET version = version + 1, updated_at = clock_timestamp()
+            WHERE table_name = 'enrollments' AND shard = 0
+        """)
+        cur.execute(sql.SQL("""
+            INSERT INTO entity_versions (entity, entity_id, version, updated_at)
+            SELECT entity, id, 1, clock_timestamp()
+            FROM (SELECT 'student' AS entity, student_id AS id FROM {0}
+                  UNION
+                  SELECT 'course', course_id FROM {0}) r
+            ORDER BY 1, 2
+            ON CONFLICT (entity, entity_id) DO UPDATE
+            SET version = entity_versions.version + 1,
+                updated_at = EXCLUDED.updated_at
+        """).format(name))
+        conn.commit()
+    except Exception:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+        cur.close()
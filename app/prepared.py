@@ -0,0 +1,139 @@
+import hashlib
+import re
+import threading
+import weakref
+
+import psycopg2.errors
+from flask import current_app, has_app_context
+
+# psycopg2 placeholders; %% is a literal percent sign
+_PLACEHOLDER = re.compile(r"%%|%s")
+_NAME = re.compile(r"^[a-z][a-z0-9_]*$")
+
+# connection -> names of the statements PREPAREd in its session. Prepared
+# statements live as long as the server session, so a connection the pool
+# replaces (after a reconnect) starts with an empty set and the entry goes
+# away with the connection object.
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+_stats = {"prepares": 0, "executes": 0, "reprepares": 0, "unprepared": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def prepared_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _prepared_lock:
+        stats["connections"] = len(_prepared)
+        stats["statements"] = sum(len(names) for names in _prepared.values())
+    return stats
+
+
+def _settings():
+    if has_app_context():
+        config = current_app.config
+        return config["PREPARED_STATEMENTS"], config["PREPARED_STATEMENTS_MAX"]
+    return True, 200
+
+
+def _statements(conn):
+    with _prepared_lock:
+        names = _prepared.get(conn)
+        if names is None:
+            names = _prepared[conn] = set()
+        return names
+
+
+def statement_name(label, sql):
+    """
+    `label` plus a hash of the SQL text, so a query whose text changes (a new
+    deploy, or a keyset page with other filters) gets its own statement.
+    """
+    if not _NAME.match(label):
+        raise ValueError(f"invalid prepared statement label: {label!r}")
+    return f"{label}_{hashlib.sha1(sql.encode()).hexdigest()[:10]}"
+
+
+def _numbered(sql):
+    """Rewrite %s placeholders as $1, $2, ... for PREPARE; returns (sql, count)."""
+    count = 0
+
+    def number(match):
+        nonlocal count
+        if match.group() == "%%":
+            return "%%"  # still goes through psycopg2's interpolation
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER.sub(number, sql), count
+
+
+def execute_prepared(cur, label, sql, params=()):
+    """
+    Run `sql` (with psycopg2 %s placeholders) as a named prepared statement.
+
+    The first call on a connection sends PREPARE and EXECUTE together, in
+    the one round trip the plain statement would have taken; later calls
+    send only EXECUTE, so Postgres skips parsing and, once it settles on a
+    generic plan (after five executions), planning as well.
+
+    A statement that has disappeared from the session (DISCARD ALL, a
+    restarted pooler) or whose result type changed after an ALTER is
+    prepared again. The EXECUTE is sent as is, without a savepoint, also
+    inside an open transaction (the @conditional routes have already
+    looked up versions on the connection): a failure rolls that
+    transaction back before the statement is prepared again. This is
+    only used for reads, so nothing but the snapshot of the earlier
+    statements is lost, and those ran at READ COMMITTED anyway.
+    """
+    enabled, limit = _settings()
+    if not enabled:
+        return cur.execute(sql, params)
+
+    if isinstance(params, dict):
+        raise ValueError("prepared statements take positional parameters")
+
+    conn = cur.connection
+    name = statement_name(label, sql)
+    names = _statements(conn)
+    body, count = _numbered(sql)
+    if len(params) != count:
+        raise ValueError(f"{label}: expected {count} parameters, got {len(params)}")
+    execute = f"EXECUTE {name}" + (f"({', '.join(['%s'] * count)})" if count else "")
+
+    if name in names:
+        try:
+            result = cur.execute(execute, params)
+            _count("executes")
+            return result
+        except psycopg2.errors.InvalidSqlStatementName:
+            names.discard(name)
+            prefix = ""
+        except psycopg2.errors.FeatureNotSupported as e:
+            # "cached plan must not change result type": still prepared, so
+            # it is deallocated first
+            if "cached plan" not in str(e):
+                raise
+            prefix = f"DEALLOCATE {name}; "
+
+        conn.rollback()
+        _count("reprepares")
+    elif len(names) >= limit:
+        _count("unprepared")
+        return cur.execute(sql, params)
+    else:
+        prefix = ""
+
+    # recorded before running: PREPARE is not transactional, so the
+    # statement exists even if the EXECUTE part fails
+    names.add(name)
+    result = cur.execute(f"{prefix}PREPARE {name} AS {body}; {execute}", params)
+    _count("prepares")
+    return result
+
@@ -0,0 +1,345 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import date, datetime
+
+import psycopg2
+from flask import Blueprint, abort, current_app, jsonify, make_response, render_template, request
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from . import whatif
+from .cache import get_departments, get_semesters
+from .models import _connect_kwargs, get_db_connection
+
+log = logging.getLogger(__name__)
+
+reports = Blueprint("reports", __name__, url_prefix="/reports")
+
+# the materialized views of db/migrations/0008, in refresh order
+VIEWS = ("report_course_fill", "report_grade_distribution", "report_department_gpa")
+
+# one refresh at a time across workers and `flask reports refresh`
+_REFRESH_LOCK = "SELECT pg_try_advisory_lock(hashtext('report_refreshes'))"
+_REFRESH_UNLOCK = "SELECT pg_advisory_unlock(hashtext('report_refreshes'))"
+
+# slug -> view, title, row order and Cache-Control max-age (seconds). Fill
+# rates move with every registration; grade and GPA summaries only when
+# grades are posted.
+REPORTS = {
+    "fill-rates": dict(view="report_course_fill", title="Course Fill Rates",
+                       order="fill_rate DESC, course_code", max_age=300),
+    "grades": dict(view="report_grade_distribution", title="Grade Distributions",
+                   order="course_code, points DESC NULLS LAST, grade", max_age=3600),
+    "department-gpa": dict(view="report_department_gpa", title="Department GPA",
+                           order="department_name, enrollment_year DESC", max_age=3600),
+}
+
+
+# -----------------------------
+# Refreshing
+# -----------------------------
+def connect():
+    """A dedicated autocommit connection: each view refreshes in its own transaction."""
+    conn = psycopg2.connect(**_connect_kwargs())
+    conn.autocommit = True
+    return conn
+
+
+def refresh_reports(conn, views=VIEWS, older_than=None):
+    """
+    REFRESH MATERIALIZED VIEW CONCURRENTLY each of `views` (readers keep
+    seeing the old contents meanwhile) and record it in report_refreshes.
+
+    With `older_than` (seconds) only views refreshed longer ago than that
+    are refreshed. Returns [(view, rows, ms)], or None when another
+    refresh holds the lock.
+    """
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(_REFRESH_LOCK + " AS locked")
+    if not cur.fetchone()["locked"]:
+        cur.close()
+        return None
+
+    done = []
+    try:
+        if older_than is not None:
+            cur.execute("""
+                SELECT view_name FROM report_refreshes
+                WHERE refreshed_at > NOW() - make_interval(secs => %s)
+            """, (older_than,))
+            fresh = {r["view_name"] for r in cur.fetchall()}
+            views = [v for v in views if v not in fresh]
+
+        for view in views:
+            start = time.perf_counter()
+            cur.execute(sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}")
+                        .format(sql.Identifier(view)))
+            ms = int((time.perf_counter() - start) * 1000)
+            cur.execute(sql.SQL("""
+                INSERT INTO report_refreshes (view_name, refreshed_at, duration_ms, row_count)
+                SELECT %s, NOW(), %s, COUNT(*) FROM {}
+                ON CONFLICT (view_name) DO UPDATE
+                SET refreshed_at = EXCLUDED.refreshed_at,
+                    duration_ms = EXCLUDED.duration_ms,
+                    row_count = EXCLUDED.row_count
+                RETURNING row_count
+            """).format(sql.Identifier(view)), (view, ms))
+            done.append((view, cur.fetchone()["row_count"], ms))
+    finally:
+        cur.execute(_REFRESH_UNLOCK)
+        cur.close()
+    return done
+
+
+class ReportRefresher(threading.Thread):
+    """
+    Background thread that refreshes the report views `delay` seconds
+    after grades were posted (later postings within the delay are folded
+    into the same refresh) and, with an `interval`, whenever a view is
+    older than that. Every worker runs one; the advisory lock and the
+    age check keep them from refreshing the same data twice.
+    """
+
+    def __init__(self, delay, interval):
+        super().__init__(name="report-refresher", daemon=True)
+        self.delay = delay
+        self.interval = interval or None
+
+        self.refreshes = 0
+        self.last_refresh = None
+        self.last_error = None
+        self._requested = threading.Event()
+        self._stopping = threading.Event()
+
+    def request(self):
+        self._requested.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._requested.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            requested = self._requested.wait(self.interval)
+            if self._stopping.is_set():
+                break
+            if requested:
+                if self._stopping.wait(self.delay):
+                    break
+                self._requested.clear()
+            if self._refresh(None if requested else self.interval) is None and requested:
+                # another worker is refreshing and may have started before
+                # these grades were committed: go again after the delay
+                self._requested.set()
+
+    def _refresh(self, older_than):
+        """refresh_reports() on a fresh connection; [] after an error."""
+        try:
+            conn = connect()
+        except psycopg2.Error as e:
+            self.last_error = str(e).strip()
+            log.warning("report refresh could not connect: %s", self.last_error)
+            return []
+        try:
+            done = refresh_reports(conn, older_than=older_than)
+            if done:
+                self.refreshes += 1
+                self.last_refresh = time.time()
+                log.info("refreshed %s", ", ".join(f"{v} ({ms} ms)" for v, _, ms in done))
+            return done
+        except psycopg2.Error as e:
+            self.last_error = str(e).strip()
+            log.warning("report refresh failed: %s", self.last_error)
+            return []
+        finally:
+            conn.close()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start_refresher(config):
+    """
+    Start this process's refresher unless it is already running. Threads
+    do not survive fork(), so a gunicorn worker forked from a --preload
+    master starts its own.
+    """
+    global _refresher
+
+    if _refresher is not None and _refresher.is_alive():
+        return _refresher
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = ReportRefresher(config["REPORTS_REFRESH_DELAY"],
+                                         config["REPORTS_REFRESH_INTERVAL"])
+            _refresher.start()
+    return _refresher
+
+
+def _serving():
+    start_refresher(current_app.config)
+
+
+def init_reports(app):
+    """
+    Register the reports blueprint. The refresher is started by the first
+    request a process serves, not here, so CLI commands, tests and the
+    master of a --preload server never run one.
+    """
+    app.register_blueprint(reports)
+    if app.config["REPORTS_REFRESH_AFTER_GRADES"] or app.config["REPORTS_REFRESH_INTERVAL"] > 0:
+        app.before_request(_serving)
+
+
+def request_refresh():
+    """Called after grades are posted; a no-op unless REPORTS_REFRESH_AFTER_GRADES is on."""
+    if _refresher is not None and current_app.config["REPORTS_REFRESH_AFTER_GRADES"]:
+        _refresher.request()
+
+
+# -----------------------------
+# Serving
+# -----------------------------
+def _refreshed(cur):
+    cur.execute("SELECT view_name, refreshed_at, duration_ms, row_count FROM report_refreshes")
+    return {r["view_name"]: r for r in cur.fetchall()}
+
+
+def _cached(report, refreshed_at, variant, render):
+    """
+    Answer with 304 while the view has not been refreshed since the
+    client's copy, otherwise render. Clients may reuse a report for its
+    max-age without asking at all.
+    """
+    etag = hashlib.sha1(
+        f"{current_app.config['ETAG_SALT']}|{request.full_path}|{variant}|"
+        f"{_wants_json()}|{refreshed_at}".encode()).hexdigest()
+
+    if "If-None-Match" in request.headers:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = bool(since and refreshed_at.replace(microsecond=0) <= since)
+
+    response = (current_app.response_class(status=304) if not_modified
+                else make_response(render()))
+    response.set_etag(etag)
+    response.last_modified = refreshed_at
+    response.headers["Cache-Control"] = f"private, max-age={report['max_age']}"
+    response.vary.add("Accept")
+    return response
+
+
+def _wants_json():
+    return request.args.get("format") == "json" or \
+        request.accept_mimetypes.best == "application/json"
+
+
+@reports.route("/")
+def report_index():
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    refreshed = _refreshed(cur)
+    cur.close()
+
+    return render_template("reports/index.html", reports=REPORTS, refreshed=refreshed)
+
+
+@reports.route("/what-if")
+def what_if():
+    """What-if GPA scenarios over the in-process GradeBook (app/whatif.py)."""
+    args = request.args
+    status = args.get("status", "Active")
+    form = {
+        "department_id": args.get("department_id", type=int),
+        "enrollment_year": args.get("enrollment_year", type=int),
+        "status": status if status in whatif.STATUSES else None,
+        "semester_id": args.get("semester_id", type=int),
+        "pending": args.get("pending") or "current",
+        "threshold": args.get("threshold", 2.0, type=float),
+        "course_id": args.get("course_id", type=int),
+        "course_grade": args.get("course_grade") or None,
+    }
+
+    result, error = None, None
+    book = whatif.get_gradebook()
+    try:
+        # also rejects inf and nan, which float() accepts
+        if not 0 <= form["threshold"] <= 4:
+            raise ValueError("threshold must be a GPA between 0 and 4")
+        overrides = ({form["course_id"]: form["course_grade"]}
+                     if form["course_id"] and form["course_grade"] else None)
+        start = time.perf_counter()
+        result = book.what_if(
+            book.cohort(form["department_id"], form["enrollment_year"], form["status"]),
+            threshold=form["threshold"], pending=form["pending"],
+            semester_id=form["semester_id"], overrides=overrides)
+        result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["loaded_at"] = datetime.fromtimestamp(book.loaded_at).isoformat(timespec="seconds")
+    except ValueError as e:
+        error = str(e)
+
+    if _wants_json():
+        if error:
+            return jsonify(error=error), 400
+        return jsonify(dict(result, enrollments=len(book), scenario=form))
+
+    return render_template("reports/what-if.html", form=form, result=result, error=error,
+                           enrollments=len(book), departments=get_departments(),
+                           semesters=get_semesters())
+
+
+@reports.route("/<slug>")
+def show_report(slug):
+    report = REPORTS.get(slug)
+    if report is None:
+        abort(404)
+
+    department_id = request.args.get("department_id", type=int)
+    semester_id = request.args.get("semester_id", type=int)
+
+    # fill rates are shown one term at a time (the latest that has started)
+    # and grade histograms one department at a time, to keep pages small
+    if slug == "fill-rates" and not semester_id:
+        started = [sm for sm in get_semesters() if sm["start_date"] <= date.today()]
+        semester_id = started[0]["semester_id"] if started else None
+    if slug == "grades" and not department_id and get_departments():
+        department_id = get_departments()[0]["department_id"]
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    refreshed = _refreshed(cur).get(report["view"])
+    cur.close()
+    if refreshed is None:
+        abort(404)
+
+    def render():
+        conditions, params = [], []
+        if department_id:
+            conditions.append("department_id = %s")
+            params.append(department_id)
+        if semester_id and slug == "fill-rates":
+            conditions.append("semester_id = %s")
+            params.append(semester_id)
+
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(sql.SQL("SELECT * FROM {} " +
+                            ("WHERE " + " AND ".join(conditions) if conditions else "") +
+                            " ORDER BY " + report["order"])
+                    .format(sql.Identifier(report["view"])), params)
+        rows = cur.fetchall()
+        cur.close()
+
+        if _wants_json():
+            return jsonify(report=slug, refreshed_at=refreshed["refreshed_at"].isoformat(),
+                           department_id=department_id, semester_id=semester_id, rows=rows)
+        return render_template(f"reports/{slug}.html", report=report, rows=rows,
+                               refreshed=refreshed, departments=get_departments(),
+                               semesters=get_semesters(), department_id=department_id,
+                               semester_id=semester_id)
+
+    # the defaults above are part of what the page shows
+    return _cached(report, refreshed["refreshed_at"], (department_id, semester_id), render)
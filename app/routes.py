@@ -1,8 +1,19 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from .models import get_db_connection
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from . import bulk
+from .models import get_db_connection, single_statement
+from .cache import get_departments, get_instructors, get_semesters, invalidate, reference_cache
+from .conditional import conditional
+from .exports import stream_export
+from .invalidation import listener_stats
+from .pagination import fetch_keyset_page
+from .prepared import execute_prepared, prepared_stats
+from .reports import request_refresh
+from .search import SEARCHES, DEFAULT_LIMIT, MAX_LIMIT, normalize_query, search
+from .slowlog import top_offenders
 from datetime import datetime
 from psycopg2.extras import RealDictCursor
 import psycopg2.extras
+import csv
 
 main = Blueprint("main", __name__)
 
@@ -12,35 +23,48 @@ main = Blueprint("main", __name__)
 # -----------------------------
 @main.route("/")
 def index():
+    department_id = request.args.get("department_id", type=int)
+    status = request.args.get("status") or None
+
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cur.execute("""
+    conditions, params = [], []
+    if department_id:
+        conditions.append("s.department_id = %s")
+        params.append(department_id)
+    if status:
+        conditions.append("s.status = %s")
+        params.append(status)
+
+    # one page, seeking on student_id
+    students = fetch_keyset_page(cur, """
         SELECT s.student_id, s.first_name, s.last_name, s.email,
                d.department_name, s.status
         FROM students s
         JOIN departments d ON s.department_id = d.department_id
-        ORDER BY s.student_id
-    """)
-    students = cur.fetchall()
+    """, conditions, params, ["s.student_id"], ["student_id"], [int])
+
+    departments = get_departments()
 
     cur.close()
-    conn.close()
 
-    return render_template("index.html", students=students)
+    return render_template("index.html", students=students, departments=departments,
+                           department_id=department_id, status=status)
 
 
 # -----------------------------
 # Student Detail
 # -----------------------------
 @main.route("/students/<int:student_id>")
+@conditional("departments", "courses", "semesters", entity=("student", "student_id"))
 def student_detail(student_id):
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     # student info
-    cur.execute("""
+    execute_prepared(cur, "student_detail", """
         SELECT s.student_id, s.first_name, s.last_name, s.email,
                s.enrollment_year, s.gpa, s.status,
                d.department_name
@@ -55,7 +79,7 @@ def student_detail(student_id):
         return redirect(url_for("main.index"))
 
     # enrollments
-    cur.execute("""
+    execute_prepared(cur, "student_enrollments", """
         SELECT 
             e.enrollment_id,
             c.course_code,
@@ -73,7 +97,6 @@ def student_detail(student_id):
     enrollments = cur.fetchall()
 
     cur.close()
-    conn.close()
 
     return render_template("student_detail.html", student=student, enrollments=enrollments)
 
@@ -98,34 +121,29 @@ def add_student():
             return redirect(url_for("main.add_student"))
 
         # -----------------------------
-        # Email duplication check
+        # Insert new student; a used email inserts nothing
         # -----------------------------
-        cur.execute(
-            "SELECT student_id FROM students WHERE email = %s", (email,))
-        existing_email = cur.fetchone()
+        with single_statement(conn):
+            cur.execute("""
+                INSERT INTO students (first_name, last_name, email, department_id, enrollment_year, status)
+                VALUES (%s, %s, %s, %s, %s, 'Active')
+                ON CONFLICT (email) DO NOTHING
+                RETURNING student_id
+            """, (first, last, email, dept, year))
+            inserted = cur.fetchone()
+            conn.commit()
 
-        if existing_email:
+        if not inserted:
             flash("Error: This email is already used by another student.", "danger")
             return redirect(url_for("main.add_student"))
 
-        # -----------------------------
-        # Insert new student
-        # -----------------------------
-        cur.execute("""
-            INSERT INTO students (first_name, last_name, email, department_id, enrollment_year, status)
-            VALUES (%s, %s, %s, %s, %s, 'Active')
-        """, (first, last, email, dept, year))
-
-        conn.commit()
         flash("Student added successfully!", "success")
         return redirect(url_for("main.index"))
 
     # Load departments
-    cur.execute("SELECT department_id, department_name FROM departments")
-    departments = cur.fetchall()
+    departments = get_departments()
 
     cur.close()
-    conn.close()
 
     return render_template("student_add.html", departments=departments)
 
@@ -195,11 +213,9 @@ def edit_student(student_id):
     """, (student_id,))
     student = cur.fetchone()
 
-    cur.execute("SELECT department_id, department_name FROM departments")
-    departments = cur.fetchall()
+    departments = get_departments()
 
     cur.close()
-    conn.close()
 
     return render_template(
         "student_edit.html",
@@ -226,26 +242,36 @@ def delete_student(student_id):
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     try:
-        # 1. Mark student Inactive
-        cur.execute("""
-            UPDATE students
-            SET status='Inactive'
-            WHERE student_id=%s
-        """, (student_id,))
-
-        # 2. Change ENROLLED → DROPPED_INACTIVE
-        cur.execute("""
-            UPDATE enrollments
-            SET status='Dropped_Inactive'
-            WHERE student_id=%s
-              AND status='Enrolled'
-        """, (student_id,))
-
-        # 3. No need to update courses table.
-        # SELECT COUNT(*) WHERE status='Enrolled' will now decrease automatically!
+        # One statement: mark the student Inactive and change ENROLLED →
+        # DROPPED_INACTIVE. No need to update courses table:
+        # trg_enrolled_count_update decrements course_offerings.enrolled_count for us.
+        with single_statement(conn):
+            cur.execute("""
+                WITH student AS (
+                    UPDATE students
+                    SET status='Inactive'
+                    WHERE student_id=%s
+                    RETURNING student_id
+                ),
+                dropped AS (
+                    UPDATE enrollments e
+                    SET status='Dropped_Inactive'
+                    FROM student s
+                    WHERE e.student_id = s.student_id
+                      AND e.status='Enrolled'
+                    RETURNING e.enrollment_id
+                )
+                SELECT (SELECT COUNT(*) FROM student) AS students,
+                       (SELECT COUNT(*) FROM dropped) AS dropped
+            """, (student_id,))
+            result = cur.fetchone()
+            conn.commit()
 
-        conn.commit()
-        flash("Student set to Inactive. Enrollments marked Dropped_Inactive.", "success")
+        if result["students"]:
+            flash(f"Student set to Inactive. {result['dropped']} enrollment(s) "
+                  "marked Dropped_Inactive.", "success")
+        else:
+            flash("Student not found.", "danger")
 
     except Exception as e:
         conn.rollback()
@@ -253,7 +279,6 @@ def delete_student(student_id):
 
     finally:
         cur.close()
-        conn.close()
 
     return redirect(url_for("main.index"))
 
@@ -266,62 +291,65 @@ def delete_student(student_id):
 # Course List (Active / All)
 # -----------------------------
 @main.route("/courses")
+@conditional("courses", "course_offerings", "departments", "semesters")
 def course_list():
 
     # use 'view' instead of 'mode'
     view = request.args.get("view", "active")
+    department_id = request.args.get("department_id", type=int)
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    if view == "all":
-        cur.execute("""
-            SELECT c.*,
-                (SELECT COUNT(*) FROM enrollments e 
-                    WHERE e.course_id = c.course_id AND e.status='Enrolled')
-                AS enrolled_count
-            FROM courses c
-            ORDER BY c.course_code
-        """)
-    else:
-        cur.execute("""
-            SELECT c.*,
-                (SELECT COUNT(*) FROM enrollments e 
-                    WHERE e.course_id = c.course_id AND e.status='Enrolled')
-                AS enrolled_count
-            FROM courses c
-            WHERE c.status = 'Active'
-            ORDER BY c.course_code
-        """)
-
-    courses = cur.fetchall()
+    conditions, params = [], []
+    if view != "all":
+        conditions.append("c.status = 'Active'")
+    if department_id:
+        conditions.append("c.department_id = %s")
+        params.append(department_id)
+
+    # one page, seeking on course_code; seats are summed over the open terms
+    courses = fetch_keyset_page(cur, """
+        SELECT c.course_id, c.course_code, c.course_name, c.credits, c.status,
+               COALESCE(t.enrolled_count, 0) AS enrolled_count,
+               COALESCE(t.capacity, c.capacity) AS capacity
+        FROM courses c
+        LEFT JOIN LATERAL (
+            SELECT SUM(o.enrolled_count) AS enrolled_count,
+                   SUM(o.capacity) AS capacity
+            FROM course_offerings o
+            JOIN open_semesters os ON os.semester_id = o.semester_id
+            WHERE o.course_id = c.course_id
+        ) t ON TRUE
+    """, conditions, params, ["c.course_code"], ["course_code"], [str],
+        prepare="course_list")
+
+    departments = get_departments()
 
     cur.close()
-    conn.close()
 
-    return render_template("courses.html", courses=courses, view=view)
+    return render_template("courses.html", courses=courses, view=view,
+                           departments=departments, department_id=department_id)
 
 
 # -----------------------------
 # Course Detail
 # -----------------------------
 @main.route("/courses/<int:course_id>")
+@conditional("departments", "instructors", "students", "semesters",
+             entity=("course", "course_id"))
 def course_detail(course_id):
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     # course info
-    cur.execute("""
+    execute_prepared(cur, "course_detail", """
         SELECT 
             c.course_id, c.course_code, c.course_name, 
             c.credits, c.level, c.capacity,
             d.department_name,
-            i.first_name || ' ' || i.last_name AS instructor_name,
-            (
-                SELECT COUNT(*) FROM enrollments e 
-                WHERE e.course_id = c.course_id AND e.status='Enrolled'
-            ) AS enrolled_count
+            i.first_name || ' ' || i.last_name AS instructor_name
         FROM courses c
         JOIN departments d ON c.department_id = d.department_id
         JOIN instructors i ON c.instructor_id = i.instructor_id
@@ -330,7 +358,7 @@ def course_detail(course_id):
     course = cur.fetchone()
 
     # enrolled students
-    cur.execute("""
+    execute_prepared(cur, "course_enrollments", """
         SELECT s.student_id, 
                s.first_name || ' ' || s.last_name AS student_name,
                e.status,
@@ -345,10 +373,95 @@ def course_detail(course_id):
     """, (course_id,))
     enrollments = cur.fetchall()
 
+    # per-term offerings with their own seat counts
+    execute_prepared(cur, "course_offerings", """
+        SELECT o.offering_id, o.semester_id, sm.term, sm.year,
+               o.capacity, o.enrolled_count,
+               i.first_name || ' ' || i.last_name AS instructor_name,
+               (os.semester_id IS NOT NULL) AS is_open
+        FROM course_offerings o
+        JOIN semesters sm ON o.semester_id = sm.semester_id
+        LEFT JOIN instructors i ON o.instructor_id = i.instructor_id
+        LEFT JOIN open_semesters os ON o.semester_id = os.semester_id
+        WHERE o.course_id=%s
+        ORDER BY sm.start_date DESC
+    """, (course_id,))
+    offerings = cur.fetchall()
+
+    # choices for the "offer in semester" form
+    semesters = get_semesters()
+    instructors = get_instructors(active_only=True)
+
     cur.close()
-    conn.close()
 
-    return render_template("course_detail.html", course=course, enrollments=enrollments)
+    return render_template("course_detail.html", course=course, enrollments=enrollments,
+                           offerings=offerings, semesters=semesters, instructors=instructors)
+
+
+# -----------------------------
+# Add / Update Course Offering
+# -----------------------------
+@main.route("/courses/<int:course_id>/offerings", methods=["POST"])
+def save_offering(course_id):
+    """
+    Offer a course in a semester, or change an existing offering's capacity
+    and instructor. Blank fields fall back to the course defaults.
+    """
+
+    semester_id = request.form["semester_id"]
+    capacity = request.form.get("capacity", type=int)
+    inst = request.form.get("instructor_id", type=int)
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    try:
+        # nothing is saved when the course or semester is missing or the
+        # capacity is below the enrolled count; the flags tell which
+        cur.execute("""
+            WITH course AS (
+                SELECT course_id, instructor_id, capacity FROM courses WHERE course_id = %s
+            ),
+            semester AS (
+                SELECT semester_id FROM semesters WHERE semester_id = %s
+            ),
+            saved AS (
+                INSERT INTO course_offerings (course_id, semester_id, instructor_id, capacity)
+                SELECT c.course_id, sm.semester_id,
+                       COALESCE(%s, c.instructor_id), COALESCE(%s, c.capacity)
+                FROM course c, semester sm
+                ON CONFLICT (course_id, semester_id) DO UPDATE
+                SET instructor_id = EXCLUDED.instructor_id,
+                    capacity = EXCLUDED.capacity
+                WHERE EXCLUDED.capacity >= course_offerings.enrolled_count
+                RETURNING offering_id
+            )
+            SELECT EXISTS (SELECT 1 FROM course) AS course,
+                   EXISTS (SELECT 1 FROM semester) AS semester,
+                   EXISTS (SELECT 1 FROM saved) AS saved
+        """, (course_id, semester_id, inst, capacity))
+        result = cur.fetchone()
+
+        conn.commit()
+        if not result["course"]:
+            flash("Course not found.", "danger")
+            return redirect(url_for("main.course_list"))
+        if not result["semester"]:
+            flash("Semester not found.", "danger")
+        elif result["saved"]:
+            flash("Course offering saved.", "success")
+        else:
+            flash("Capacity cannot be lower than the number of students already "
+                  "enrolled in that offering.", "danger")
+
+    except psycopg2.Error as e:
+        conn.rollback()
+        flash("Failed to save offering: " + str(e), "danger")
+
+    finally:
+        cur.close()
+
+    return redirect(url_for("main.course_detail", course_id=course_id))
 
 
 # -----------------------------
@@ -380,20 +493,12 @@ def add_course():
         return redirect(url_for("main.course_list"))
 
     # load departments
-    cur.execute("SELECT * FROM departments ORDER BY department_name")
-    departments = cur.fetchall()
+    departments = get_departments()
 
     # load instructors WITH full name
-    cur.execute("""
-        SELECT instructor_id,
-               first_name || ' ' || last_name AS instructor_name
-        FROM instructors
-        ORDER BY last_name
-    """)
-    instructors = cur.fetchall()
+    instructors = get_instructors()
 
     cur.close()
-    conn.close()
 
     return render_template("course_add.html", departments=departments, instructors=instructors)
 
@@ -432,15 +537,12 @@ def edit_course(course_id):
     course = cur.fetchone()
 
     # departments
-    cur.execute("SELECT * FROM departments ORDER BY department_name")
-    departments = cur.fetchall()
+    departments = get_departments()
 
     # instructors
-    cur.execute("SELECT instructor_id, first_name, last_name FROM instructors")
-    instructors = cur.fetchall()
+    instructors = get_instructors()
 
     cur.close()
-    conn.close()
 
     return render_template("course_edit.html", course=course, departments=departments, instructors=instructors)
 
@@ -455,14 +557,13 @@ def delete_course(course_id):
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     cur.execute("""
-        SELECT COUNT(*) AS cnt
-        FROM enrollments
-        WHERE course_id = %s AND status = 'Enrolled'
+        SELECT COALESCE(SUM(enrolled_count), 0) AS cnt
+        FROM course_offerings
+        WHERE course_id = %s
     """, (course_id,))
     count = cur.fetchone()["cnt"]
 
     cur.close()
-    conn.close()
 
     if count > 0:
         return redirect(url_for("main.confirm_course_delete",
@@ -498,23 +599,31 @@ def force_delete_course(course_id):
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cur.execute("""
-        UPDATE enrollments
-        SET status='Course_Cancelled', grade=NULL
-        WHERE course_id=%s AND status='Enrolled'
-    """, (course_id,))
-
-    cur.execute("""
-        UPDATE courses
-        SET status='Inactive'
-        WHERE course_id=%s
-    """, (course_id,))
+    # one statement: inactivate the course and cancel its active enrollments
+    with single_statement(conn):
+        cur.execute("""
+            WITH course AS (
+                UPDATE courses
+                SET status='Inactive'
+                WHERE course_id=%s
+                RETURNING course_id
+            ),
+            cancelled AS (
+                UPDATE enrollments e
+                SET status='Course_Cancelled', grade=NULL
+                FROM course c
+                WHERE e.course_id = c.course_id
+                  AND e.status='Enrolled'
+                RETURNING e.enrollment_id
+            )
+            SELECT (SELECT COUNT(*) FROM cancelled) AS cancelled
+        """, (course_id,))
+        cancelled = cur.fetchone()["cancelled"]
+        conn.commit()
 
-    conn.commit()
     cur.close()
-    conn.close()
 
-    flash("Course deleted. All enrolled students marked as Course_Cancelled.", "warning")
+    flash(f"Course deleted. {cancelled} enrolled student(s) marked as Course_Cancelled.", "warning")
     return redirect(url_for("main.course_list"))
 
 
@@ -530,41 +639,36 @@ def enroll_page(student_id):
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     # student
-    cur.execute("""
+    execute_prepared(cur, "enroll_student", """
         SELECT student_id, first_name, last_name 
         FROM students
         WHERE student_id=%s
     """, (student_id,))
     student = cur.fetchone()
 
-    # courses with enrolled count
-    cur.execute("""
+    # offerings in the open terms, with per-term seat counts
+    execute_prepared(cur, "enroll_offerings", """
         SELECT 
-            c.course_id,
+            o.offering_id,
+            o.semester_id,
+            os.term,
+            os.year,
             c.course_code,
             c.course_name,
             c.credits,
-            c.capacity,
-            (
-                SELECT COUNT(*) FROM enrollments e 
-                WHERE e.course_id = c.course_id AND e.status='Enrolled'
-            ) AS enrolled_count
-        FROM courses c
+            o.capacity,
+            o.enrolled_count
+        FROM open_semesters os
+        JOIN course_offerings o ON o.semester_id = os.semester_id
+        JOIN courses c ON o.course_id = c.course_id
         WHERE c.status='Active'
-        ORDER BY c.course_code
+        ORDER BY os.start_date DESC, c.course_code
     """)
-    courses = cur.fetchall()
-
-    # semesters
-    cur.execute(
-        "SELECT semester_id, term, year FROM semesters ORDER BY year DESC")
-    semesters = cur.fetchall()
+    offerings = cur.fetchall()
 
     cur.close()
-    conn.close()
 
-    return render_template("enroll_add.html",
-                           student=student, courses=courses, semesters=semesters)
+    return render_template("enroll_add.html", student=student, offerings=offerings)
 
 
 # -----------------------------
@@ -573,34 +677,29 @@ def enroll_page(student_id):
 @main.route("/students/<int:student_id>/enroll/submit", methods=["POST"])
 def enroll_submit(student_id):
 
-    course_id = request.form["course_id"]
-    semester_id = request.form["semester_id"]
+    offering_id = request.form["offering_id"]
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     try:
 
-        # 1. capacity check
-        cur.execute("""
-            SELECT capacity,
-                (SELECT COUNT(*) FROM enrollments e 
-                 WHERE e.course_id=%s AND e.status='Enrolled') AS enrolled_count
-            FROM courses
-            WHERE course_id=%s
-        """, (course_id, course_id))
-        info = cur.fetchone()
-
-        if info["enrolled_count"] >= info["capacity"]:
-            raise Exception("Course is full")
+        # Single statement: trg_enforce_course_capacity reserves the seat
+        # with a conditional UPDATE on the offering row and raises
+        # "Course is full" when none is left. Running it as its own
+        # transaction releases the offering row lock as soon as it ends.
+        with single_statement(conn):
+            cur.execute("""
+                INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+                SELECT %s, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+                FROM course_offerings o
+                WHERE o.offering_id = %s
+            """, (student_id, offering_id))
 
-        # 2. insert enrollment
-        cur.execute("""
-            INSERT INTO enrollments (student_id, course_id, semester_id, status)
-            VALUES (%s, %s, %s, 'Enrolled')
-        """, (student_id, course_id, semester_id))
+            if cur.rowcount == 0:
+                raise Exception("Course offering not found")
 
-        conn.commit()
+            conn.commit()
         flash("Enrollment added successfully!", "success")
         return redirect(url_for("main.student_detail", student_id=student_id))
 
@@ -620,7 +719,6 @@ def enroll_submit(student_id):
 
     finally:
         cur.close()
-        conn.close()
 
 # -----------------------------
 # Instructors List
@@ -630,35 +728,34 @@ def enroll_submit(student_id):
 @main.route("/instructors")
 def instructor_list():
     view = request.args.get("view", "active")  # add filter toggle
+    department_id = request.args.get("department_id", type=int)
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    if view == "all":
-        cur.execute("""
-            SELECT i.instructor_id, i.first_name, i.last_name, 
-                   i.email, i.title, i.status,
-                   d.department_name
-            FROM instructors i
-            JOIN departments d ON i.department_id = d.department_id
-            ORDER BY i.last_name
-        """)
-    else:
-        cur.execute("""
-            SELECT i.instructor_id, i.first_name, i.last_name, 
-                   i.email, i.title, i.status,
-                   d.department_name
-            FROM instructors i
-            JOIN departments d ON i.department_id = d.department_id
-            WHERE i.status = 'Active'
-            ORDER BY i.last_name
-        """)
-
-    instructors = cur.fetchall()
+    conditions, params = [], []
+    if view != "all":
+        conditions.append("i.status = 'Active'")
+    if department_id:
+        conditions.append("i.department_id = %s")
+        params.append(department_id)
+
+    # last_name is not unique, so instructor_id breaks ties in the seek key
+    instructors = fetch_keyset_page(cur, """
+        SELECT i.instructor_id, i.first_name, i.last_name,
+               i.email, i.title, i.status,
+               d.department_name
+        FROM instructors i
+        JOIN departments d ON i.department_id = d.department_id
+    """, conditions, params,
+        ["i.last_name", "i.instructor_id"], ["last_name", "instructor_id"], [str, int])
+
+    departments = get_departments()
+
     cur.close()
-    conn.close()
 
-    return render_template("instructor_list.html", instructors=instructors, view=view)
+    return render_template("instructor_list.html", instructors=instructors, view=view,
+                           departments=departments, department_id=department_id)
 
 
 @main.route("/instructors/add", methods=["GET", "POST"])
@@ -679,14 +776,13 @@ def add_instructor():
         """, (dept, first, last, email, title))
 
         conn.commit()
+        invalidate("instructors")
         flash("Instructor added successfully!", "success")
         return redirect(url_for("main.instructor_list"))
 
-    cur.execute("SELECT department_id, department_name FROM departments")
-    departments = cur.fetchall()
+    departments = get_departments()
 
     cur.close()
-    conn.close()
 
     return render_template("instructor_add.html", departments=departments)
 
@@ -710,6 +806,7 @@ def edit_instructor(instructor_id):
         """, (dept, first, last, email, title, instructor_id))
 
         conn.commit()
+        invalidate("instructors")
         flash("Instructor updated!", "success")
         return redirect(url_for("main.instructor_list"))
 
@@ -718,11 +815,9 @@ def edit_instructor(instructor_id):
     """, (instructor_id,))
     instructor = cur.fetchone()
 
-    cur.execute("SELECT department_id, department_name FROM departments")
-    departments = cur.fetchall()
+    departments = get_departments()
 
     cur.close()
-    conn.close()
 
     return render_template(
         "instructor_edit.html", instructor=instructor, departments=departments
@@ -744,7 +839,6 @@ def instructor_detail(instructor_id):
 
     if not instructor:
         cur.close()
-        conn.close()
         flash("Instructor not found.", "danger")
         return redirect(url_for("main.instructor_list"))
 
@@ -754,21 +848,22 @@ def instructor_detail(instructor_id):
             c.course_code,
             c.course_name,
             c.status,
-            c.capacity,
-            (
-                SELECT COUNT(*) 
-                FROM enrollments e
-                WHERE e.course_id = c.course_id
-                  AND e.status = 'Enrolled'
-            ) AS enrolled_count
+            COALESCE(t.capacity, c.capacity) AS capacity,
+            COALESCE(t.enrolled_count, 0) AS enrolled_count
         FROM courses c
+        LEFT JOIN LATERAL (
+            SELECT SUM(o.enrolled_count) AS enrolled_count,
+                   SUM(o.capacity) AS capacity
+            FROM course_offerings o
+            JOIN open_semesters os ON os.semester_id = o.semester_id
+            WHERE o.course_id = c.course_id
+        ) t ON TRUE
         WHERE c.instructor_id = %s
         ORDER BY c.course_code
     """, (instructor_id,))
     courses = cur.fetchall()
 
     cur.close()
-    conn.close()
 
     return render_template(
         "instructor_detail.html",
@@ -797,7 +892,6 @@ def confirm_delete_instructor(instructor_id):
 
     if not instructor:
         cur.close()
-        conn.close()
         flash("Instructor not found.", "danger")
         return redirect(url_for("main.instructor_list"))
 
@@ -812,17 +906,15 @@ def confirm_delete_instructor(instructor_id):
 
     # count active enrollments in those courses
     cur.execute("""
-        SELECT COUNT(*) AS enrollment_count
-        FROM enrollments e
-        JOIN courses c ON e.course_id = c.course_id
+        SELECT COALESCE(SUM(o.enrolled_count), 0) AS enrollment_count
+        FROM course_offerings o
+        JOIN courses c ON o.course_id = c.course_id
         WHERE c.instructor_id = %s
           AND c.status = 'Active'
-          AND e.status = 'Enrolled'
     """, (instructor_id,))
     enrollment_count = cur.fetchone()["enrollment_count"]
 
     cur.close()
-    conn.close()
 
     return render_template(
         "instructor_confirm_delete.html",
@@ -842,47 +934,47 @@ def delete_instructor(instructor_id):
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     try:
-        # 1. mark instructor as Inactive
-        cur.execute("""
-            UPDATE instructors
-            SET status = 'Inactive'
-            WHERE instructor_id = %s
-        """, (instructor_id,))
-
-        # 2. collect all active courses taught by this instructor
-        cur.execute("""
-            SELECT course_id
-            FROM courses
-            WHERE instructor_id = %s
-              AND status = 'Active'
-        """, (instructor_id,))
-        course_rows = cur.fetchall()
-        course_ids = [row["course_id"] for row in course_rows]
-
-        cancelled_enrollments = 0
-
-        if course_ids:
-            # 3. mark those courses as Inactive
+        # One statement: mark the instructor Inactive, inactivate their
+        # active courses and mark active enrollments in those courses as
+        # Course_Cancelled
+        with single_statement(conn):
             cur.execute("""
-                UPDATE courses
-                SET status = 'Inactive'
-                WHERE course_id = ANY(%s)
-            """, (course_ids,))
+                WITH instructor AS (
+                    UPDATE instructors
+                    SET status = 'Inactive'
+                    WHERE instructor_id = %s
+                    RETURNING instructor_id
+                ),
+                courses_closed AS (
+                    UPDATE courses c
+                    SET status = 'Inactive'
+                    FROM instructor i
+                    WHERE c.instructor_id = i.instructor_id
+                      AND c.status = 'Active'
+                    RETURNING c.course_id
+                ),
+                cancelled AS (
+                    UPDATE enrollments e
+                    SET status = 'Course_Cancelled'
+                    FROM courses_closed c
+                    WHERE e.course_id = c.course_id
+                      AND e.status = 'Enrolled'
+                    RETURNING e.enrollment_id
+                )
+                SELECT (SELECT COUNT(*) FROM courses_closed) AS courses,
+                       (SELECT COUNT(*) FROM cancelled) AS enrollments
+            """, (instructor_id,))
+            result = cur.fetchone()
+            conn.commit()
 
-            # 4. mark active enrollments in those courses as Course_Cancelled
-            cur.execute("""
-                UPDATE enrollments
-                SET status = 'Course_Cancelled'
-                WHERE course_id = ANY(%s)
-                  AND status = 'Enrolled'
-            """, (course_ids,))
-            cancelled_enrollments = cur.rowcount
+        invalidate("instructors")
 
-        conn.commit()
+        closed_courses = result["courses"]
+        cancelled_enrollments = result["enrollments"]
 
         msg = "Instructor deleted (soft delete)."
-        if course_ids:
-            msg += f" {len(course_ids)} active course(s) were inactivated"
+        if closed_courses:
+            msg += f" {closed_courses} active course(s) were inactivated"
             if cancelled_enrollments:
                 msg += f" and {cancelled_enrollments} active enrollment(s) were marked as Course_Cancelled."
             else:
@@ -895,7 +987,6 @@ def delete_instructor(instructor_id):
 
     finally:
         cur.close()
-        conn.close()
 
     return redirect(url_for("main.instructor_list"))
 
@@ -904,50 +995,68 @@ def delete_instructor(instructor_id):
 # -----------------------------
 
 
+def enrollment_filters(view, status, semester_id, department_id, course_code):
+    """WHERE conditions for enrollments e joined to students s and courses c."""
+    conditions, params = [], []
+    if view != "all":
+        # ACTIVE enrollments only
+        conditions += ["e.status = 'Enrolled'",
+                       "s.status = 'Active'",
+                       "c.status = 'Active'"]
+    if status:
+        conditions.append("e.status = %s")
+        params.append(status)
+    if semester_id:
+        conditions.append("e.semester_id = %s")
+        params.append(semester_id)
+    if department_id:
+        conditions.append("c.department_id = %s")
+        params.append(department_id)
+    if course_code:
+        conditions.append("c.course_code = %s")
+        params.append(course_code)
+    return conditions, params
+
+
 @main.route("/enrollments")
+@conditional("enrollments", "students", "courses", "semesters", "departments")
 def enrollment_list():
     view = request.args.get("view", "active")  # default to active
+    status = request.args.get("status") or None
+    semester_id = request.args.get("semester_id", type=int)
+    department_id = request.args.get("department_id", type=int)
+    course_code = request.args.get("course", "").strip().upper() or None
 
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    if view == "all":
-        # ALL enrollments (include inactive students/courses)
-        cur.execute("""
-            SELECT e.enrollment_id, e.student_id, 
-                   s.first_name || ' ' || s.last_name AS student_name,
-                   e.course_id, c.course_code, c.course_name,
-                   e.status, e.grade,
-                   sm.term, sm.year
-            FROM enrollments e
-            JOIN students s ON e.student_id = s.student_id
-            JOIN courses c ON e.course_id = c.course_id
-            JOIN semesters sm ON e.semester_id = sm.semester_id
-            ORDER BY e.enrollment_id ASC
-        """)
-    else:
-        # ACTIVE enrollments only
-        cur.execute("""
-            SELECT e.enrollment_id, e.student_id,
-                   s.first_name || ' ' || s.last_name AS student_name,
-                   e.course_id, c.course_code, c.course_name,
-                   e.status, e.grade,
-                   sm.term, sm.year
-            FROM enrollments e
-            JOIN students s ON e.student_id = s.student_id
-            JOIN courses c ON e.course_id = c.course_id
-            JOIN semesters sm ON e.semester_id = sm.semester_id
-            WHERE e.status = 'Enrolled'
-              AND s.status = 'Active'
-              AND c.status = 'Active'
-            ORDER BY e.enrollment_id ASC
-        """)
+    conditions, params = enrollment_filters(view, status, semester_id,
+                                            department_id, course_code)
+
+    # one page, seeking on enrollment_id
+    enrollments = fetch_keyset_page(cur, """
+        SELECT e.enrollment_id, e.student_id,
+               s.first_name || ' ' || s.last_name AS student_name,
+               e.course_id, c.course_code, c.course_name,
+               e.status, e.grade,
+               sm.term, sm.year
+        FROM enrollments e
+        JOIN students s ON e.student_id = s.student_id
+        JOIN courses c ON e.course_id = c.course_id
+        JOIN semesters sm ON e.semester_id = sm.semester_id
+    """, conditions, params, ["e.enrollment_id"], ["enrollment_id"], [int],
+        prepare="enrollment_list")
+
+    departments = get_departments()
+
+    semesters = get_semesters()
 
-    enrollments = cur.fetchall()
     cur.close()
-    conn.close()
 
-    return render_template("enrollment_list.html", enrollments=enrollments, view=view)
+    return render_template("enrollment_list.html", enrollments=enrollments, view=view,
+                           departments=departments, semesters=semesters,
+                           status=status, semester_id=semester_id,
+                           department_id=department_id, course_code=course_code)
 
 
 # -----------------------------
@@ -970,7 +1079,7 @@ def grade_enrollment(enrollment_id):
 
         conn.commit()
         cur.close()
-        conn.close()
+        request_refresh()
 
         flash("Grade updated successfully!", "success")
         return redirect(url_for("main.enrollment_list"))
@@ -989,6 +1098,304 @@ def grade_enrollment(enrollment_id):
     enrollment = cur.fetchone()
 
     cur.close()
-    conn.close()
 
     return render_template("grade_edit.html", enrollment=enrollment)
+
+
+# -----------------------------
+# Bulk Grade Import (CSV)
+# -----------------------------
+@main.route("/enrollments/grades/import", methods=["GET", "POST"])
+def import_grades():
+
+    if request.method == "GET":
+        return render_template("grade_import.html", result=None)
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Choose a CSV file to upload.", "danger")
+        return redirect(url_for("main.import_grades"))
+
+    # apply the valid rows even when some rows are rejected
+    partial = request.form.get("partial") == "1"
+
+    try:
+        rows, errors = bulk.parse_grade_rows(bulk.read_csv(upload.stream))
+    except (bulk.CsvFormatError, UnicodeDecodeError, csv.Error) as e:
+        flash(f"Could not read the file: {e}", "danger")
+        return redirect(url_for("main.import_grades"))
+
+    result = {"rows": len(rows) + len(errors), "applied": False,
+              "updated": 0, "students": 0}
+
+    if rows:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            # with parse errors and no partial import the rows are still
+            # staged, so the report lists every problem at once
+            outcome = bulk.import_grades(cur, rows, allow_errors=partial,
+                                         apply=partial or not errors)
+            if outcome["applied"]:
+                conn.commit()
+                request_refresh()
+            else:
+                conn.rollback()
+        except psycopg2.Error as e:
+            conn.rollback()
+            cur.close()
+            flash(f"Import failed: {e.pgerror or e}", "danger")
+            return redirect(url_for("main.import_grades"))
+        cur.close()
+
+        errors = sorted(errors + outcome.pop("errors"))
+        result.update(outcome)
+
+    result["errors"] = [{"line": line, "error": msg} for line, msg in errors]
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(result), (200 if result["applied"] or not errors else 422)
+
+    return render_template("grade_import.html", result=result)
+
+
+# -----------------------------
+# Bulk (Cohort) Enrollment
+# -----------------------------
+@main.route("/enrollments/bulk", methods=["GET", "POST"])
+def bulk_enroll():
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    result = None
+    errors = []
+
+    if request.method == "POST":
+        offering_id = request.form.get("offering_id", type=int)
+        source = request.form.get("source", "csv")
+        department_id = request.form.get("department_id", type=int)
+        enrollment_year = request.form.get("enrollment_year", type=int)
+        student_ids = None
+
+        if source == "csv":
+            upload = request.files.get("file")
+            if not upload or not upload.filename:
+                errors.append((0, "Choose a CSV file with a student_id column."))
+            else:
+                try:
+                    student_ids, errors = bulk.parse_student_ids(bulk.read_csv(upload.stream))
+                except (bulk.CsvFormatError, UnicodeDecodeError, csv.Error) as e:
+                    errors.append((0, f"Could not read the file: {e}"))
+        elif not department_id and not enrollment_year:
+            errors.append((0, "Choose a department and/or an enrollment year."))
+
+        if not offering_id:
+            errors.append((0, "Choose a course offering."))
+
+        if not errors:
+            try:
+                result = bulk.enroll_cohort(cur, offering_id, student_ids=student_ids,
+                                            department_id=department_id,
+                                            enrollment_year=enrollment_year)
+                if result is None:
+                    errors.append((0, "Course offering not found."))
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                result = None
+                errors.append((0, f"Enrollment failed: {e.pgerror or e}"))
+
+        if request.accept_mimetypes.best == "application/json":
+            cur.close()
+            body = dict(result or {})
+            body["errors"] = [{"line": line, "error": msg} for line, msg in errors]
+            return jsonify(body), (422 if errors else 200)
+
+    # offerings in the open terms
+    cur.execute("""
+        SELECT o.offering_id, o.semester_id, os.term, os.year,
+               c.course_code, c.course_name,
+               o.capacity, o.enrolled_count
+        FROM open_semesters os
+        JOIN course_offerings o ON o.semester_id = os.semester_id
+        JOIN courses c ON o.course_id = c.course_id
+        WHERE c.status='Active'
+        ORDER BY os.start_date DESC, c.course_code
+    """)
+    offerings = cur.fetchall()
+
+    departments = get_departments()
+
+    cur.close()
+
+    return render_template("bulk_enroll.html", offerings=offerings,
+                           departments=departments, result=result,
+                           errors=[{"line": line, "error": msg} for line, msg in errors])
+
+
+# -----------------------------
+# Exports (CSV / JSON Lines)
+# -----------------------------
+EXPORT_FORMATS = "<any(csv, jsonl):fmt>"
+
+
+@main.route(f"/enrollments/export.{EXPORT_FORMATS}")
+def export_enrollments(fmt):
+    view = request.args.get("view", "all")
+    status = request.args.get("status") or None
+    semester_id = request.args.get("semester_id", type=int)
+    department_id = request.args.get("department_id", type=int)
+    course_code = request.args.get("course", "").strip().upper() or None
+
+    conditions, params = enrollment_filters(view, status, semester_id,
+                                            department_id, course_code)
+
+    sql = """
+        SELECT e.enrollment_id, e.student_id, s.first_name, s.last_name, s.email,
+               c.course_code, c.course_name, c.credits,
+               sm.term, sm.year, e.enrollment_date, e.status, e.grade
+        FROM enrollments e
+        JOIN students s ON e.student_id = s.student_id
+        JOIN courses c ON e.course_id = c.course_id
+        JOIN semesters sm ON e.semester_id = sm.semester_id
+    """
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY e.enrollment_id"
+
+    columns = ["enrollment_id", "student_id", "first_name", "last_name", "email",
+               "course_code", "course_name", "credits",
+               "term", "year", "enrollment_date", "status", "grade"]
+
+    return stream_export(get_db_connection(), sql, params, columns, fmt,
+                         "enrollments", gzip=request.args.get("gzip") == "1")
+
+
+@main.route(f"/courses/<int:course_id>/roster.{EXPORT_FORMATS}")
+def export_course_roster(course_id, fmt):
+    semester_id = request.args.get("semester_id", type=int)
+    # the roster is the current class list unless ?status= says otherwise
+    status = request.args.get("status", "Enrolled")
+
+    conditions, params = ["e.course_id = %s"], [course_id]
+    if semester_id:
+        conditions.append("e.semester_id = %s")
+        params.append(semester_id)
+    if status != "all":
+        conditions.append("e.status = %s")
+        params.append(status)
+
+    sql = """
+        SELECT c.course_code, sm.term, sm.year,
+               s.student_id, s.first_name, s.last_name, s.email,
+               d.department_name, s.enrollment_year,
+               e.status, e.grade
+        FROM enrollments e
+        JOIN courses c ON e.course_id = c.course_id
+        JOIN semesters sm ON e.semester_id = sm.semester_id
+        JOIN students s ON e.student_id = s.student_id
+        LEFT JOIN departments d ON s.department_id = d.department_id
+        WHERE """ + " AND ".join(conditions) + """
+        ORDER BY sm.start_date, s.last_name, s.first_name, s.student_id
+    """
+
+    columns = ["course_code", "term", "year",
+               "student_id", "first_name", "last_name", "email",
+               "department_name", "enrollment_year", "status", "grade"]
+
+    return stream_export(get_db_connection(), sql, params, columns, fmt,
+                         f"roster-{course_id}", gzip=request.args.get("gzip") == "1")
+
+
+@main.route(f"/students/<int:student_id>/transcript.{EXPORT_FORMATS}")
+def export_transcript(student_id, fmt):
+    semester_id = request.args.get("semester_id", type=int)
+    department_id = request.args.get("department_id", type=int)
+
+    conditions, params = ["e.student_id = %s"], [student_id]
+    if semester_id:
+        conditions.append("e.semester_id = %s")
+        params.append(semester_id)
+    if department_id:
+        conditions.append("c.department_id = %s")
+        params.append(department_id)
+
+    sql = """
+        SELECT sm.term, sm.year, c.course_code, c.course_name, c.credits,
+               e.status, e.grade, gp.points AS grade_points
+        FROM enrollment_history e
+        JOIN courses c ON e.course_id = c.course_id
+        JOIN semesters sm ON e.semester_id = sm.semester_id
+        LEFT JOIN grade_points gp
+               ON gp.grade = e.grade AND e.status = 'Completed'
+        WHERE """ + " AND ".join(conditions) + """
+        ORDER BY sm.start_date, c.course_code
+    """
+
+    columns = ["term", "year", "course_code", "course_name", "credits",
+               "status", "grade", "grade_points"]
+
+    return stream_export(get_db_connection(), sql, params, columns, fmt,
+                         f"transcript-{student_id}", gzip=request.args.get("gzip") == "1")
+
+
+# -----------------------------
+# Search (page + typeahead API)
+# -----------------------------
+@main.route("/search")
+@conditional("students", "courses", "instructors", "departments")
+def search_page():
+    q = normalize_query(request.args.get("q"))
+
+    results = {}
+    if q:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        results = {kind: search(cur, kind, q) for kind in SEARCHES}
+        cur.close()
+
+    return render_template("search.html", q=request.args.get("q", ""), results=results)
+
+
+@main.route("/api/search")
+@conditional("students", "courses", "instructors", "departments")
+def search_api():
+    q = normalize_query(request.args.get("q"))
+    kinds = list(dict.fromkeys(k for k in request.args.get("type", ",".join(SEARCHES)).split(",") if k))
+    unknown = [k for k in kinds if k not in SEARCHES]
+    if unknown:
+        return jsonify(error=f"unknown type {unknown[0]!r}", types=list(SEARCHES)), 400
+    limit = max(1, min(request.args.get("limit", DEFAULT_LIMIT, type=int) or DEFAULT_LIMIT,
+                       MAX_LIMIT))
+
+    results = {kind: [] for kind in kinds}
+    if q:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        for kind in kinds:
+            results[kind] = search(cur, kind, q, limit)
+        cur.close()
+
+    return jsonify(query=q, results=results)
+
+
+# -----------------------------
+# Reference-data cache stats
+# -----------------------------
+@main.route("/cache/stats")
+def cache_stats():
+    stats = reference_cache.stats()
+    stats["listener"] = listener_stats()
+    stats["prepared"] = prepared_stats()
+    return jsonify(stats)
+
+
+# -----------------------------
+# Slow Queries (admin)
+# -----------------------------
+@main.route("/admin/slow-queries")
+def slow_queries():
+    offenders = top_offenders(current_app.config)
+    return render_template("admin_slow_queries.html", offenders=offenders,
+                           threshold_ms=current_app.config["SLOW_QUERY_MS"])
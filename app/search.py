@@ -0,0 +1,105 @@
+import re
+
+from flask import url_for
+
+from .prepared import execute_prepared
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 100
+
+# below three characters a substring pattern has no trigram to look up in
+# the index, so short queries only use the fuzzy (<%) match
+MIN_SUBSTRING_LENGTH = 3
+
+# What each kind of result is matched against. The `document` expressions
+# must stay identical to the ones indexed in db/migrations/0007 (gin_trgm_ops),
+# or the planner cannot use the indexes.
+SEARCHES = {
+    "students": dict(
+        document="lower(s.first_name || ' ' || s.last_name || ' ' || s.email)",
+        select="""
+            SELECT s.student_id AS id,
+                   s.first_name || ' ' || s.last_name AS label,
+                   s.email || ', ' || COALESCE(d.department_name, '') || ', ' || s.status AS detail
+            FROM students s
+            LEFT JOIN departments d ON s.department_id = d.department_id
+        """,
+        id="s.student_id",
+        endpoint="main.student_detail", arg="student_id",
+    ),
+    "courses": dict(
+        document="lower(c.course_code || ' ' || c.course_name)",
+        select="""
+            SELECT c.course_id AS id,
+                   c.course_code || ' ' || c.course_name AS label,
+                   c.credits || ' credits, ' || c.status AS detail
+            FROM courses c
+        """,
+        id="c.course_id",
+        endpoint="main.course_detail", arg="course_id",
+    ),
+    "instructors": dict(
+        document="lower(i.first_name || ' ' || i.last_name)",
+        select="""
+            SELECT i.instructor_id AS id,
+                   i.first_name || ' ' || i.last_name AS label,
+                   concat_ws(', ', i.title, d.department_name, i.status) AS detail
+            FROM instructors i
+            JOIN departments d ON i.department_id = d.department_id
+        """,
+        id="i.instructor_id",
+        endpoint="main.instructor_detail", arg="instructor_id",
+    ),
+}
+
+
+def normalize_query(text):
+    """Lower-cased, whitespace-collapsed and truncated; None when too short to search."""
+    q = " ".join((text or "").split()).lower()[:MAX_QUERY_LENGTH]
+    return q if len(q) >= MIN_QUERY_LENGTH else None
+
+
+def _like_pattern(q):
+    return "%" + re.sub(r"([\\%_])", r"\\\1", q) + "%"
+
+
+def search(cur, kind, q, limit=DEFAULT_LIMIT):
+    """
+    The `limit` best matches of one kind for the normalized query `q`.
+
+    A row matches when its document contains `q` or is similar to it word
+    by word (pg_trgm's <% operator, which tolerates typos); both conditions
+    are answered from the trigram index, so only the candidate rows are
+    ranked. A query that is a number also matches that id exactly. Exact
+    ids rank first, then substring hits, then by trigram word similarity.
+    """
+    spec = SEARCHES[kind]
+    doc = spec["document"]
+
+    conditions, params = [f"%s <%% {doc}"], [q]
+    if len(q) >= MIN_SUBSTRING_LENGTH:
+        conditions.append(f"{doc} LIKE %s")
+        params.append(_like_pattern(q))
+    exact = q.isascii() and q.isdigit() and len(q) < 10
+    if exact:
+        conditions.append(f"{spec['id']} = %s")
+        params.append(int(q))
+
+    sql = spec["select"] + f"""
+        WHERE {" OR ".join(conditions)}
+        ORDER BY {f"{spec['id']} = %s DESC, " if exact else ""}strpos({doc}, %s) > 0 DESC,
+                 word_similarity(%s, {doc}) DESC, {spec['id']}
+        LIMIT %s
+    """
+    params += ([int(q)] if exact else []) + [q, q, limit]
+
+    # one statement per kind and shape of query, prepared on each connection
+    execute_prepared(cur, f"search_{kind}", sql, params)
+    rows = cur.fetchall()
+
+    for row in rows:
+        row["type"] = kind[:-1]
+        row["url"] = url_for(spec["endpoint"], **{spec["arg"]: row["id"]})
+    return rows
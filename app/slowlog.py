@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+import psycopg2
+import psycopg2.extensions
+from flask import current_app, has_app_context, has_request_context, request
+
+from .instrumentation import fingerprint, set_slow_query_hook
+
+log = logging.getLogger("app.slow_queries")
+
+_WRITE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+_EXPLAINABLE = {"SELECT", "WITH", "VALUES", "TABLE", "INSERT", "UPDATE", "DELETE", "EXECUTE"}
+
+# fingerprint -> monotonic time of the last captured plan
+_last_explained = {}
+_last_explained_lock = threading.Lock()
+
+
+def _describe_params(params, redact):
+    """Parameters for the log: type names only when redacting, else truncated reprs."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _describe_params([v], redact)[0] for k, v in params.items()}
+    if redact:
+        return [type(p).__name__ for p in params]
+    return [r if len(r) <= 200 else r[:200] + "..." for r in map(repr, params)]
+
+
+def _should_explain(digest, config):
+    if random.random() >= config["SLOW_QUERY_EXPLAIN_SAMPLE"]:
+        return False
+    now = time.monotonic()
+    with _last_explained_lock:
+        last = _last_explained.get(digest)
+        if last is not None and now - last < config["SLOW_QUERY_EXPLAIN_INTERVAL"]:
+            return False
+        _last_explained[digest] = now
+    return True
+
+
+def _explain(cursor, query, params, normalized, config):
+    """
+    Capture the plan of a statement that just ran slowly, on the same
+    connection and inside a savepoint that is always rolled back, so
+    re-running it has no lasting effect. Writes are only EXPLAINed without
+    ANALYZE unless SLOW_QUERY_ANALYZE_WRITES is set.
+    """
+    conn = cursor.connection
+    words = normalized.split(None, 1)
+    if conn.autocommit or getattr(cursor, "name", None) or not words \
+            or words[0].upper() not in _EXPLAINABLE:
+        return None, None
+
+    is_write = words[0].upper() != "SELECT" and bool(_WRITE.search(normalized))
+    analyze = not is_write or config["SLOW_QUERY_ANALYZE_WRITES"]
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+
+    # a plain cursor, so the EXPLAIN itself is neither timed nor logged
+    raw = psycopg2.extensions.cursor(conn)
+    try:
+        raw.execute("SAVEPOINT slow_query_explain")
+        try:
+            raw.execute("SET LOCAL statement_timeout = %s",
+                        (int(config["SLOW_QUERY_EXPLAIN_TIMEOUT"] * 1000),))
+            raw.execute(f"EXPLAIN ({options}) {query}", params)
+            return raw.fetchone()[0], None
+        except psycopg2.Error as e:
+            return None, str(e).strip()
+        finally:
+            raw.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            raw.execute("RELEASE SAVEPOINT slow_query_explain")
+    except psycopg2.Error as e:
+        return None, str(e).strip()
+    finally:
+        raw.close()
+
+
+def record_slow_query(cursor, query, params, duration):
+    if not has_app_context():
+        return
+
+    config = current_app.config
+    digest, normalized = fingerprint(query)
+
+    plan = plan_error = None
+    if _should_explain(digest, config):
+        plan, plan_error = _explain(cursor, query, params, normalized, config)
+
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "pid": os.getpid(),
+        "endpoint": request.endpoint if has_request_context() else None,
+        "method": request.method if has_request_context() else None,
+        "path": request.path if has_request_context() else None,
+        "query": digest,
+        "sql": normalized,
+        "params": _describe_params(params, config["SLOW_QUERY_REDACT_PARAMS"]),
+        "duration_ms": round(duration * 1000, 2),
+        "rows": cursor.rowcount,
+        "plan": plan,
+        "plan_error": plan_error,
+    }
+    log.info(json.dumps(entry, default=str))
+
+
+# -----------------------------
+# Reading the log back
+# -----------------------------
+def log_files(config):
+    """Every process's log file and its rotated files, oldest backups first."""
+    root, ext = os.path.splitext(config["SLOW_QUERY_LOG"])
+    directory = os.path.dirname(root) or "."
+    own = re.compile(re.escape(os.path.basename(root)) + r"\.(\d+)" + re.escape(ext)
+                     + r"(?:\.(\d+))?$")
+    found = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        match = own.match(name)
+        if match:
+            pid, backup = match.groups()
+            found.append((int(pid), -int(backup or 0), os.path.join(directory, name)))
+    return [path for _, _, path in sorted(found)]
+
+
+def top_offenders(config, limit=50):
+    """Aggregate the slow-query log (all rotated files) by fingerprint."""
+    offenders = {}
+    for path in log_files(config):
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                o = offenders.setdefault(entry["query"], {
+                    "query": entry["query"], "sql": entry["sql"], "count": 0,
+                    "total_ms": 0.0, "max_ms": 0.0, "plan": None,
+                    "plan_ts": None, "endpoints": set(), "last_seen": None,
+                })
+                o["count"] += 1
+                o["total_ms"] += entry["duration_ms"]
+                o["max_ms"] = max(o["max_ms"], entry["duration_ms"])
+                o["endpoints"].add(entry.get("endpoint") or "-")
+                # the files are per process, so the newest entry can come first
+                if o["last_seen"] is None or entry["ts"] >= o["last_seen"]:
+                    o["last_seen"] = entry["ts"]
+                if entry.get("plan") and (o["plan_ts"] is None or entry["ts"] >= o["plan_ts"]):
+                    o["plan"], o["plan_ts"] = entry["plan"], entry["ts"]
+
+    ranked = sorted(offenders.values(), key=lambda o: o["total_ms"], reverse=True)
+    for o in ranked:
+        o["avg_ms"] = o["total_ms"] / o["count"]
+        o["endpoints"] = sorted(o["endpoints"])
+    return ranked[:limit]
+
+
+class ProcessFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that writes to <root>.<pid><ext> of `path`, so each
+    worker appends to and rotates only its own file: with one shared file,
+    a worker rotating it would leave the others writing to the renamed one.
+    The file is chosen again in a process forked after the handler was made.
+    """
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.pid = os.getpid()
+        super().__init__(self._file(), delay=True, **kwargs)
+
+    def _file(self):
+        root, ext = os.path.splitext(self.path)
+        return os.path.abspath(f"{root}.{self.pid}{ext}")
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            # the inherited stream is the parent's file; it is left open for it
+            self.pid = os.getpid()
+            self.stream = None
+            self.baseFilename = self._file()
+        super().emit(record)
+
+
+def init_slow_log(app):
+    config = app.config
+    path = config["SLOW_QUERY_LOG"]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if not log.handlers:
+        handler = ProcessFileHandler(path, maxBytes=config["SLOW_QUERY_LOG_MAX_BYTES"],
+                                     backupCount=config["SLOW_QUERY_LOG_BACKUPS"],
+                                     encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+    set_slow_query_hook(config["SLOW_QUERY_MS"] / 1000.0, record_slow_query)
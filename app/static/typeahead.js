@@ -0,0 +1,99 @@
+// Typeahead for inputs with data-typeahead="<search API URL>" (and an
+// optional data-typeahead-type="students,courses"). Requests are debounced
+// and a newer keystroke cancels the request in flight, so the page itself
+// is never reloaded; the matches are shown in a dropdown of links.
+(function () {
+  const DELAY_MS = 200;
+  const MIN_LENGTH = 2;
+
+  function attach(input) {
+    const menu = document.createElement("div");
+    menu.className = "list-group position-absolute shadow-sm d-none";
+    menu.style.zIndex = 1050;
+    menu.style.minWidth = "100%";
+    input.parentNode.classList.add("position-relative");
+    input.parentNode.appendChild(menu);
+
+    let timer = null;
+    let inFlight = null;
+
+    function hide() {
+      menu.classList.add("d-none");
+      menu.replaceChildren();
+    }
+
+    function show(results) {
+      menu.replaceChildren();
+      for (const [kind, rows] of Object.entries(results)) {
+        for (const row of rows) {
+          const item = document.createElement("a");
+          item.className = "list-group-item list-group-item-action py-1";
+          item.href = row.url;
+
+          const label = document.createElement("span");
+          label.textContent = row.label;
+          const detail = document.createElement("small");
+          detail.className = "text-muted ms-2";
+          detail.textContent = (Object.keys(results).length > 1 ? kind.slice(0, -1) + " · " : "")
+            + row.detail;
+
+          item.append(label, detail);
+          menu.appendChild(item);
+        }
+      }
+      menu.classList.toggle("d-none", !menu.children.length);
+    }
+
+    function lookup() {
+      const q = input.value.trim();
+      if (inFlight) inFlight.abort();
+      if (q.length < MIN_LENGTH) {
+        hide();
+        return;
+      }
+
+      const params = new URLSearchParams({ q: q, limit: input.dataset.typeaheadLimit || "8" });
+      if (input.dataset.typeaheadType) params.set("type", input.dataset.typeaheadType);
+
+      inFlight = new AbortController();
+      fetch(input.dataset.typeahead + "?" + params, {
+        signal: inFlight.signal,
+        headers: { Accept: "application/json" },
+      })
+        .then((resp) => (resp.ok ? resp.json() : Promise.reject(resp.status)))
+        .then((body) => show(body.results))
+        .catch((err) => {
+          if (err.name !== "AbortError") hide();
+        });
+    }
+
+    input.addEventListener("input", () => {
+      clearTimeout(timer);
+      timer = setTimeout(lookup, DELAY_MS);
+    });
+    input.addEventListener("keydown", (e) => {
+      if (e.key === "Escape") hide();
+      if (e.key === "ArrowDown" && menu.firstChild) {
+        e.preventDefault();
+        menu.firstChild.focus();
+      }
+    });
+    menu.addEventListener("keydown", (e) => {
+      if (e.key === "ArrowDown" && document.activeElement.nextSibling) {
+        e.preventDefault();
+        document.activeElement.nextSibling.focus();
+      } else if (e.key === "ArrowUp") {
+        e.preventDefault();
+        (document.activeElement.previousSibling || input).focus();
+      } else if (e.key === "Escape") {
+        hide();
+        input.focus();
+      }
+    });
+    document.addEventListener("click", (e) => {
+      if (!input.parentNode.contains(e.target)) hide();
+    });
+  }
+
+  document.querySelectorAll("input[data-typeahead]").forEach(attach);
+})();
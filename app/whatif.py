@@ -0,0 +1,250 @@
+import io
+import threading
+import time
+
+import numpy as np
+from flask import current_app, has_app_context
+
+from .models import get_db_connection
+
+# Everything a GPA depends on, one row per enrollment that counts now
+# (Completed with a grade in grade_points, as in calculate_student_gpa) or
+# may count later (Enrolled, grade pending). Points are in hundredths and
+# -1 for pending rows, so every sum below is exact integer arithmetic.
+ENROLLMENTS_SQL = """
+    SELECT e.student_id, e.course_id, e.semester_id,
+           c.credits::SMALLINT,
+           COALESCE((gp.points * 100)::SMALLINT, -1::SMALLINT)
+    FROM enrollment_history e
+    JOIN courses c ON c.course_id = e.course_id
+    LEFT JOIN grade_points gp ON gp.grade = e.grade AND e.status = 'Completed'
+    WHERE e.status = 'Enrolled'
+       OR (e.status = 'Completed' AND gp.points IS NOT NULL)
+"""
+ENROLLMENT_FIELDS = [("student_id", "i4"), ("course_id", "i4"), ("semester_id", "i4"),
+                     ("credits", "i2"), ("points", "i2")]
+
+STUDENTS_SQL = """
+    SELECT student_id,
+           COALESCE(department_id, 0),
+           COALESCE(enrollment_year, 0)::SMALLINT,
+           CASE status WHEN 'Active' THEN 0 WHEN 'Graduated' THEN 1 ELSE 2 END::SMALLINT
+    FROM students
+    ORDER BY student_id
+"""
+STUDENT_FIELDS = [("student_id", "i4"), ("department_id", "i4"),
+                  ("enrollment_year", "i2"), ("status", "i2")]
+STATUSES = {"Active": 0, "Graduated": 1, "Inactive": 2}
+
+PERCENTILES = (10, 25, 50, 75, 90)
+DEFAULT_BINS = np.arange(0, 4.25, 0.25)
+
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def _copy_arrays(cur, query, fields):
+    """
+    Run `query` through COPY ... (FORMAT binary) and return its columns as
+    NumPy arrays, without building a Python object per row. Every column
+    must be NOT NULL and of the fixed-width type given in `fields`
+    (i2 / i4 / i8), which makes every tuple the same size.
+    """
+    buf = io.BytesIO()
+    cur.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", buf)
+    data = buf.getbuffer()
+
+    if bytes(data[:11]) != _COPY_SIGNATURE:
+        raise ValueError("not a binary COPY stream")
+    header = 19 + int.from_bytes(data[15:19], "big")
+
+    layout = [("count", ">i2")]
+    for name, kind in fields:
+        layout += [(f"{name}_len", ">i4"), (name, ">" + kind)]
+    rows = np.frombuffer(data[header:len(data) - 2], dtype=np.dtype(layout))
+
+    if len(rows) and ((rows["count"] != len(fields)).any()
+                      or any((rows[f"{name}_len"] != np.dtype(kind).itemsize).any()
+                             for name, kind in fields)):
+        raise ValueError("unexpected NULL or column type in binary COPY stream")
+    # native byte order, compact copies (the COPY buffer is released)
+    return {name: rows[name].astype(kind) for name, kind in fields}
+
+
+def _grade_points(cur):
+    cur.execute("SELECT grade, (points * 100)::INTEGER AS points FROM grade_points")
+    return {grade: points for grade, points in cur.fetchall()}
+
+
+def _round_gpa(quality, credits):
+    """
+    quality / credits in hundredths, rounded half up like NUMERIC ROUND();
+    -1 where there are no credits.
+    """
+    safe = np.maximum(credits, 1)
+    return np.where(credits > 0, (2 * quality + safe) // (2 * safe), -1)
+
+
+class GradeBook:
+    """
+    Enrollments and grades held as flat NumPy arrays, for what-if GPA
+    scenarios over the whole student body.
+
+    Students are rows of the `students` arrays (sorted by student_id);
+    enrollments refer to them by position (`student`), so a per-student
+    sum is one np.bincount over the enrollment rows.
+    """
+
+    def __init__(self, students, enrollments, grade_points, loaded_at=None):
+        self.students = students
+        self.grade_points = grade_points
+        self.loaded_at = loaded_at or time.time()
+
+        self.student = np.searchsorted(students["student_id"], enrollments["student_id"])
+        self.course_id = enrollments["course_id"]
+        self.semester_id = enrollments["semester_id"]
+        self.credits = enrollments["credits"].astype(np.int64)
+        self.points = enrollments["points"].astype(np.int64)
+        self.pending = self.points < 0
+
+        n = len(students["student_id"])
+        graded = ~self.pending
+        self.base_quality = np.bincount(self.student[graded],
+                                        weights=self.credits[graded] * self.points[graded],
+                                        minlength=n).astype(np.int64)
+        self.base_credits = np.bincount(self.student[graded], weights=self.credits[graded],
+                                        minlength=n).astype(np.int64)
+        self.base_gpa = _round_gpa(self.base_quality, self.base_credits)
+
+    @classmethod
+    def load(cls, conn):
+        """Read every student and every counting / pending enrollment in two COPYs."""
+        cur = conn.cursor()
+        try:
+            students = _copy_arrays(cur, STUDENTS_SQL, STUDENT_FIELDS)
+            enrollments = _copy_arrays(cur, ENROLLMENTS_SQL, ENROLLMENT_FIELDS)
+            grade_points = _grade_points(cur)
+        finally:
+            cur.close()
+        return cls(students, enrollments, grade_points)
+
+    def __len__(self):
+        return len(self.student)
+
+    def points_for(self, value):
+        """Hundredths of a grade point for a grade ('B+', '87') or a number (3.3)."""
+        if isinstance(value, str) and value.strip().upper() in self.grade_points:
+            return self.grade_points[value.strip().upper()]
+        try:
+            points = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"unknown grade: {value!r}") from None
+        if not 0 <= points <= 4:
+            raise ValueError(f"grade points must be between 0 and 4, got {points}")
+        return int(round(points * 100))
+
+    def cohort(self, department_id=None, enrollment_year=None, status=None):
+        """Boolean mask over the students."""
+        mask = np.ones(len(self.students["student_id"]), dtype=bool)
+        if department_id:
+            mask &= self.students["department_id"] == department_id
+        if enrollment_year:
+            mask &= self.students["enrollment_year"] == enrollment_year
+        if status:
+            mask &= self.students["status"] == STATUSES[status]
+        return mask
+
+    def scenario_gpa(self, pending=None, semester_id=None, overrides=None):
+        """
+        GPA (hundredths, -1 without credits) per student once the pending
+        grades land.
+
+        `pending` is the grade every pending enrollment gets (see
+        points_for), or "current" for each student's current GPA;
+        `overrides` maps course_id -> grade for the pending enrollments of
+        those courses. With `semester_id` only that term's pending grades
+        land. Enrollments left without a grade do not count, as now.
+        """
+        landing = self.pending.copy()
+        if semester_id:
+            landing &= self.semester_id == semester_id
+
+        points = np.full(len(self), -1, dtype=np.int64)
+        if pending == "current":
+            points = np.where(self.base_gpa[self.student] >= 0, self.base_gpa[self.student], -1)
+        elif pending is not None:
+            points[:] = self.points_for(pending)
+        for course_id, grade in (overrides or {}).items():
+            points[self.course_id == course_id] = self.points_for(grade)
+
+        landing &= points >= 0
+        n = len(self.base_quality)
+        quality = self.base_quality + np.bincount(
+            self.student[landing], weights=self.credits[landing] * points[landing],
+            minlength=n).astype(np.int64)
+        credits = self.base_credits + np.bincount(
+            self.student[landing], weights=self.credits[landing], minlength=n).astype(np.int64)
+        return _round_gpa(quality, credits)
+
+    def what_if(self, mask=None, threshold=2.0, bins=DEFAULT_BINS, **scenario):
+        """
+        Summary of the cohort `mask` now and under `scenario` (the
+        arguments of scenario_gpa): GPA distribution, percentiles and how
+        many students are below `threshold`, including who crosses it.
+        """
+        if mask is None:
+            mask = np.ones(len(self.base_gpa), dtype=bool)
+        after = self.scenario_gpa(**scenario)
+        cut = int(round(threshold * 100))
+
+        def summary(gpa):
+            values = gpa[mask & (gpa >= 0)] / 100
+            counts, _ = np.histogram(values, bins=bins)
+            return {
+                "students": int(len(values)),
+                "mean": round(float(values.mean()), 2) if len(values) else None,
+                "percentiles": ({p: round(float(v), 2) for p, v in
+                                 zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+                                if len(values) else {}),
+                "histogram": counts.tolist(),
+                "below_threshold": int((values < threshold).sum()),
+            }
+
+        before_graded, after_graded = mask & (self.base_gpa >= 0), mask & (after >= 0)
+        return {
+            "cohort": int(mask.sum()),
+            "pending_enrollments": int((self.pending & mask[self.student]).sum()),
+            "threshold": threshold,
+            "bins": [round(float(b), 2) for b in bins],
+            "current": summary(self.base_gpa),
+            "scenario": summary(after),
+            "newly_below": int((after_graded & (after < cut)
+                                & ~(before_graded & (self.base_gpa < cut))).sum()),
+            "newly_above": int((before_graded & (self.base_gpa < cut) & (after >= cut)).sum()),
+        }
+
+
+# -----------------------------
+# Per-process copy
+# -----------------------------
+_book = None
+_book_lock = threading.Lock()
+
+
+def _max_age():
+    return current_app.config["WHATIF_CACHE_TTL"] if has_app_context() else 600
+
+
+def get_gradebook(refresh=False):
+    """
+    This process's GradeBook, loaded again once older than WHATIF_CACHE_TTL
+    seconds. One thread loads while the others wait for it. GET requests
+    load it from a read replica when one is configured.
+    """
+    global _book
+
+    with _book_lock:
+        if refresh or _book is None or time.time() - _book.loaded_at > _max_age():
+            conn = get_db_connection()
+            _book = GradeBook.load(conn)
+            conn.rollback()
+        return _book
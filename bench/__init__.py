@@ -0,0 +1,4 @@
+"""
+Benchmarks and stress tools that run against a local PostgreSQL loaded from
+db/final_project.sql. Connection settings come from the same .env as the app.
+"""
@@ -0,0 +1,215 @@
+"""
+Before/after timings for the indexes added by db/migrations.
+
+For every applied index migration, runs the queries it targets with
+EXPLAIN (ANALYZE, BUFFERS) while its indexes exist ("after") and again
+inside a transaction that drops them first, recreates the indexes the
+migration replaced, and is then rolled back ("before"), and reports the median execution time, shared buffers touched
+and whether the plan used the new index. The DROP INDEX holds an exclusive
+lock on the table until the rollback, so run this against a local
+benchmark database (bench.generate_data), not a shared one. Results are
+written as JSON next to the load driver's.
+
+    flask db migrate
+    python -m bench.bench_indexes --repeat 7
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from datetime import datetime, timezone
+
+from psycopg2.extras import RealDictCursor
+
+from app import migrations
+from app.models import get_db_connection
+from bench.load_driver import RESULTS_DIR, git_revision
+
+# sample parameters, looked up once: the course with the most enrolled
+# seats, the student of the newest enrollment, the newest open term, the
+# instructor with the most courses
+PARAMS_SQL = """
+    SELECT (SELECT course_id FROM course_offerings
+            ORDER BY enrolled_count DESC LIMIT 1) AS course_id,
+           (SELECT student_id FROM enrollments
+            ORDER BY enrollment_id DESC LIMIT 1) AS student_id,
+           (SELECT semester_id FROM open_semesters
+            ORDER BY start_date DESC LIMIT 1) AS semester_id,
+           (SELECT instructor_id FROM courses
+            GROUP BY instructor_id ORDER BY COUNT(*) DESC LIMIT 1) AS instructor_id
+"""
+
+# migration version -> [(label, SQL with %(name)s parameters)], copied
+# from the routes the migration is meant for
+QUERIES = {
+    "0001": [
+        ("force_delete_course", """
+            SELECT COUNT(*) FROM enrollments
+            WHERE course_id = %(course_id)s AND status = 'Enrolled'
+        """),
+        ("roster export", """
+            SELECT s.student_id, s.last_name, e.status
+            FROM enrollments e
+            JOIN students s ON e.student_id = s.student_id
+            WHERE e.course_id = %(course_id)s
+              AND e.semester_id = %(semester_id)s
+              AND e.status = 'Enrolled'
+        """),
+    ],
+    "0002": [
+        ("transcript for one term", """
+            SELECT c.course_code, e.status, e.grade
+            FROM enrollments e
+            JOIN courses c ON e.course_id = c.course_id
+            WHERE e.student_id = %(student_id)s
+              AND e.semester_id = %(semester_id)s
+        """),
+        ("student_detail", """
+            SELECT e.enrollment_id, c.course_code, sm.term, sm.year, e.status, e.grade
+            FROM enrollments e
+            JOIN courses c ON e.course_id = c.course_id
+            JOIN semesters sm ON e.semester_id = sm.semester_id
+            WHERE e.student_id = %(student_id)s
+            ORDER BY sm.year DESC, sm.term DESC
+        """),
+    ],
+    "0004": [
+        ("instructor_detail", """
+            SELECT c.course_id, c.course_code
+            FROM courses c
+            WHERE c.instructor_id = %(instructor_id)s
+            ORDER BY c.course_code
+        """),
+        ("confirm_delete_instructor", """
+            SELECT COUNT(*) FROM courses
+            WHERE instructor_id = %(instructor_id)s AND status = 'Active'
+        """),
+    ],
+}
+
+# migration version -> indexes it dropped as superseded, recreated for "before"
+SUPERSEDED = {
+    "0002": ["CREATE INDEX idx_enrollments_student ON enrollments(student_id)"],
+    "0004": ["CREATE INDEX idx_courses_instructor ON courses(instructor_id)"],
+}
+
+
+def plan_indexes(plan):
+    found, nodes = set(), [plan]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            found.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+    return found
+
+
+def with_partitions(cur, indexes):
+    """`indexes` and the indexes of their partitions, which plans name instead."""
+    if not indexes:
+        return set()
+    cur.execute("""
+        WITH RECURSIVE family AS (
+            SELECT c.oid, c.relname FROM pg_class c
+            WHERE c.relname = ANY(%s) AND c.relkind IN ('i', 'I')
+            UNION ALL
+            SELECT c.oid, c.relname
+            FROM family f
+            JOIN pg_inherits i ON i.inhparent = f.oid
+            JOIN pg_class c ON c.oid = i.inhrelid
+        )
+        SELECT relname FROM family
+    """, (list(indexes),))
+    return {r["relname"] for r in cur.fetchall()}
+
+
+def measure(cur, sql, params, repeat):
+    """Median execution time (ms), buffers touched and indexes used."""
+    runs = []
+    for _ in range(repeat + 1):
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+        runs.append(cur.fetchone()["QUERY PLAN"][0])
+    runs = runs[1:]  # the first run only warms the cache
+    plan = runs[-1]["Plan"]
+    return {
+        "median_ms": round(statistics.median(r["Execution Time"] for r in runs), 3),
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+        "indexes": sorted(plan_indexes(plan)),
+    }
+
+
+def run(args):
+    conn = migrations.connect()
+    try:
+        rows = migrations.status(conn)
+    finally:
+        conn.close()
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(PARAMS_SQL)
+    params = cur.fetchone()
+    conn.rollback()
+
+    results = []
+    try:
+        for migration, applied, _ in rows:
+            if migration.version not in QUERIES:
+                continue
+            if not applied:
+                print(f"{migration.version}_{migration.name}: not applied, skipped")
+                continue
+            indexes = migration.concurrent_indexes()
+            family = with_partitions(cur, indexes)
+            conn.rollback()
+
+            for label, sql in QUERIES[migration.version]:
+                after = measure(cur, sql, params, args.repeat)
+                conn.rollback()
+
+                for index in indexes:
+                    cur.execute(f"DROP INDEX {index}")
+                for create in SUPERSEDED.get(migration.version, []):
+                    cur.execute(create)
+                before = measure(cur, sql, params, args.repeat)
+                conn.rollback()
+
+                results.append({"migration": f"{migration.version}_{migration.name}",
+                                "query": label, "before": before, "after": after,
+                                "uses_new_index": bool(family & set(after["indexes"]))})
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+    print(f"{'migration':<38} {'query':<26} {'before ms':>10} {'after ms':>10} "
+          f"{'buffers':>15}  new index used")
+    for r in results:
+        print(f"{r['migration']:<38} {r['query']:<26} {r['before']['median_ms']:>10.3f} "
+              f"{r['after']['median_ms']:>10.3f} "
+              f"{str(r['before']['buffers']) + '->' + str(r['after']['buffers']):>15}  "
+              f"{'yes' if r['uses_new_index'] else 'no'}")
+
+    commit, dirty = git_revision()
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"indexes-{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "git_commit": commit, "git_dirty": dirty, "params": params,
+                   "repeat": args.repeat, "results": results}, fh, indent=2, default=str)
+    print(f"results written to {path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=7,
+                        help="timed runs per query and state (after one warm-up run)")
+    parser.add_argument("--output", help="results file (default bench/results/indexes-<time>-<commit>.json)")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Planning time saved by running the hot read queries as prepared statements.
+
+For each join-heavy query of the main routes, measures on one connection
+  * "plain": the SQL text as the routes sent it before, parsed and planned
+    on every execution, and
+  * "prepared": the same query through app.prepared.execute_prepared,
+    after enough executions for Postgres to settle on a generic plan,
+and reports the median planning and execution time from EXPLAIN ANALYZE
+plus the median wall-clock time of a full round trip (execute + fetch),
+both in autocommit and inside an open transaction that has already run
+the version lookup, as on the @conditional pages (the path most hot
+reads take). Only reads are run. Results are written as JSON next to the load driver's.
+
+    python -m bench.bench_prepared --repeat 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from psycopg2.extras import RealDictCursor
+
+from app.models import get_db_connection
+from app.prepared import execute_prepared, statement_name
+from bench.load_driver import RESULTS_DIR, git_revision
+
+# the student and the course with the most enrollments, the newest open term
+PARAMS_SQL = """
+    SELECT (SELECT student_id FROM enrollments
+            GROUP BY student_id ORDER BY COUNT(*) DESC LIMIT 1) AS student_id,
+           (SELECT course_id FROM course_offerings
+            ORDER BY enrolled_count DESC LIMIT 1) AS course_id,
+           (SELECT semester_id FROM open_semesters
+            ORDER BY start_date DESC LIMIT 1) AS semester_id
+"""
+
+# (label, SQL with %s placeholders, parameter names), copied from the routes
+QUERIES = [
+    ("student_enrollments", """
+        SELECT
+            e.enrollment_id,
+            c.course_code,
+            c.course_name,
+            sm.term,
+            sm.year,
+            e.status,
+            e.grade
+        FROM enrollments e
+        JOIN courses c ON e.course_id = c.course_id
+        JOIN semesters sm ON e.semester_id = sm.semester_id
+        WHERE e.student_id = %s
+        ORDER BY sm.year DESC, sm.term DESC
+    """, ("student_id",)),
+    ("course_detail", """
+        SELECT
+            c.course_id, c.course_code, c.course_name,
+            c.credits, c.level, c.capacity,
+            d.department_name,
+            i.first_name || ' ' || i.last_name AS instructor_name
+        FROM courses c
+        JOIN departments d ON c.department_id = d.department_id
+        JOIN instructors i ON c.instructor_id = i.instructor_id
+        WHERE c.course_id=%s
+    """, ("course_id",)),
+    ("course_offerings", """
+        SELECT o.offering_id, o.semester_id, sm.term, sm.year,
+               o.capacity, o.enrolled_count,
+               i.first_name || ' ' || i.last_name AS instructor_name,
+               (os.semester_id IS NOT NULL) AS is_open
+        FROM course_offerings o
+        JOIN semesters sm ON o.semester_id = sm.semester_id
+        LEFT JOIN instructors i ON o.instructor_id = i.instructor_id
+        LEFT JOIN open_semesters os ON o.semester_id = os.semester_id
+        WHERE o.course_id=%s
+        ORDER BY sm.start_date DESC
+    """, ("course_id",)),
+    ("enroll_offerings", """
+        SELECT
+            o.offering_id,
+            o.semester_id,
+            os.term,
+            os.year,
+            c.course_code,
+            c.course_name,
+            c.credits,
+            o.capacity,
+            o.enrolled_count
+        FROM open_semesters os
+        JOIN course_offerings o ON o.semester_id = os.semester_id
+        JOIN courses c ON o.course_id = c.course_id
+        WHERE c.status='Active'
+        ORDER BY os.start_date DESC, c.course_code
+    """, ()),
+    ("course_list", """
+        SELECT c.course_id, c.course_code, c.course_name, c.credits, c.status,
+               COALESCE(t.enrolled_count, 0) AS enrolled_count,
+               COALESCE(t.capacity, c.capacity) AS capacity
+        FROM courses c
+        LEFT JOIN LATERAL (
+            SELECT SUM(o.enrolled_count) AS enrolled_count,
+                   SUM(o.capacity) AS capacity
+            FROM course_offerings o
+            JOIN open_semesters os ON os.semester_id = o.semester_id
+            WHERE o.course_id = c.course_id
+        ) t ON TRUE
+     WHERE c.status = 'Active' ORDER BY c.course_code ASC LIMIT 51""", ()),
+    ("enrollment_list", """
+        SELECT e.enrollment_id, e.student_id,
+               s.first_name || ' ' || s.last_name AS student_name,
+               e.course_id, c.course_code, c.course_name,
+               e.status, e.grade,
+               sm.term, sm.year
+        FROM enrollments e
+        JOIN students s ON e.student_id = s.student_id
+        JOIN courses c ON e.course_id = c.course_id
+        JOIN semesters sm ON e.semester_id = sm.semester_id
+     WHERE e.status = 'Enrolled' AND s.status = 'Active' AND c.status = 'Active'
+       AND e.semester_id = %s ORDER BY e.enrollment_id ASC LIMIT %s""",
+     ("semester_id", "limit")),
+]
+
+
+def explain_times(cur, sql, params, repeat):
+    """Median planning and execution time (ms) from EXPLAIN ANALYZE."""
+    planning, execution = [], []
+    for _ in range(repeat):
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+        plan = cur.fetchone()["QUERY PLAN"][0]
+        planning.append(plan["Planning Time"])
+        execution.append(plan["Execution Time"])
+    return round(statistics.median(planning), 4), round(statistics.median(execution), 4)
+
+
+def round_trips(run, repeat):
+    """Median wall-clock time (ms) of `run`, which executes and fetches."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 4)
+
+
+# what data_version() runs before the view on a @conditional page
+VERSION_SQL = """
+    SELECT table_name AS name, SUM(version) AS version, MAX(updated_at) AS updated_at
+    FROM table_versions
+    WHERE table_name = ANY(%s)
+    GROUP BY table_name
+"""
+
+
+def round_trips_in_transaction(cur, run, repeat):
+    """
+    Median wall-clock time (ms) of `run` inside a transaction opened by the
+    version lookup, which is not timed; the transaction is rolled back after.
+    """
+    conn = cur.connection
+    conn.autocommit = False
+    times = []
+    try:
+        for _ in range(repeat):
+            cur.execute(VERSION_SQL, (["enrollments", "students", "courses"],))
+            cur.fetchall()
+            start = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - start) * 1000)
+            conn.rollback()
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+    return round(statistics.median(times), 4)
+
+
+def run(args):
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(PARAMS_SQL)
+    values = dict(cur.fetchone(), limit=51)
+    conn.rollback()
+
+    # one autocommit session, as the routes' reads run outside a long
+    # transaction; the prepared statements stay for the whole run
+    conn.autocommit = True
+    results = []
+    try:
+        for label, sql, names in QUERIES:
+            params = tuple(values[n] for n in names)
+
+            def plain():
+                cur.execute(sql, params)
+                cur.fetchall()
+
+            def prepared():
+                execute_prepared(cur, label, sql, params)
+                cur.fetchall()
+
+            plain()  # warm the buffer cache
+            plain_plan, plain_exec = explain_times(cur, sql, params, args.explain)
+            plain_ms = round_trips(plain, args.repeat)
+
+            # past the five custom plans, so a generic plan can be chosen
+            for _ in range(args.warmup):
+                prepared()
+            name = statement_name(label, sql)
+            execute = f"EXECUTE {name}" + (f"({', '.join(['%s'] * len(params))})" if params else "")
+            prepared_plan, prepared_exec = explain_times(cur, execute, params, args.explain)
+            prepared_ms = round_trips(prepared, args.repeat)
+            plain_tx_ms = round_trips_in_transaction(cur, plain, args.repeat)
+            prepared_tx_ms = round_trips_in_transaction(cur, prepared, args.repeat)
+
+            cur.execute("SELECT to_jsonb(p) AS info FROM pg_prepared_statements p WHERE name = %s",
+                        (name,))
+            info = cur.fetchone()["info"]
+
+            results.append({
+                "query": label,
+                "plain": {"planning_ms": plain_plan, "execution_ms": plain_exec,
+                          "round_trip_ms": plain_ms, "in_transaction_ms": plain_tx_ms},
+                "prepared": {"planning_ms": prepared_plan, "execution_ms": prepared_exec,
+                             "round_trip_ms": prepared_ms,
+                             "in_transaction_ms": prepared_tx_ms},
+                # pg_prepared_statements has these columns from PostgreSQL 14
+                "generic_plans": info.get("generic_plans"),
+                "custom_plans": info.get("custom_plans"),
+            })
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"{'query':<22} {'plan ms':>16} {'exec ms':>16} {'round trip ms':>18} "
+          f"{'in transaction ms':>20}  generic plans")
+    for r in results:
+        p, q = r["plain"], r["prepared"]
+        print(f"{r['query']:<22} "
+              f"{p['planning_ms']:>7.3f} -> {q['planning_ms']:<6.3f} "
+              f"{p['execution_ms']:>7.3f} -> {q['execution_ms']:<6.3f} "
+              f"{p['round_trip_ms']:>8.3f} -> {q['round_trip_ms']:<7.3f} "
+              f"{p['in_transaction_ms']:>9.3f} -> {q['in_transaction_ms']:<8.3f}  "
+              f"{'n/a' if r['generic_plans'] is None else r['generic_plans']}")
+
+    commit, dirty = git_revision()
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"prepared-{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "git_commit": commit, "git_dirty": dirty, "params": values,
+                   "repeat": args.repeat, "explain": args.explain, "warmup": args.warmup,
+                   "results": results}, fh, indent=2, default=str)
+    print(f"results written to {path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="timed round trips per query and mode")
+    parser.add_argument("--explain", type=int, default=20,
+                        help="EXPLAIN ANALYZE runs per query and mode")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="prepared executions before measuring (generic plan after 5)")
+    parser.add_argument("--output", help="results file (default bench/results/prepared-<time>-<commit>.json)")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
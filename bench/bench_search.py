@@ -0,0 +1,195 @@
+"""
+Latency of the trigram search behind /search and /api/search.
+
+Builds queries from rows already in the database (run bench.generate_data
+first for realistic sizes; the target is 100k students): for each kind, a
+sample of full names, three-letter prefixes, names with one typo and, for
+students, numeric ids. Each query runs through app.search.search on one
+connection as the API runs it (a prepared statement, top --limit rows),
+and the script reports the median and 95th percentile wall-clock time per
+kind and query shape. It also EXPLAINs one query of each shape and fails
+when the searched table is read with a sequential scan, or when a 95th
+percentile is over --target-ms. Results are written as JSON next to the
+load driver's.
+
+    python -m bench.bench_search --sample 200 --target-ms 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from psycopg2.extras import RealDictCursor
+
+from app import create_app
+from app.instrumentation import set_slow_query_hook
+from app.models import get_db_connection
+from app.search import SEARCHES, normalize_query, search
+from bench.load_driver import RESULTS_DIR, git_revision
+
+# (kind, table, SQL for the text the queries are made from)
+SOURCES = [
+    ("students", "students", "first_name || ' ' || last_name"),
+    ("courses", "courses", "course_name"),
+    ("instructors", "instructors", "first_name || ' ' || last_name"),
+]
+
+
+def typo(rng, text):
+    """`text` with one letter replaced, dropped or doubled."""
+    i = rng.randrange(len(text))
+    edit = rng.choice(("replace", "drop", "double"))
+    if edit == "replace":
+        return text[:i] + rng.choice("aeiourstln") + text[i + 1:]
+    if edit == "drop" and len(text) > 3:
+        return text[:i] + text[i + 1:]
+    return text[:i] + text[i] + text[i:]
+
+
+def make_queries(cur, rng, sample):
+    """kind -> [(shape, query)], from a random sample of each table."""
+    queries = {}
+    for kind, table, text in SOURCES:
+        cur.execute(f"SELECT {text} AS text, {SEARCHES[kind]['id'].split('.')[1]} AS id "
+                    f"FROM {table} ORDER BY random() LIMIT %s", (sample,))
+        rows = cur.fetchall()
+        shapes = []
+        for r in rows:
+            shapes.append(("full", r["text"]))
+            shapes.append(("prefix", r["text"][:3]))
+            shapes.append(("typo", typo(rng, r["text"])))
+            if kind == "students":
+                shapes.append(("id", str(r["id"])))
+        queries[kind] = [(shape, q) for shape, q in shapes if normalize_query(q)]
+    return queries
+
+
+def seq_scanned(plan, table):
+    found, nodes = False, [plan]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") == table:
+            found = True
+        nodes.extend(node.get("Plans", []))
+    return found
+
+
+def explain(cur, kind, q, limit, sent):
+    """EXPLAIN the statement search() sends for `q` (as captured into `sent`)."""
+    sent.clear()
+    search(cur, kind, q, limit)
+    # after the warm-up this is the EXECUTE of the prepared statement
+    statement = sent[-1].split("; ")[-1]
+    cur.execute("EXPLAIN (FORMAT JSON) " + statement)
+    return cur.fetchone()["QUERY PLAN"][0]["Plan"]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    app = create_app({"QUERY_METRICS": True, "SLOW_QUERY_MS": 0,
+                      "CACHE_INVALIDATION_LISTENER": False})
+
+    # the statements search() sends, kept only while `sent` is being watched
+    sent, watching = [], []
+
+    def capture(cursor, query, vars, duration):
+        if watching:
+            sent.append(cursor.mogrify(query, vars).decode())
+
+    set_slow_query_hook(0.0, capture)
+
+    with app.test_request_context("/api/search"):
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT relname, reltuples::BIGINT AS rows
+            FROM pg_class WHERE relname IN ('students', 'courses', 'instructors')
+        """)
+        sizes = {r["relname"]: r["rows"] for r in cur.fetchall()}
+        queries = make_queries(cur, rng, args.sample)
+        conn.rollback()
+
+        # reads run outside a long transaction, as on the pooled connections
+        conn.autocommit = True
+        results, failures = [], []
+        try:
+            for kind, table, _ in SOURCES:
+                by_shape = {}
+                for shape, q in queries[kind]:
+                    by_shape.setdefault(shape, []).append(normalize_query(q))
+
+                for shape, qs in by_shape.items():
+                    for q in qs[:args.warmup]:
+                        search(cur, kind, q, args.limit)
+
+                    times, hits = [], 0
+                    for q in qs:
+                        start = time.perf_counter()
+                        rows = search(cur, kind, q, args.limit)
+                        times.append((time.perf_counter() - start) * 1000)
+                        hits += bool(rows)
+
+                    watching.append(True)
+                    plan = explain(cur, kind, qs[0], args.limit, sent)
+                    watching.clear()
+                    times.sort()
+                    result = {
+                        "kind": kind, "shape": shape, "queries": len(qs),
+                        "p50_ms": round(statistics.median(times), 3),
+                        "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+                        "hit_rate": round(hits / len(qs), 3),
+                        "seq_scan": seq_scanned(plan, table),
+                    }
+                    results.append(result)
+                    if result["seq_scan"]:
+                        failures.append(f"{kind}/{shape}: {table} read with a sequential scan")
+                    if result["p95_ms"] > args.target_ms:
+                        failures.append(f"{kind}/{shape}: p95 {result['p95_ms']} ms "
+                                        f"over {args.target_ms} ms")
+        finally:
+            cur.close()
+            conn.close()
+
+    print(f"{'kind':<12} {'shape':<7} {'rows':>9} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'hits':>6}  plan")
+    for r in results:
+        print(f"{r['kind']:<12} {r['shape']:<7} {sizes.get(r['kind'], 0):>9} {r['queries']:>5} "
+              f"{r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} {r['hit_rate']:>6.0%}  "
+              f"{'seq scan' if r['seq_scan'] else 'index'}")
+
+    commit, dirty = git_revision()
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"search-{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "git_commit": commit, "git_dirty": dirty, "table_rows": sizes,
+                   "limit": args.limit, "target_ms": args.target_ms, "seed": args.seed,
+                   "results": results}, fh, indent=2)
+    print(f"results written to {path}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sample", type=int, default=200,
+                        help="rows per table the queries are made from")
+    parser.add_argument("--limit", type=int, default=10, help="results per query (top-k)")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="queries per shape run before timing (past the custom plans)")
+    parser.add_argument("--target-ms", type=float, default=20.0,
+                        help="fail when a 95th percentile is over this")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default bench/results/search-<time>-<commit>.json)")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Speed and correctness of the in-process what-if GPA engine (app/whatif.py).
+
+Loads the GradeBook from the database (two binary COPYs), or builds one
+from --synthetic N random enrollments without a database, then times
+the what-if scenarios the /reports/what-if page runs over the whole
+student body and over one department's cohort (median of --repeat runs).
+For comparison it times the same scenario computed row by row in Python
+over dict rows, as a RealDictCursor loop would. That loop runs over
+--loop-rows rows and is extrapolated to the full size.
+
+Against a database it also checks that the engine's current GPA matches
+students.gpa (kept by the GPA triggers, as calculate_student_gpa
+computes it) for every student, and fails on any mismatch. Results are
+written as JSON next to the load driver's.
+
+    python -m bench.bench_whatif --repeat 20
+    python -m bench.bench_whatif --synthetic 5000000 --students 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.models import get_db_connection
+from app.whatif import GradeBook
+from bench.load_driver import RESULTS_DIR, git_revision
+
+# grade points in hundredths for the synthetic grades, as in grade_points
+LETTER_POINTS = {"A": 400, "A-": 370, "B+": 330, "B": 300, "B-": 270, "C+": 230,
+                 "C": 200, "C-": 170, "D+": 130, "D": 100, "F": 0}
+
+# (label, what_if() keyword arguments)
+SCENARIOS = [
+    ("current", dict(pending=None)),
+    ("pending at B", dict(pending="B")),
+    ("pending at C-", dict(pending="C-")),
+    ("pending at own GPA", dict(pending="current")),
+]
+
+
+def synthetic_book(rows, students, seed):
+    """A GradeBook of `rows` random enrollments (a tenth of them pending)."""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, students + 1, dtype=np.int32)
+    student_data = {
+        "student_id": ids,
+        "department_id": rng.integers(1, 20, students, dtype=np.int32),
+        "enrollment_year": rng.integers(2015, 2026, students).astype(np.int16),
+        "status": rng.choice(np.array([0, 1, 2], dtype=np.int16), students, p=[0.8, 0.15, 0.05]),
+    }
+    points = rng.choice(np.array(list(LETTER_POINTS.values()), dtype=np.int16), rows)
+    points[rng.random(rows) < 0.1] = -1
+    enrollments = {
+        "student_id": rng.choice(ids, rows),
+        "course_id": rng.integers(1, 2000, rows, dtype=np.int32),
+        "semester_id": rng.integers(1, 20, rows, dtype=np.int32),
+        "credits": rng.choice(np.array([1, 2, 3, 4, 5], dtype=np.int16), rows,
+                              p=[0.03, 0.07, 0.5, 0.35, 0.05]),
+        "points": points,
+    }
+    return GradeBook(student_data, enrollments, dict(LETTER_POINTS))
+
+
+def loop_gpa(rows, pending_points, threshold):
+    """The 'pending at X' scenario the slow way: Python over one dict per row."""
+    totals = {}
+    for r in rows:
+        points = r["points"] if r["points"] >= 0 else pending_points
+        t = totals.setdefault(r["student_id"], [0, 0])
+        t[0] += r["credits"] * points
+        t[1] += r["credits"]
+    gpas = [q / c / 100 for q, c in totals.values() if c]
+    return sum(1 for g in gpas if g < threshold)
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def check_stored_gpa(conn, book):
+    """Students whose stored GPA differs from the engine's current GPA."""
+    cur = conn.cursor()
+    cur.execute("SELECT student_id, (gpa * 100)::INTEGER FROM students "
+                "WHERE attempted_credits > 0 AND gpa IS NOT NULL")
+    stored = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 2)
+    cur.close()
+    conn.rollback()
+
+    index = np.searchsorted(book.students["student_id"], stored[:, 0])
+    mismatched = book.base_gpa[index] != stored[:, 1]
+    return int(mismatched.sum()), stored[mismatched][:10].tolist()
+
+
+def run(args):
+    mismatches, examples, load_ms = None, [], None
+    if args.synthetic:
+        book = synthetic_book(args.synthetic, args.students, args.seed)
+        source = f"synthetic ({args.synthetic} enrollments, {args.students} students)"
+    else:
+        conn = get_db_connection()
+        start = time.perf_counter()
+        book = GradeBook.load(conn)
+        load_ms = round((time.perf_counter() - start) * 1000, 1)
+        conn.rollback()
+        mismatches, examples = check_stored_gpa(conn, book)
+        conn.close()
+        source = "database"
+
+    students = len(book.students["student_id"])
+    department = int(np.bincount(book.students["department_id"]).argmax())
+    cohorts = [("all students", book.cohort()),
+               (f"department {department}", book.cohort(department_id=department))]
+
+    results = []
+    for cohort, mask in cohorts:
+        for label, scenario in SCENARIOS:
+            ms = timed(lambda: book.what_if(mask, threshold=2.0, **scenario), args.repeat)
+            results.append({"cohort": cohort, "scenario": label, "median_ms": ms})
+
+    # the same 'pending at B' over dict rows, on a slice of the enrollments
+    n = min(args.loop_rows, len(book))
+    rows = [{"student_id": int(s), "credits": int(c), "points": int(p)}
+            for s, c, p in zip(book.student[:n], book.credits[:n], book.points[:n])]
+    loop_ms = timed(lambda: loop_gpa(rows, LETTER_POINTS["B"], 2.0), 1)
+    loop_full_ms = round(loop_ms * len(book) / max(n, 1), 1)
+
+    print(f"source: {source}; {len(book)} enrollments, {students} students"
+          + (f"; loaded in {load_ms} ms" if load_ms is not None else ""))
+    print(f"{'cohort':<18} {'scenario':<20} {'median ms':>10}")
+    for r in results:
+        print(f"{r['cohort']:<18} {r['scenario']:<20} {r['median_ms']:>10.3f}")
+    print(f"python loop over dict rows: {loop_ms:.1f} ms for {n} rows "
+          f"(~{loop_full_ms:.0f} ms for all {len(book)})")
+    if mismatches is not None:
+        print(f"current GPA vs students.gpa: {mismatches} mismatch(es)"
+              + (f", e.g. (student_id, stored hundredths) {examples}" if mismatches else ""))
+
+    commit, dirty = git_revision()
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"whatif-{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "git_commit": commit, "git_dirty": dirty, "source": source,
+                   "enrollments": len(book), "students": students, "load_ms": load_ms,
+                   "repeat": args.repeat, "results": results,
+                   "loop": {"rows": n, "ms": loop_ms, "extrapolated_ms": loop_full_ms},
+                   "gpa_mismatches": mismatches}, fh, indent=2)
+    print(f"results written to {path}")
+    return 1 if mismatches else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=20, help="runs per scenario (median)")
+    parser.add_argument("--synthetic", type=int, metavar="ROWS",
+                        help="use this many random enrollments instead of the database")
+    parser.add_argument("--students", type=int, default=100000,
+                        help="students in the synthetic data")
+    parser.add_argument("--loop-rows", type=int, default=500000,
+                        help="rows the Python loop baseline runs over")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default bench/results/whatif-<time>-<commit>.json)")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
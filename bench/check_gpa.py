@@ -0,0 +1,217 @@
+"""
+Randomized equivalence check for the incremental GPA triggers.
+
+Creates throwaway students and course offerings (with varying credits)
+inside one transaction, posts random grade sets through every path the
+triggers cover (inserting completed rows, bulk grading, regrading,
+un-completing, deleting, changing a course's credits) and after each step
+compares the students' running totals and GPA with a full recomputation:
+the credit-weighted average of the original calculate_student_gpa() CASE
+ladder. The transaction is rolled back at the end, so nothing is left
+behind.
+
+    python -m bench.check_gpa --students 300 --courses 12 --rounds 5 --seed 42
+"""
+import argparse
+import random
+import sys
+from datetime import datetime
+
+from psycopg2.extras import RealDictCursor
+
+from app.models import get_db_connection
+
+# full recomputation using the grade ladder from before grade_points existed
+REFERENCE_GPA_SQL = """
+    SELECT s.student_id,
+           s.gpa AS stored,
+           s.quality_points AS stored_points,
+           s.attempted_credits AS stored_credits,
+           r.points AS expected_points,
+           r.credits AS expected_credits,
+           ROUND(r.points / NULLIF(r.credits, 0), 2) AS expected
+    FROM students s
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(SUM(c.credits * x.pts), 0) AS points,
+               COALESCE(SUM(c.credits) FILTER (WHERE x.pts IS NOT NULL), 0) AS credits
+        FROM enrollments e
+        JOIN courses c ON c.course_id = e.course_id
+        CROSS JOIN LATERAL (
+            SELECT
+                   CASE
+                       WHEN grade = 'A'  THEN 4.0
+                       WHEN grade = 'A-' THEN 3.7
+                       WHEN grade = 'B+' THEN 3.3
+                       WHEN grade = 'B'  THEN 3.0
+                       WHEN grade = 'B-' THEN 2.7
+                       WHEN grade = 'C+' THEN 2.3
+                       WHEN grade = 'C'  THEN 2.0
+                       WHEN grade = 'C-' THEN 1.7
+                       WHEN grade = 'D+' THEN 1.3
+                       WHEN grade = 'D'  THEN 1.0
+                       WHEN grade = 'F'  THEN 0.0
+
+                       WHEN grade ~ '^[0-9]{1,3}$' THEN
+                           CASE
+                               WHEN grade::INTEGER >= 93 THEN 4.0
+                               WHEN grade::INTEGER >= 90 THEN 3.7
+                               WHEN grade::INTEGER >= 87 THEN 3.3
+                               WHEN grade::INTEGER >= 83 THEN 3.0
+                               WHEN grade::INTEGER >= 80 THEN 2.7
+                               WHEN grade::INTEGER >= 77 THEN 2.3
+                               WHEN grade::INTEGER >= 73 THEN 2.0
+                               WHEN grade::INTEGER >= 70 THEN 1.7
+                               WHEN grade::INTEGER >= 67 THEN 1.3
+                               WHEN grade::INTEGER >= 60 THEN 1.0
+                               ELSE 0.0
+                           END
+                       ELSE NULL
+                   END AS pts
+        ) x
+        WHERE e.student_id = s.student_id
+          AND e.status = 'Completed'
+          AND e.grade IS NOT NULL
+    ) r
+    WHERE s.student_id = ANY(%s)
+"""
+
+LETTERS = ["A", "A-", "B+", "B", "B-", "C+", "C", "C-", "D+", "D", "F"]
+UNMAPPED = ["P", "W", "I", "A+", "1000", "9a", "", " 90"]
+
+
+def random_grade(rng):
+    pick = rng.random()
+    if pick < 0.55:
+        return rng.choice(LETTERS)
+    if pick < 0.90:
+        # numeric grades, including zero-padded ones such as '07' or '093'
+        width = rng.choice([1, 2, 3])
+        return str(rng.randint(0, 10 ** width - 1)).zfill(width)
+    return rng.choice(UNMAPPED)
+
+
+def setup(cur, students, courses):
+    cur.execute("SELECT department_id, instructor_id FROM instructors ORDER BY instructor_id LIMIT 1")
+    owner = cur.fetchone()
+    tag = datetime.now().strftime("%H%M%S%f")
+
+    cur.execute("""
+        INSERT INTO students (first_name, last_name, email, department_id, enrollment_year, status)
+        SELECT 'Gpa', 'Check ' || n, 'gpa-check-' || %s || '-' || n || '@bench.invalid',
+               %s, %s, 'Active'
+        FROM generate_series(1, %s) AS n
+        RETURNING student_id
+    """, (tag, owner["department_id"], datetime.now().year, students))
+    student_ids = [r["student_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO courses
+            (course_code, course_name, credits, level, capacity, department_id, instructor_id, status)
+        SELECT 'GC' || %s || n, 'GPA Check ' || n, 1 + n %% 5, 'Undergraduate', %s, %s, %s, 'Active'
+        FROM generate_series(1, %s) AS n
+        RETURNING course_id
+    """, (tag[-8:], students, owner["department_id"], owner["instructor_id"], courses))
+    course_ids = [r["course_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO course_offerings (course_id, semester_id, instructor_id, capacity)
+        SELECT c.course_id, sm.semester_id, c.instructor_id, c.capacity
+        FROM courses c CROSS JOIN semesters sm
+        WHERE c.course_id = ANY(%s)
+        RETURNING offering_id
+    """, (course_ids,))
+    offering_ids = [r["offering_id"] for r in cur.fetchall()]
+
+    return student_ids, course_ids, offering_ids
+
+
+def compare(cur, student_ids, label):
+    cur.execute(REFERENCE_GPA_SQL, (student_ids,))
+    rows = cur.fetchall()
+    bad = [r for r in rows
+           if (r["stored"], r["stored_points"], r["stored_credits"])
+           != (r["expected"], r["expected_points"], r["expected_credits"])]
+    print(f"{label:<28} checked={len(rows):<6} mismatches={len(bad)}")
+    for r in bad[:5]:
+        print(f"    student {r['student_id']}: stored={r['stored']} "
+              f"({r['stored_points']}/{r['stored_credits']}) expected={r['expected']} "
+              f"({r['expected_points']}/{r['expected_credits']})")
+    return not bad
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    ok = True
+
+    try:
+        student_ids, course_ids, offering_ids = setup(cur, args.students, args.courses)
+
+        for rnd in range(1, args.rounds + 1):
+            # 1. completed rows inserted directly (one INSERT statement)
+            pairs = {(s, o) for s in student_ids for o in rng.sample(offering_ids, 2)}
+            cur.execute("DELETE FROM enrollments WHERE student_id = ANY(%s)", (student_ids,))
+            rows = [(s, o, rng.choice(["Completed", "Enrolled"]), random_grade(rng))
+                    for s, o in pairs]
+            cur.execute("""
+                INSERT INTO enrollments (student_id, offering_id, course_id, semester_id, status, grade)
+                SELECT v.student_id, v.offering_id, o.course_id, o.semester_id, v.status,
+                       CASE WHEN v.status = 'Completed' THEN v.grade END
+                FROM UNNEST(%s::INTEGER[], %s::INTEGER[], %s::TEXT[], %s::TEXT[])
+                     AS v(student_id, offering_id, status, grade)
+                JOIN course_offerings o ON o.offering_id = v.offering_id
+            """, ([r[0] for r in rows], [r[1] for r in rows],
+                  [r[2] for r in rows], [r[3] for r in rows]))
+            ok &= compare(cur, student_ids, f"round {rnd}: insert")
+
+            # 2. bulk grade posting and regrading in one UPDATE
+            cur.execute("SELECT enrollment_id FROM enrollments WHERE student_id = ANY(%s)",
+                        (student_ids,))
+            ids = [r["enrollment_id"] for r in cur.fetchall()]
+            chosen = rng.sample(ids, len(ids) // 2)
+            cur.execute("""
+                UPDATE enrollments e
+                SET grade = v.grade, status = 'Completed'
+                FROM UNNEST(%s::INTEGER[], %s::TEXT[]) AS v(enrollment_id, grade)
+                WHERE e.enrollment_id = v.enrollment_id
+            """, (chosen, [random_grade(rng) for _ in chosen]))
+            ok &= compare(cur, student_ids, f"round {rnd}: grade/regrade")
+
+            # 3. some completed rows moved out of Completed
+            chosen = rng.sample(ids, len(ids) // 5)
+            cur.execute("""
+                UPDATE enrollments SET status = 'Dropped'
+                WHERE enrollment_id = ANY(%s) AND status = 'Completed'
+            """, (chosen,))
+            ok &= compare(cur, student_ids, f"round {rnd}: un-complete")
+
+            # 4. deletes
+            chosen = rng.sample(ids, len(ids) // 5)
+            cur.execute("DELETE FROM enrollments WHERE enrollment_id = ANY(%s)", (chosen,))
+            ok &= compare(cur, student_ids, f"round {rnd}: delete")
+
+            # 5. a course's credits change
+            cur.execute("UPDATE courses SET credits = %s WHERE course_id = %s",
+                        (rng.randint(1, 6), rng.choice(course_ids)))
+            ok &= compare(cur, student_ids, f"round {rnd}: credit change")
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+    print("PASS: running GPA totals match a full recomputation" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--courses", type=int, default=12)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=None)
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
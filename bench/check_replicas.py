@@ -0,0 +1,144 @@
+"""
+Check read/write splitting and read-your-writes through the Flask app.
+
+Runs the app with DB_REPLICA_DSNS set to --replica (by default the
+database from DB_HOST / DB_NAME / DB_USER / DB_PASSWORD, so one instance
+poses as both primary and replica) and checks, for one student, that
+
+  * a GET reads from the replica, on a read-only connection,
+  * the POST of the edit form writes to the primary,
+  * the redirect after it shows the edit (pinned to the primary in "pin"
+    mode, from a caught-up replica in "lsn" mode),
+  * another session keeps reading from the replica meanwhile, and
+  * the session reads from the replica again once the window has passed.
+
+The student's name is restored afterwards. Exits non-zero on failure.
+
+    python -m bench.check_replicas --replica "host=replica1 dbname=course_enrollment" --mode lsn
+"""
+import argparse
+import sys
+import time
+import uuid
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from flask import g
+from psycopg2.extras import RealDictCursor
+
+from app import create_app
+from app.models import _connect_kwargs, get_db_connection
+
+
+def default_dsn():
+    kwargs = _connect_kwargs()
+    return psycopg2.extensions.make_dsn(dbname=kwargs.pop("database"), **kwargs)
+
+
+def run(args):
+    app = create_app({
+        "SECRET_KEY": "replica-check",
+        "DB_REPLICA_DSNS": [args.replica or default_dsn()],
+        "DB_READ_YOUR_WRITES": args.mode,
+        "DB_READ_YOUR_WRITES_WINDOW": args.window,
+        "CACHE_INVALIDATION_LISTENER": False,
+        "CONDITIONAL_GET": False,
+    })
+
+    # which side served each request, and whether that connection was read-only
+    served = []
+
+    @app.after_request
+    def record(response):
+        conn = g.get("db_conn")
+        if conn is not None:
+            served.append(("replica" if g.db_replica else "primary", conn.readonly))
+        return response
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT student_id, first_name, last_name, email, department_id, enrollment_year, status
+        FROM students
+        WHERE status = 'Active'
+        ORDER BY student_id
+        LIMIT 1
+    """)
+    student = cur.fetchone()
+    conn.rollback()
+    if student is None:
+        print("no active student to edit")
+        return 1
+
+    url = f"/students/{student['student_id']}"
+    form = {k: str(v) for k, v in student.items() if k != "student_id"}
+    marker = "Replica" + uuid.uuid4().hex[:6]
+    failures = []
+
+    def check(label, ok, detail=""):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}" + (f" ({detail})" if detail and not ok else ""))
+        if not ok:
+            failures.append(label)
+
+    def request(client, method, path, data=None):
+        served.clear()
+        resp = client.open(path, method=method, data=data)
+        return resp, (served[-1] if served else (None, None))
+
+    writer = app.test_client()
+    reader = app.test_client()
+    try:
+        resp, (side, readonly) = request(writer, "GET", url)
+        check("GET reads from the replica", resp.status_code == 200 and side == "replica", side)
+        check("replica connection is read-only", readonly is True)
+
+        resp, (side, _) = request(writer, "POST", url + "/edit", dict(form, first_name=marker))
+        check("POST writes to the primary", resp.status_code == 302 and side == "primary", side)
+
+        resp, (side, _) = request(writer, "GET", url)
+        check("redirect target shows the write", marker in resp.get_data(as_text=True))
+        if args.mode == "pin":
+            check("writer session is pinned to the primary", side == "primary", side)
+
+        resp, (side, _) = request(reader, "GET", url)
+        check("other sessions still read from the replica", side == "replica", side)
+
+        time.sleep(args.window + 0.1)
+        resp, (side, _) = request(writer, "GET", url)
+        check("writer reads from the replica after the window", side == "replica", side)
+    finally:
+        cur.execute("""
+            UPDATE students SET first_name = %s WHERE student_id = %s
+        """, (student["first_name"], student["student_id"]))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    # the replica connection refuses writes even when it is the primary
+    with app.test_request_context(url, method="GET"):
+        replica = get_db_connection()
+        try:
+            replica.cursor().execute("UPDATE students SET first_name = first_name WHERE FALSE")
+            check("writes on a replica connection fail", False, "UPDATE succeeded")
+        except psycopg2.errors.ReadOnlySqlTransaction:
+            check("writes on a replica connection fail", True)
+        finally:
+            replica.rollback()
+
+    print(f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--replica", help="libpq DSN of the replica (default: the primary itself)")
+    parser.add_argument("--mode", choices=("pin", "lsn"), default="pin",
+                        help="DB_READ_YOUR_WRITES mode to check")
+    parser.add_argument("--window", type=float, default=2.0,
+                        help="DB_READ_YOUR_WRITES_WINDOW in seconds")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
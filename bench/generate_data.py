@@ -0,0 +1,429 @@
+"""
+Synthetic data generator for benchmarks.
+
+Adds departments, instructors, students, courses, semesters, a course
+offering for every generated course in every term, and enrollments to the
+current database, streamed in with COPY. Popularity is skewed the way real
+registrations are: department sizes and course demand follow Zipf-like
+distributions, most picks stay inside the student's own department, and
+each student is active for a contiguous run of terms starting at their
+entry year. Terms that have ended get Completed rows with letter grades
+(and some Dropped / Withdrawn ones); the open terms get Enrolled rows.
+
+Everything is loaded in one transaction. The per-row seat trigger and the
+GPA insert trigger on enrollments are disabled for the load (ALTER TABLE
+needs the table owner), then course_offerings.enrolled_count and the GPA
+totals are rebuilt in one pass each, and offerings in the open terms get
+their capacity raised to at least their enrollment. The data-version
+triggers of every loaded table are disabled as well, so no transition
+table of the loaded rows is built; the versions are bumped once at the
+end instead. The tables being extended are locked against other writers
+while it runs. The same --seed
+gives the same data on the same starting database.
+
+    python -m bench.generate_data --students 50000 --courses 2000 \\
+        --semesters 20 --enrollments 5000000 --seed 1
+"""
+import argparse
+import bisect
+import itertools
+import random
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+from psycopg2.extras import RealDictCursor
+
+from app.models import get_db_connection
+from app.partitions import TERMS
+
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie",
+               "Avery", "Quinn", "Drew", "Reese", "Rowan", "Sage", "Emerson", "Kai",
+               "Noor", "Wei", "Priya", "Mateo", "Lena", "Omar", "Yuki", "Ines"]
+LAST_NAMES = ["Nguyen", "Garcia", "Smith", "Kim", "Patel", "Chen", "Lopez", "Brown",
+              "Singh", "Martin", "Khan", "Rossi", "Novak", "Silva", "Ito", "Moreau",
+              "Ali", "Okafor", "Larsen", "Meyer", "Cohen", "Walsh", "Costa", "Park"]
+TITLES = ["Professor", "Associate Professor", "Assistant Professor", "Lecturer"]
+LETTERS = ["A", "A-", "B+", "B", "B-", "C+", "C", "C-", "D+", "D", "F"]
+LETTER_WEIGHTS = [18, 14, 13, 14, 10, 8, 8, 5, 3, 3, 4]
+CREDITS = [1, 2, 3, 4, 5]
+CREDIT_WEIGHTS = [3, 7, 50, 35, 5]
+
+# share of a student's picks drawn from their own department
+HOME_DEPARTMENT_SHARE = 0.6
+# terms a student stays active for
+MIN_ACTIVE_TERMS, MAX_ACTIVE_TERMS = 6, 10
+# tables with trg_<table>_version_insert / _update triggers (section 26)
+VERSIONED_TABLES = ("departments", "semesters", "instructors", "students", "courses",
+                    "course_offerings", "enrollments")
+
+
+class CopySource:
+    """File-like object that feeds COPY from an iterator of text lines."""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ""
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks, length = [self._buffer], len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_lines(cur, table, columns, lines):
+    """COPY tab-separated lines (\\N for NULL) into table; returns the row count."""
+    source = CopySource(lines)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", source, size=1 << 16)
+    return source.rows
+
+
+def row(*values):
+    return "\t".join(r"\N" if v is None else str(v) for v in values) + "\n"
+
+
+def zipf_weights(n, s, rng):
+    """Zipf(s) weights over n items, randomly assigned to ranks."""
+    weights = [1.0 / (rank ** s) for rank in range(1, n + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def reserve_ids(cur, table, column, count):
+    """First id of a block of `count` ids, taken past the current maximum."""
+    cur.execute(f"SELECT COALESCE(MAX({column}), 0) AS top FROM {table}")
+    first = cur.fetchone()["top"] + 1
+    cur.execute("SELECT setval(pg_get_serial_sequence(%s, %s), %s)",
+                (table, column, max(first + count - 1, 1)))
+    return first
+
+
+# -----------------------------
+# Reference data
+# -----------------------------
+def ensure_semesters(cur, count):
+    """Add terms before the earliest existing one until `count` exist."""
+    cur.execute("SELECT term, year FROM semesters")
+    existing = {(r["term"], r["year"]) for r in cur.fetchall()}
+    missing = count - len(existing)
+
+    if missing > 0:
+        year = min((y for _, y in existing), default=date.today().year)
+        new = []
+        while len(new) < missing:
+            for term, (sm, sd), (em, ed) in reversed(TERMS):
+                if (term, year) not in existing and len(new) < missing:
+                    new.append(row(term, year, date(year, sm, sd), date(year, em, ed)))
+            year -= 1
+        copy_lines(cur, "semesters", ["term", "year", "start_date", "end_date"], new)
+
+    cur.execute("""
+        SELECT sm.semester_id, sm.year, sm.start_date,
+               sm.semester_id IN (SELECT semester_id FROM open_semesters) AS is_open
+        FROM semesters sm
+        ORDER BY sm.start_date
+    """)
+    return cur.fetchall()
+
+
+def generate_departments(cur, tag, count):
+    first = reserve_ids(cur, "departments", "department_id", count)
+    copy_lines(cur, "departments",
+               ["department_id", "department_code", "department_name", "description"],
+               (row(first + n, f"G{tag}{n:02d}", f"Generated {tag} {n:02d}",
+                    "Synthetic benchmark department") for n in range(count)))
+    return list(range(first, first + count))
+
+
+def generate_instructors(cur, rng, tag, departments, dept_weights, count):
+    first = reserve_ids(cur, "instructors", "instructor_id", count)
+    owners = rng.choices(departments, cum_weights=dept_weights, k=count)
+    copy_lines(cur, "instructors",
+               ["instructor_id", "department_id", "first_name", "last_name", "email",
+                "title", "hire_date", "status"],
+               (row(first + n, owners[n], rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                    f"gen-{tag}-i{n}@bench.invalid", rng.choice(TITLES),
+                    date(rng.randint(1995, 2024), rng.randint(1, 12), 1), "Active")
+                for n in range(count)))
+
+    by_department = {}
+    for n, department_id in enumerate(owners):
+        by_department.setdefault(department_id, []).append(first + n)
+    return by_department
+
+
+def generate_courses(cur, rng, tag, departments, dept_weights, instructors, count):
+    """Returns [(course_id, department_id, instructor_id, capacity)]."""
+    first = reserve_ids(cur, "courses", "course_id", count)
+    courses, lines = [], []
+    for n in range(count):
+        department_id = rng.choices(departments, cum_weights=dept_weights)[0]
+        # departments without instructors borrow one from anywhere
+        instructor_id = rng.choice(instructors.get(department_id)
+                                   or rng.choice(list(instructors.values())))
+        credits = rng.choices(CREDITS, weights=CREDIT_WEIGHTS)[0]
+        capacity = rng.choice([20, 25, 30, 40, 60, 80, 120, 200])
+        level = "Graduate" if rng.random() < 0.3 else "Undergraduate"
+        courses.append((first + n, department_id, instructor_id, capacity))
+        lines.append(row(first + n, department_id, instructor_id, f"G{tag}{n:05d}",
+                         f"Generated Course {n}", credits, None, capacity, level, "Active"))
+    copy_lines(cur, "courses",
+               ["course_id", "department_id", "instructor_id", "course_code", "course_name",
+                "credits", "description", "capacity", "level", "status"], lines)
+    return courses
+
+
+def generate_offerings(cur, courses, semesters):
+    """One offering per course per term; offering id = first + course * terms + term."""
+    first = reserve_ids(cur, "course_offerings", "offering_id", len(courses) * len(semesters))
+    copy_lines(cur, "course_offerings",
+               ["offering_id", "course_id", "semester_id", "instructor_id", "capacity"],
+               (row(first + c * len(semesters) + t, course_id, sm["semester_id"],
+                    instructor_id, capacity)
+                for c, (course_id, _, instructor_id, capacity) in enumerate(courses)
+                for t, sm in enumerate(semesters)))
+    return first
+
+
+# -----------------------------
+# Data versions
+# -----------------------------
+def set_version_triggers(cur, enabled):
+    """Enable or disable the insert and update data-version triggers of the loaded tables."""
+    action = "ENABLE" if enabled else "DISABLE"
+    for table in VERSIONED_TABLES:
+        for operation in ("insert", "update"):
+            cur.execute(f"ALTER TABLE {table} {action} TRIGGER trg_{table}_version_{operation}")
+
+
+def bump_versions(cur, student_ids, course_ids):
+    """What the disabled triggers would have done, once for the whole load."""
+    cur.execute("""
+        UPDATE table_versions
+        SET version = version + 1, updated_at = clock_timestamp()
+        WHERE table_name = ANY(%s) AND shard = 0
+    """, (list(VERSIONED_TABLES),))
+    cur.execute("""
+        INSERT INTO entity_versions (entity, entity_id, version, updated_at)
+        SELECT entity, id, 1, clock_timestamp()
+        FROM (SELECT 'student' AS entity, id FROM UNNEST(%s::INTEGER[]) AS id
+              UNION
+              SELECT 'course', id FROM UNNEST(%s::INTEGER[]) AS id) r
+        ORDER BY 1, 2
+        ON CONFLICT (entity, entity_id) DO UPDATE
+        SET version = entity_versions.version + 1,
+            updated_at = EXCLUDED.updated_at
+    """, (student_ids, course_ids))
+
+
+# -----------------------------
+# Students and enrollments
+# -----------------------------
+def plan_students(rng, departments, dept_weights, semesters, count):
+    """Returns [(department_id, first term index, last term index)]."""
+    plans = []
+    for _ in range(count):
+        span = rng.randint(MIN_ACTIVE_TERMS, MAX_ACTIVE_TERMS)
+        # more students in recent cohorts: start index skewed towards the end
+        start = int(len(semesters) * rng.random() ** 0.7) - span // 2
+        start = max(0, min(start, len(semesters) - 1))
+        end = min(start + span, len(semesters)) - 1
+        plans.append((rng.choices(departments, cum_weights=dept_weights)[0], start, end))
+    return plans
+
+
+def generate_students(cur, rng, tag, semesters, plans):
+    first = reserve_ids(cur, "students", "student_id", len(plans))
+    this_year = date.today().year
+    last_term = len(semesters) - 1
+
+    def lines():
+        for n, (department_id, start, end) in enumerate(plans):
+            entry_year = min(semesters[start]["year"], this_year)
+            yield row(first + n, department_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                      f"gen-{tag}-s{n}@bench.invalid",
+                      date(entry_year - 18 - rng.randint(0, 4), rng.randint(1, 12),
+                           rng.randint(1, 28)),
+                      entry_year, "Active" if end == last_term else "Graduated")
+
+    copy_lines(cur, "students",
+               ["student_id", "department_id", "first_name", "last_name", "email",
+                "date_of_birth", "enrollment_year", "status"], lines())
+    return first
+
+
+def enrollment_lines(rng, first_student, plans, courses, semesters, first_offering,
+                     course_weights, target):
+    """Yield enrollment rows; per-term load is chosen so the total lands near target."""
+    by_department = {}
+    for index, (_, department_id, _, _) in enumerate(courses):
+        by_department.setdefault(department_id, []).append(index)
+    home_weights = {
+        department_id: list(itertools.accumulate(course_weights[i] for i in indexes))
+        for department_id, indexes in by_department.items()
+    }
+    all_weights = list(itertools.accumulate(course_weights))
+
+    active_terms = sum(end - start + 1 for _, start, end in plans)
+    per_term = target / max(active_terms, 1)
+    terms = len(semesters)
+    all_courses = range(len(courses))
+
+    for n, (department_id, start, end) in enumerate(plans):
+        home = by_department.get(department_id)
+        for t in range(start, end + 1):
+            semester = semesters[t]
+            wanted = max(1, min(round(rng.gauss(per_term, per_term * 0.3)), len(courses)))
+
+            picked = set()
+            for _ in range(wanted * 3):
+                if len(picked) >= wanted:
+                    break
+                if home and rng.random() < HOME_DEPARTMENT_SHARE:
+                    weights = home_weights[department_id]
+                    picked.add(home[bisect.bisect_left(weights, rng.random() * weights[-1])])
+                else:
+                    picked.add(rng.choices(all_courses, cum_weights=all_weights)[0])
+
+            enrolled_on = semester["start_date"] - timedelta(days=rng.randint(1, 60))
+            for c in picked:
+                if semester["is_open"]:
+                    status, grade = "Enrolled", None
+                else:
+                    pick = rng.random()
+                    if pick < 0.90:
+                        status = "Completed"
+                        grade = rng.choices(LETTERS, weights=LETTER_WEIGHTS)[0]
+                    else:
+                        status, grade = ("Dropped" if pick < 0.96 else "Withdrawn"), None
+                yield row(first_student + n, courses[c][0], semester["semester_id"],
+                          first_offering + c * terms + t, enrolled_on, status, grade)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    tag = (uuid.UUID(int=rng.getrandbits(128)).hex if args.seed is not None
+           else uuid.uuid4().hex)[:4].upper()
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    timings = {}
+
+    def step(name, started):
+        timings[name] = time.perf_counter() - started
+        print(f"{name:<22} {timings[name]:8.1f}s", flush=True)
+        return time.perf_counter()
+
+    try:
+        t = time.perf_counter()
+        cur.execute("""
+            LOCK TABLE departments, instructors, students, semesters, courses,
+                       course_offerings, enrollments IN SHARE ROW EXCLUSIVE MODE
+        """)
+        set_version_triggers(cur, False)
+
+        semesters = ensure_semesters(cur, args.semesters)
+        departments = generate_departments(cur, tag, args.departments)
+        dept_weights = list(itertools.accumulate(zipf_weights(len(departments), 0.8, rng)))
+        instructors = generate_instructors(cur, rng, tag, departments, dept_weights,
+                                           args.instructors)
+        courses = generate_courses(cur, rng, tag, departments, dept_weights, instructors,
+                                   args.courses)
+        first_offering = generate_offerings(cur, courses, semesters)
+        plans = plan_students(rng, departments, dept_weights, semesters, args.students)
+        first_student = generate_students(cur, rng, tag, semesters, plans)
+        t = step("reference data", t)
+
+        cur.execute("ALTER TABLE enrollments DISABLE TRIGGER trg_enforce_course_capacity")
+        cur.execute("ALTER TABLE enrollments DISABLE TRIGGER trg_gpa_after_insert")
+        loaded = copy_lines(
+            cur, "enrollments",
+            ["student_id", "course_id", "semester_id", "offering_id", "enrollment_date",
+             "status", "grade"],
+            enrollment_lines(rng, first_student, plans, courses, semesters, first_offering,
+                             zipf_weights(len(courses), args.skew, rng), args.enrollments))
+        cur.execute("ALTER TABLE enrollments ENABLE TRIGGER trg_enforce_course_capacity")
+        cur.execute("ALTER TABLE enrollments ENABLE TRIGGER trg_gpa_after_insert")
+        t = step("enrollments (COPY)", t)
+
+        cur.execute("""
+            SELECT o.course_id
+            FROM verify_offering_enrolled_counts(TRUE) v
+            JOIN course_offerings o ON o.offering_id = v.offering_id
+        """)
+        repaired_courses = [r["course_id"] for r in cur.fetchall()]
+        cur.execute("""
+            UPDATE course_offerings
+            SET capacity = enrolled_count
+            WHERE offering_id >= %s
+              AND enrolled_count > capacity
+        """, (first_offering,))
+        raised = cur.rowcount
+        cur.execute("SELECT student_id FROM rebuild_gpa_totals(TRUE)")
+        repaired_students = [r["student_id"] for r in cur.fetchall()]
+        t = step("counters and GPA", t)
+
+        set_version_triggers(cur, True)
+        # generated rows, plus existing ones whose counters were repaired
+        bump_versions(cur,
+                      list(range(first_student, first_student + len(plans))) + repaired_students,
+                      [c[0] for c in courses] + repaired_courses)
+        t = step("data versions", t)
+
+        conn.commit()
+
+        conn.autocommit = True
+        cur.execute("ANALYZE")
+        step("analyze", t)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"tag             {tag}")
+    print(f"semesters       {len(semesters)}")
+    print(f"departments     {len(departments)}")
+    print(f"instructors     {args.instructors}")
+    print(f"courses         {len(courses)}")
+    print(f"offerings       {len(courses) * len(semesters)}")
+    print(f"students        {len(plans)}")
+    print(f"enrollments     {loaded}")
+    print(f"counters set    {len(repaired_courses)} (capacity raised on {raised})")
+    print(f"GPAs set        {len(repaired_students)}")
+    print(f"elapsed         {sum(timings.values()):.1f}s")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--semesters", type=int, default=20,
+                        help="total number of terms; earlier terms are added as needed")
+    parser.add_argument("--enrollments", type=int, default=5000000,
+                        help="approximate number of enrollment rows")
+    parser.add_argument("--departments", type=int, default=25)
+    parser.add_argument("--instructors", type=int, default=600)
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Zipf exponent of course popularity")
+    parser.add_argument("--seed", type=int, default=None)
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
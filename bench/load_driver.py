@@ -0,0 +1,360 @@
+"""
+Weighted load driver for the main routes.
+
+Replays a weighted mix of index, course_list, student_detail,
+enroll_submit, grade_enrollment and enrollment_list through the Flask app
+(one test client per thread, real pooled connections to the local
+database), then reports p50 / p95 / p99 latency and throughput per route
+and writes the results, tagged with the git commit, as JSON so runs can be
+compared across commits. Student, offering and enrollment ids are sampled
+from the database up front; run it against data from bench.generate_data.
+enroll_submit and grade_enrollment write, so the database changes.
+
+    python -m bench.load_driver --threads 16 --duration 60 --warmup 10
+    python -m bench.load_driver --compare bench/results/a.json bench/results/b.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from psycopg2.extras import RealDictCursor
+
+from app import create_app
+from app.models import get_db_connection
+
+DEFAULT_MIX = ("index=15,course_list=15,student_detail=30,enroll_submit=10,"
+               "grade_enrollment=10,enrollment_list=20")
+STATUSES = ["Enrolled", "Completed", "Dropped"]
+GRADES = ["A", "A-", "B+", "B", "B-", "C+", "C", "D", "F"]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+# -----------------------------
+# Id pools
+# -----------------------------
+def load_pools(cur, size):
+    cur.execute("SELECT student_id FROM students ORDER BY random() LIMIT %s", (size,))
+    students = [r["student_id"] for r in cur.fetchall()]
+
+    cur.execute("SELECT department_id FROM departments")
+    departments = [r["department_id"] for r in cur.fetchall()]
+
+    cur.execute("SELECT semester_id FROM semesters")
+    semesters = [r["semester_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        SELECT o.offering_id
+        FROM open_semesters os
+        JOIN course_offerings o ON o.semester_id = os.semester_id
+        ORDER BY random()
+        LIMIT %s
+    """, (size,))
+    offerings = [r["offering_id"] for r in cur.fetchall()]
+
+    # newest rows first: the generator puts the Enrolled ones last
+    cur.execute("""
+        SELECT enrollment_id
+        FROM enrollments
+        WHERE status = 'Enrolled'
+        ORDER BY enrollment_id DESC
+        LIMIT %s
+    """, (size,))
+    enrollments = [r["enrollment_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        SELECT course_code FROM courses ORDER BY random() LIMIT %s
+    """, (size,))
+    course_codes = [r["course_code"] for r in cur.fetchall()]
+
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM students) AS students,
+               (SELECT COUNT(*) FROM courses) AS courses,
+               (SELECT COUNT(*) FROM semesters) AS semesters,
+               (SELECT COUNT(*) FROM course_offerings) AS offerings,
+               (SELECT reltuples::BIGINT FROM pg_class
+                WHERE oid = 'enrollments'::regclass) AS enrollments_estimate
+    """)
+    sizes = dict(cur.fetchone())
+
+    pools = dict(students=students, departments=departments, semesters=semesters,
+                 offerings=offerings, enrollments=enrollments, course_codes=course_codes)
+    empty = [name for name, ids in pools.items() if not ids]
+    if empty:
+        sys.exit(f"nothing to sample for: {', '.join(empty)}")
+    return pools, sizes
+
+
+# -----------------------------
+# Route requests
+# -----------------------------
+def maybe(rng, value, probability=0.5):
+    return value if rng.random() < probability else None
+
+
+def query(**params):
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def request_index(client, rng, pools):
+    return client.get("/", query_string=query(
+        department_id=maybe(rng, rng.choice(pools["departments"]), 0.3)))
+
+
+def request_course_list(client, rng, pools):
+    return client.get("/courses", query_string=query(
+        view=maybe(rng, "all", 0.2),
+        department_id=maybe(rng, rng.choice(pools["departments"]), 0.5)))
+
+
+def request_student_detail(client, rng, pools):
+    return client.get(f"/students/{rng.choice(pools['students'])}")
+
+
+def request_enroll_submit(client, rng, pools):
+    # duplicates and full courses are answered with a redirect too
+    return client.post(f"/students/{rng.choice(pools['students'])}/enroll/submit",
+                       data={"offering_id": rng.choice(pools["offerings"])})
+
+
+def request_grade_enrollment(client, rng, pools):
+    return client.post(f"/enrollments/{rng.choice(pools['enrollments'])}/grade",
+                       data={"grade": rng.choice(GRADES)})
+
+
+def request_enrollment_list(client, rng, pools):
+    return client.get("/enrollments", query_string=query(
+        status=maybe(rng, rng.choice(STATUSES), 0.3),
+        semester_id=maybe(rng, rng.choice(pools["semesters"]), 0.4),
+        department_id=maybe(rng, rng.choice(pools["departments"]), 0.3),
+        course=maybe(rng, rng.choice(pools["course_codes"]), 0.2)))
+
+
+ROUTES = {
+    "index": request_index,
+    "course_list": request_course_list,
+    "student_detail": request_student_detail,
+    "enroll_submit": request_enroll_submit,
+    "grade_enrollment": request_grade_enrollment,
+    "enrollment_list": request_enrollment_list,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(
+                f"unknown route {name!r} (choose from {', '.join(ROUTES)})")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"bad weight for {name}: {weight!r}")
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+
+# -----------------------------
+# Statistics
+# -----------------------------
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s[0] for s in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(1 for _, status in samples if status == "error" or status >= 500)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    cwd=root, check=True, capture_output=True,
+                                    text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def print_table(routes):
+    print(f"{'route':<18} {'reqs':>7} {'err':>5} {'rps':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in routes.items():
+        print(f"{name:<18} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps'] or 0:>8.1f} "
+              f"{r['p50_ms'] or 0:>8.1f} {r['p95_ms'] or 0:>8.1f} {r['p99_ms'] or 0:>8.1f}")
+
+
+# -----------------------------
+# Running
+# -----------------------------
+def run(args):
+    app = create_app({
+        "SECRET_KEY": "load-driver",
+        "DB_POOL_MIN_SIZE": 1,
+        "DB_POOL_MAX_SIZE": args.threads,
+        "DB_POOL_TIMEOUT": 30,
+    })
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        pools, sizes = load_pools(cur, args.pool_size)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    names = list(args.mix)
+    weights = [args.mix[n] for n in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+    budget = [args.requests]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        local = []
+        while True:
+            now = time.perf_counter()
+            if args.requests:
+                with lock:
+                    if budget[0] <= 0:
+                        break
+                    budget[0] -= 1
+            elif now >= stop_at:
+                break
+
+            name = rng.choices(names, weights=weights)[0]
+            t = time.perf_counter()
+            try:
+                status = ROUTES[name](client, rng, pools).status_code
+            except Exception:
+                status = "error"
+            if args.requests or t >= measure_from:
+                local.append((name, time.perf_counter() - t, status))
+
+        with lock:
+            for name, latency, status in local:
+                samples[name].append((latency, status))
+
+    threads = [threading.Thread(target=worker, args=(None if args.seed is None else args.seed + n,))
+               for n in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    elapsed = (time.perf_counter() - started if args.requests
+               else time.perf_counter() - measure_from)
+
+    routes = {name: summarize(samples[name], elapsed) for name in names}
+    everything = [s for name in names for s in samples[name]]
+    commit, dirty = git_revision()
+
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "settings": {"threads": args.threads, "duration": args.duration,
+                     "warmup": args.warmup, "requests": args.requests,
+                     "seed": args.seed, "mix": args.mix},
+        "database": sizes,
+        "elapsed_seconds": round(elapsed, 3),
+        "total": summarize(everything, elapsed),
+        "routes": routes,
+    }
+
+    print_table(dict(routes, total=results["total"]))
+
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{(commit or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2, default=str)
+    print(f"results written to {path}")
+    return 0 if results["total"]["errors"] == 0 else 1
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding="utf-8") as fh:
+        before = json.load(fh)
+    with open(after_path, encoding="utf-8") as fh:
+        after = json.load(fh)
+
+    print(f"before {(before['git_commit'] or '?')[:8]}  after {(after['git_commit'] or '?')[:8]}")
+    print(f"{'route':<18} {'metric':<15} {'before':>10} {'after':>10} {'change':>8}")
+    for name in list(after["routes"]) + ["total"]:
+        old = before["routes"].get(name) if name != "total" else before["total"]
+        new = after["routes"][name] if name != "total" else after["total"]
+        if not old:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            a, b = old.get(metric), new.get(metric)
+            change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "-"
+            print(f"{name:<18} {metric:<15} {a if a is not None else '-':>10} "
+                  f"{b if b is not None else '-':>10} {change:>8}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60,
+                        help="seconds to measure (ignored with --requests)")
+    parser.add_argument("--warmup", type=float, default=10,
+                        help="seconds to run before measuring (ignored with --requests)")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="stop after this many requests instead of after --duration")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"route=weight,... (default {DEFAULT_MIX})")
+    parser.add_argument("--pool-size", type=int, default=5000,
+                        help="ids sampled per kind before the run")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="results file (default bench/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="compare two results files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare))
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Concurrent enrollment stress test.
+
+Creates a throwaway course offering with a small capacity and more students
+than seats, then fires one enroll_submit POST per student from many threads
+at once through the Flask app. Afterwards it checks that the offering was
+filled exactly to capacity (never beyond) and that
+course_offerings.enrolled_count agrees with the enrollments table, and
+reports enrollments/sec.
+
+    python -m bench.stress_enroll --threads 32 --students 500 --capacity 120
+"""
+import argparse
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from psycopg2.extras import RealDictCursor
+
+from app import create_app
+from app.models import get_db_connection
+
+
+def setup(cur, tag, students, capacity):
+    cur.execute("SELECT department_id, instructor_id FROM instructors ORDER BY instructor_id LIMIT 1")
+    owner = cur.fetchone()
+
+    cur.execute("""
+        INSERT INTO courses
+            (course_code, course_name, credits, level, capacity, department_id, instructor_id, status)
+        VALUES (%s, 'Stress Test Course', 3, 'Undergraduate', %s, %s, %s, 'Active')
+        RETURNING course_id
+    """, (f"ST{tag[:8].upper()}", capacity, owner["department_id"], owner["instructor_id"]))
+    course_id = cur.fetchone()["course_id"]
+
+    cur.execute("""
+        INSERT INTO students (first_name, last_name, email, department_id, enrollment_year, status)
+        SELECT 'Stress', 'Student ' || n, 'stress-' || %s || '-' || n || '@bench.invalid',
+               %s, %s, 'Active'
+        FROM generate_series(1, %s) AS n
+        RETURNING student_id
+    """, (tag, owner["department_id"], datetime.now().year, students))
+    student_ids = [row["student_id"] for row in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO course_offerings (course_id, semester_id, instructor_id, capacity)
+        SELECT %s, semester_id, %s, %s
+        FROM semesters
+        ORDER BY start_date DESC
+        LIMIT 1
+        RETURNING offering_id
+    """, (course_id, owner["instructor_id"], capacity))
+    offering_id = cur.fetchone()["offering_id"]
+
+    return course_id, student_ids, offering_id
+
+
+def teardown(cur, course_id, student_ids):
+    cur.execute("DELETE FROM enrollments WHERE course_id = %s", (course_id,))
+    cur.execute("DELETE FROM students WHERE student_id = ANY(%s)", (student_ids,))
+    cur.execute("DELETE FROM courses WHERE course_id = %s", (course_id,))
+
+
+def run(args):
+    app = create_app({
+        "SECRET_KEY": "stress-test",
+        "DB_POOL_MIN_SIZE": 1,
+        "DB_POOL_MAX_SIZE": args.threads,
+        "DB_POOL_TIMEOUT": 30,
+    })
+
+    tag = uuid.uuid4().hex[:12]
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    course_id, student_ids, offering_id = setup(cur, tag, args.students, args.capacity)
+    conn.commit()
+
+    local = threading.local()
+
+    def enroll(student_id):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        resp = local.client.post(f"/students/{student_id}/enroll/submit",
+                                 data={"offering_id": offering_id})
+        # success redirects to student_detail, failure back to enroll_page
+        return not resp.headers.get("Location", "").endswith("/enroll")
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(enroll, student_ids))
+        elapsed = time.perf_counter() - start
+
+        cur.execute("""
+            SELECT o.capacity, o.enrolled_count,
+                   (SELECT COUNT(*) FROM enrollments e
+                    WHERE e.offering_id = o.offering_id AND e.status = 'Enrolled') AS actual
+            FROM course_offerings o
+            WHERE o.offering_id = %s
+        """, (offering_id,))
+        final = cur.fetchone()
+        conn.commit()
+    finally:
+        if not args.keep:
+            teardown(cur, course_id, student_ids)
+            conn.commit()
+        cur.close()
+        conn.close()
+
+    accepted = sum(results)
+    expected = min(args.capacity, args.students)
+
+    print(f"attempts        {len(results)}")
+    print(f"accepted        {accepted}")
+    print(f"rejected        {len(results) - accepted}")
+    print(f"capacity        {final['capacity']}")
+    print(f"enrolled rows   {final['actual']}")
+    print(f"counter         {final['enrolled_count']}")
+    print(f"elapsed         {elapsed:.3f}s")
+    print(f"requests/sec    {len(results) / elapsed:.1f}")
+    print(f"enrollments/sec {accepted / elapsed:.1f}")
+
+    ok = (final["actual"] <= final["capacity"]
+          and final["actual"] == final["enrolled_count"] == accepted == expected)
+    print("PASS: no overbooking" if ok else "FAIL: seat accounting is wrong")
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--capacity", type=int, default=120)
+    parser.add_argument("--keep", action="store_true",
+                        help="leave the generated course and students in place")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
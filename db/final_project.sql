@@ -8,11 +8,21 @@
 -- 0. Drop existing tables (prepare for clean rebuild)
 ------------------------------------------------------------
 DROP TABLE IF EXISTS enrollments CASCADE;
+-- archived enrollment partitions (db/migrations/0006)
+DROP TABLE IF EXISTS enrollments_archive CASCADE;
+-- report refresh times (db/migrations/0008; the report views go with their tables)
+DROP TABLE IF EXISTS report_refreshes CASCADE;
+DROP TABLE IF EXISTS course_offerings CASCADE;
 DROP TABLE IF EXISTS courses CASCADE;
 DROP TABLE IF EXISTS students CASCADE;
 DROP TABLE IF EXISTS instructors CASCADE;
 DROP TABLE IF EXISTS semesters CASCADE;
 DROP TABLE IF EXISTS departments CASCADE;
+DROP TABLE IF EXISTS grade_points CASCADE;
+DROP TABLE IF EXISTS table_versions CASCADE;
+DROP TABLE IF EXISTS entity_versions CASCADE;
+-- a full reload also drops every index db/migrations added
+DROP TABLE IF EXISTS schema_migrations CASCADE;
 
 ------------------------------------------------------------
 -- 1. Table: departments
@@ -57,7 +67,11 @@ CREATE TABLE students (
                           AND enrollment_year <= EXTRACT(YEAR FROM CURRENT_DATE)
                        ),
     gpa               NUMERIC(3,2) CHECK (gpa >= 0 AND gpa <= 4.00),
-    status            VARCHAR(20) NOT NULL DEFAULT 'Active'
+    status            VARCHAR(20) NOT NULL DEFAULT 'Active',
+    -- running GPA totals over Completed, graded enrollments:
+    -- gpa = quality_points / attempted_credits
+    quality_points    NUMERIC(8,1) NOT NULL DEFAULT 0,
+    attempted_credits INTEGER NOT NULL DEFAULT 0 CHECK (attempted_credits >= 0)
 );
 
 ------------------------------------------------------------
@@ -91,6 +105,26 @@ CREATE TABLE courses (
     status         VARCHAR(20) NOT NULL DEFAULT 'Active'
 );
 
+------------------------------------------------------------
+-- 5.1 Table: course_offerings
+-- One row per course per semester. It carries that term's capacity,
+-- instructor and the maintained count of 'Enrolled' seats.
+-- courses.capacity / courses.instructor_id are the defaults for new
+-- offerings.
+------------------------------------------------------------
+CREATE TABLE course_offerings (
+    offering_id     SERIAL PRIMARY KEY,
+    course_id       INTEGER NOT NULL REFERENCES courses(course_id)
+                      ON DELETE CASCADE ON UPDATE CASCADE,
+    semester_id     INTEGER NOT NULL REFERENCES semesters(semester_id)
+                      ON DELETE CASCADE ON UPDATE CASCADE,
+    instructor_id   INTEGER REFERENCES instructors(instructor_id)
+                      ON DELETE RESTRICT ON UPDATE CASCADE,
+    capacity        INTEGER NOT NULL CHECK (capacity > 0),
+    enrolled_count  INTEGER NOT NULL DEFAULT 0 CHECK (enrolled_count >= 0),
+    UNIQUE(course_id, semester_id)
+);
+
 ------------------------------------------------------------
 -- 6. Table: enrollments
 ------------------------------------------------------------
@@ -102,20 +136,106 @@ CREATE TABLE enrollments (
                       ON DELETE CASCADE ON UPDATE CASCADE,
     semester_id     INTEGER NOT NULL REFERENCES semesters(semester_id)
                       ON DELETE CASCADE ON UPDATE CASCADE,
+    offering_id     INTEGER NOT NULL REFERENCES course_offerings(offering_id)
+                      ON DELETE CASCADE ON UPDATE CASCADE,
     enrollment_date DATE NOT NULL DEFAULT CURRENT_DATE,
     status          VARCHAR(20) NOT NULL DEFAULT 'Enrolled',
     grade           VARCHAR(5),
     UNIQUE(student_id, course_id, semester_id)
 );
 
+------------------------------------------------------------
+-- 6.1 Table: grade_points
+-- Grade -> grade point lookup used by every GPA calculation. Besides the
+-- letter grades it holds every 1-3 digit numeric grade string ('7', '07',
+-- '093', ...), mapped with the same percentage bands as before. A grade
+-- with no row here does not count towards GPA.
+------------------------------------------------------------
+CREATE TABLE grade_points (
+    grade   VARCHAR(5) PRIMARY KEY,
+    points  NUMERIC(2,1) NOT NULL CHECK (points >= 0 AND points <= 4.0)
+);
+
+INSERT INTO grade_points (grade, points) VALUES
+('A',  4.0), ('A-', 3.7),
+('B+', 3.3), ('B',  3.0), ('B-', 2.7),
+('C+', 2.3), ('C',  2.0), ('C-', 1.7),
+('D+', 1.3), ('D',  1.0),
+('F',  0.0);
+
+INSERT INTO grade_points (grade, points)
+SELECT LPAD(n::TEXT, w, '0'),
+       CASE
+           WHEN n >= 93 THEN 4.0
+           WHEN n >= 90 THEN 3.7
+           WHEN n >= 87 THEN 3.3
+           WHEN n >= 83 THEN 3.0
+           WHEN n >= 80 THEN 2.7
+           WHEN n >= 77 THEN 2.3
+           WHEN n >= 73 THEN 2.0
+           WHEN n >= 70 THEN 1.7
+           WHEN n >= 67 THEN 1.3
+           WHEN n >= 60 THEN 1.0
+           ELSE 0.0
+       END
+FROM generate_series(1, 3) AS w
+CROSS JOIN LATERAL generate_series(0, (10 ^ w)::INTEGER - 1) AS n;
+
+------------------------------------------------------------
+-- 6.2 Tables: table_versions, entity_versions
+-- Version stamps for HTTP conditional GET, bumped by the triggers in
+-- section 26 in the writing transaction, so a new version only becomes
+-- visible together with the data it describes. Each table's version is
+-- the sum of 16 shard rows (a writer bumps the shard picked by its backend
+-- pid), so concurrent writers rarely wait on the same row. Entity
+-- versions cover one student's or one course's detail page.
+------------------------------------------------------------
+CREATE TABLE table_versions (
+    table_name  VARCHAR(40) NOT NULL,
+    shard       SMALLINT NOT NULL,
+    version     BIGINT NOT NULL DEFAULT 0,
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (table_name, shard)
+);
+
+CREATE TABLE entity_versions (
+    entity      VARCHAR(20) NOT NULL,
+    entity_id   INTEGER NOT NULL,
+    version     BIGINT NOT NULL DEFAULT 1,
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (entity, entity_id)
+);
+
+INSERT INTO table_versions (table_name, shard)
+SELECT t, s
+FROM UNNEST(ARRAY['departments', 'semesters', 'instructors', 'students',
+                  'courses', 'course_offerings', 'enrollments']) AS t
+CROSS JOIN generate_series(0, 15) AS s;
+
 ------------------------------------------------------------
 -- 7. Indexes
 ------------------------------------------------------------
 CREATE INDEX idx_courses_department ON courses(department_id);
 CREATE INDEX idx_courses_instructor ON courses(instructor_id);
 CREATE INDEX idx_enrollments_student ON enrollments(student_id);
-CREATE INDEX idx_enrollments_course ON enrollments(course_id);
-CREATE INDEX idx_enrollments_semester ON enrollments(semester_id);
+
+-- Keyset pagination: each list filter is followed by the page's seek key,
+-- so "filter ... AND key > cursor ORDER BY key LIMIT n" is one index range.
+CREATE INDEX idx_students_department_id ON students(department_id, student_id);
+CREATE INDEX idx_students_status_id ON students(status, student_id);
+CREATE INDEX idx_courses_status_code ON courses(status, course_code);
+CREATE INDEX idx_courses_department_code ON courses(department_id, course_code);
+CREATE INDEX idx_instructors_name ON instructors(last_name, instructor_id);
+CREATE INDEX idx_instructors_status_name ON instructors(status, last_name, instructor_id);
+CREATE INDEX idx_instructors_department_name ON instructors(department_id, last_name, instructor_id);
+CREATE INDEX idx_enrollments_course ON enrollments(course_id, enrollment_id);
+CREATE INDEX idx_enrollments_semester ON enrollments(semester_id, enrollment_id);
+CREATE INDEX idx_enrollments_status ON enrollments(status, enrollment_id);
+
+-- seat counting and rosters for one offering never touch other terms
+CREATE INDEX idx_enrollments_offering_status ON enrollments(offering_id, status);
+CREATE INDEX idx_offerings_semester ON course_offerings(semester_id);
+CREATE INDEX idx_offerings_instructor ON course_offerings(instructor_id);
 
 ------------------------------------------------------------
 -- 8. Sample Data: departments
@@ -173,58 +293,105 @@ INSERT INTO courses (department_id, instructor_id, course_code, course_name, cre
 (2, 3, 'MATH2400', 'Differential Equations',4, 'Differential equations', 35, 'Undergraduate'),
 (5, 5, 'PHYS1151', 'Physics I',4, 'Physics fundamentals', 60, 'Undergraduate');
 
+------------------------------------------------------------
+-- 12.1 Sample Data: course_offerings (every course, every term)
+------------------------------------------------------------
+INSERT INTO course_offerings (course_id, semester_id, instructor_id, capacity)
+SELECT c.course_id, sm.semester_id, c.instructor_id, c.capacity
+FROM courses c
+CROSS JOIN semesters sm;
+
 ------------------------------------------------------------
 -- 13. Sample Data: enrollments
 ------------------------------------------------------------
-INSERT INTO enrollments (student_id, course_id, semester_id, status) VALUES
-(1, 1, 3, 'Enrolled'),
-(2, 1, 3, 'Enrolled'),
-(3, 3, 3, 'Enrolled'),
-(1, 2, 3, 'Enrolled');
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT v.student_id, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM (VALUES (1, 1, 3), (2, 1, 3), (3, 3, 3), (1, 2, 3))
+     AS v(student_id, course_id, semester_id)
+JOIN course_offerings o
+  ON o.course_id = v.course_id AND o.semester_id = v.semester_id;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 6, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'CS5200';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 6, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'CS5200' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 7, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'MATH2331';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 7, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'MATH2331' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 8, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'ENGL1111';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 8, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'ENGL1111' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 9, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'BIO2301';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 9, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'BIO2301' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 10, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'PHYS1151';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 10, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'PHYS1151' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 6, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'CS5010';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 6, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'CS5010' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 7, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'CS5200';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 7, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'CS5200' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 8, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'CS3000';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 8, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'CS3000' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 9, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'MATH2400';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 9, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'MATH2400' AND o.semester_id = 3;
 
-INSERT INTO enrollments (student_id, course_id, semester_id, status)
-SELECT 10, course_id, 3, 'Enrolled' FROM courses WHERE course_code = 'CS3000';
+INSERT INTO enrollments (student_id, course_id, semester_id, offering_id, status)
+SELECT 10, o.course_id, o.semester_id, o.offering_id, 'Enrolled'
+FROM course_offerings o JOIN courses c ON c.course_id = o.course_id
+WHERE c.course_code = 'CS3000' AND o.semester_id = 3;
 
 ------------------------------------------------------------
 -- 14. Cleanup existing triggers and functions
 ------------------------------------------------------------
 DROP TRIGGER IF EXISTS trg_enforce_course_capacity ON enrollments;
 DROP TRIGGER IF EXISTS trg_update_gpa ON enrollments;
+DROP TRIGGER IF EXISTS trg_gpa_after_insert ON enrollments;
+DROP TRIGGER IF EXISTS trg_gpa_after_update ON enrollments;
+DROP TRIGGER IF EXISTS trg_gpa_after_delete ON enrollments;
+DROP TRIGGER IF EXISTS trg_enrolled_count_delete ON enrollments;
+DROP TRIGGER IF EXISTS trg_enrolled_count_update ON enrollments;
 DROP INDEX IF EXISTS idx_unique_active_enrollment;
 DROP FUNCTION IF EXISTS enforce_course_capacity() CASCADE;
+DROP FUNCTION IF EXISTS reserve_course_seat(INTEGER) CASCADE;
 DROP FUNCTION IF EXISTS update_student_gpa_after_grade() CASCADE;
 DROP FUNCTION IF EXISTS calculate_student_gpa(INTEGER) CASCADE;
+DROP FUNCTION IF EXISTS refresh_student_gpas(INTEGER[]) CASCADE;
+DROP FUNCTION IF EXISTS refresh_gpa_after_statement() CASCADE;
+DROP FUNCTION IF EXISTS apply_gpa_deltas(INTEGER[], NUMERIC[], INTEGER[]) CASCADE;
+DROP FUNCTION IF EXISTS adjust_gpa_after_credit_change() CASCADE;
+DROP FUNCTION IF EXISTS rebuild_gpa_totals(BOOLEAN) CASCADE;
+DROP TRIGGER IF EXISTS trg_gpa_after_credit_change ON courses;
 DROP FUNCTION IF EXISTS get_course_enrollment_count(INTEGER, INTEGER) CASCADE;
 DROP PROCEDURE IF EXISTS enroll_student(INTEGER, INTEGER, INTEGER) CASCADE;
 DROP PROCEDURE IF EXISTS drop_course(INTEGER, INTEGER, INTEGER) CASCADE;
 DROP PROCEDURE IF EXISTS assign_grade(INTEGER, VARCHAR) CASCADE;
+DROP FUNCTION IF EXISTS maintain_course_enrolled_count() CASCADE;
+DROP FUNCTION IF EXISTS verify_course_enrolled_counts(BOOLEAN) CASCADE;
+DROP FUNCTION IF EXISTS verify_offering_enrolled_counts(BOOLEAN) CASCADE;
+DROP VIEW IF EXISTS open_semesters;
+DROP FUNCTION IF EXISTS notify_cache_invalidation() CASCADE;
+DROP FUNCTION IF EXISTS bump_data_versions() CASCADE;
 
 ------------------------------------------------------------
 -- 15. Function: calculate_student_gpa
@@ -234,46 +401,112 @@ RETURNS NUMERIC(3,2) AS $$
 DECLARE
     calculated_gpa NUMERIC(3,2);
 BEGIN
-    SELECT ROUND(AVG(
-        CASE 
-            WHEN grade = 'A'  THEN 4.0
-            WHEN grade = 'A-' THEN 3.7
-            WHEN grade = 'B+' THEN 3.3
-            WHEN grade = 'B'  THEN 3.0
-            WHEN grade = 'B-' THEN 2.7
-            WHEN grade = 'C+' THEN 2.3
-            WHEN grade = 'C'  THEN 2.0
-            WHEN grade = 'C-' THEN 1.7
-            WHEN grade = 'D+' THEN 1.3
-            WHEN grade = 'D'  THEN 1.0
-            WHEN grade = 'F'  THEN 0.0
-
-            WHEN grade ~ '^[0-9]{1,3}$' THEN 
-                CASE 
-                    WHEN grade::INTEGER >= 93 THEN 4.0
-                    WHEN grade::INTEGER >= 90 THEN 3.7
-                    WHEN grade::INTEGER >= 87 THEN 3.3
-                    WHEN grade::INTEGER >= 83 THEN 3.0
-                    WHEN grade::INTEGER >= 80 THEN 2.7
-                    WHEN grade::INTEGER >= 77 THEN 2.3
-                    WHEN grade::INTEGER >= 73 THEN 2.0
-                    WHEN grade::INTEGER >= 70 THEN 1.7
-                    WHEN grade::INTEGER >= 67 THEN 1.3
-                    WHEN grade::INTEGER >= 60 THEN 1.0
-                    ELSE 0.0
-                END
-            ELSE NULL
-        END
-    ), 2) INTO calculated_gpa
-    FROM enrollments
-    WHERE student_id = p_student_id 
-      AND status = 'Completed'
-      AND grade IS NOT NULL;
+    -- credit-weighted, recomputed from the full history
+    SELECT ROUND(SUM(c.credits * gp.points) / NULLIF(SUM(c.credits), 0), 2)
+    INTO calculated_gpa
+    FROM enrollments e
+    JOIN courses c ON c.course_id = e.course_id
+    JOIN grade_points gp ON gp.grade = e.grade
+    WHERE e.student_id = p_student_id 
+      AND e.status = 'Completed'
+      AND e.grade IS NOT NULL;
 
     RETURN COALESCE(calculated_gpa, 0.00);
 END;
 $$ LANGUAGE plpgsql;
 
+------------------------------------------------------------
+-- 15.1 Function: apply_gpa_deltas
+-- Adds per-student deltas to the running totals and derives the new GPA
+-- from them, so a grade change costs O(1) per student no matter how long
+-- the student's history is. A student with no graded credits has no GPA.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION apply_gpa_deltas(
+    p_student_ids INTEGER[],
+    p_quality     NUMERIC[],
+    p_credits     INTEGER[]
+)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE students s
+    SET quality_points    = s.quality_points + d.quality,
+        attempted_credits = s.attempted_credits + d.credits,
+        gpa = CASE
+                  WHEN s.attempted_credits + d.credits > 0 THEN
+                      ROUND((s.quality_points + d.quality)
+                            / (s.attempted_credits + d.credits), 2)
+              END
+    FROM UNNEST(p_student_ids, p_quality, p_credits) AS d(student_id, quality, credits)
+    WHERE s.student_id = d.student_id;
+END;
+$$ LANGUAGE plpgsql;
+
+------------------------------------------------------------
+-- 15.2 Function: rebuild_gpa_totals
+-- Recomputes quality_points / attempted_credits / gpa for the whole
+-- students table in one grouped pass over enrollments and returns every
+-- student whose stored values differ. With p_repair = TRUE the stored
+-- values are overwritten while writers are blocked. Run it after
+-- backfilling, or after editing grade_points.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION rebuild_gpa_totals(p_repair BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (
+    student_id        INTEGER,
+    stored_points     NUMERIC,
+    actual_points     NUMERIC,
+    stored_credits    INTEGER,
+    actual_credits    INTEGER,
+    stored_gpa        NUMERIC,
+    actual_gpa        NUMERIC
+) AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_repair THEN
+        LOCK TABLE enrollments IN SHARE MODE;
+        LOCK TABLE courses IN SHARE MODE;
+    END IF;
+
+    CREATE TEMP TABLE gpa_rebuild AS
+    SELECT s.student_id,
+           COALESCE(t.points, 0)::NUMERIC(8,1) AS points,
+           COALESCE(t.credits, 0)::INTEGER AS credits,
+           CASE WHEN t.credits > 0 THEN ROUND(t.points / t.credits, 2) END AS gpa
+    FROM students s
+    LEFT JOIN (
+        SELECT e.student_id,
+               SUM(c.credits * gp.points) AS points,
+               SUM(c.credits) AS credits
+        FROM enrollments e
+        JOIN courses c ON c.course_id = e.course_id
+        JOIN grade_points gp ON gp.grade = e.grade
+        WHERE e.status = 'Completed'
+        GROUP BY e.student_id
+    ) t ON t.student_id = s.student_id;
+
+    RETURN QUERY
+    SELECT s.student_id, s.quality_points, r.points,
+           s.attempted_credits, r.credits, s.gpa, r.gpa
+    FROM students s
+    JOIN gpa_rebuild r ON r.student_id = s.student_id
+    WHERE (s.quality_points, s.attempted_credits, s.gpa)
+          IS DISTINCT FROM (r.points, r.credits, r.gpa)
+    ORDER BY s.student_id;
+
+    IF p_repair THEN
+        UPDATE students s
+        SET quality_points = r.points,
+            attempted_credits = r.credits,
+            gpa = r.gpa
+        FROM gpa_rebuild r
+        WHERE r.student_id = s.student_id
+          AND (s.quality_points, s.attempted_credits, s.gpa)
+              IS DISTINCT FROM (r.points, r.credits, r.gpa);
+    END IF;
+
+    DROP TABLE gpa_rebuild;
+END;
+$$ LANGUAGE plpgsql;
+
 ------------------------------------------------------------
 -- 16. Function: get_course_enrollment_count
 ------------------------------------------------------------
@@ -285,11 +518,10 @@ RETURNS INTEGER AS $$
 DECLARE
     enrollment_count INTEGER;
 BEGIN
-    SELECT COUNT(*) INTO enrollment_count
-    FROM enrollments
+    SELECT enrolled_count INTO enrollment_count
+    FROM course_offerings
     WHERE course_id = p_course_id 
-      AND semester_id = p_semester_id
-      AND status = 'Enrolled';
+      AND semester_id = p_semester_id;
 
     RETURN COALESCE(enrollment_count, 0);
 END;
@@ -309,16 +541,18 @@ DECLARE
     v_current_count INTEGER;
     v_course_name VARCHAR(200);
 BEGIN
-    SELECT course_name, capacity INTO v_course_name, v_capacity
-    FROM courses
-    WHERE course_id = p_course_id;
+    SELECT c.course_name, o.capacity, o.enrolled_count
+    INTO v_course_name, v_capacity, v_current_count
+    FROM course_offerings o
+    JOIN courses c ON c.course_id = o.course_id
+    WHERE o.course_id = p_course_id
+      AND o.semester_id = p_semester_id;
 
     IF NOT FOUND THEN
-        RAISE EXCEPTION 'Course ID % does not exist', p_course_id;
+        RAISE EXCEPTION 'Course ID % is not offered in semester %',
+                        p_course_id, p_semester_id;
     END IF;
 
-    v_current_count := get_course_enrollment_count(p_course_id, p_semester_id);
-
     IF v_current_count >= v_capacity THEN
         RAISE EXCEPTION 'Course "%" is full (Capacity: %, Current: %)',
                         v_course_name, v_capacity, v_current_count;
@@ -377,25 +611,50 @@ $$;
 
 ------------------------------------------------------------
 -- 20. Trigger: enforce course capacity
+-- Every new enrollment is first attached to its course offering (looked
+-- up from course_id + semester_id, or the other way round). An 'Enrolled'
+-- row then reserves its seat with a single conditional UPDATE on the
+-- offering's counter row. The row lock it takes makes concurrent
+-- enrollments for the same offering queue up and re-check
+-- enrolled_count < capacity against the committed value, so an offering
+-- can never be overbooked. The lock is held only until the enrolling
+-- transaction commits.
 ------------------------------------------------------------
+CREATE OR REPLACE FUNCTION reserve_course_seat(p_offering_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE course_offerings
+    SET enrolled_count = enrolled_count + 1
+    WHERE offering_id = p_offering_id
+      AND enrolled_count < capacity;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Course is full';
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
 CREATE OR REPLACE FUNCTION enforce_course_capacity()
 RETURNS TRIGGER AS $$
-DECLARE
-    v_capacity INTEGER;
-    v_current_count INTEGER;
 BEGIN
-    SELECT capacity INTO v_capacity
-    FROM courses
-    WHERE course_id = NEW.course_id;
+    IF NEW.offering_id IS NULL THEN
+        SELECT offering_id INTO NEW.offering_id
+        FROM course_offerings
+        WHERE course_id = NEW.course_id
+          AND semester_id = NEW.semester_id;
 
-    SELECT COUNT(*) INTO v_current_count
-    FROM enrollments
-    WHERE course_id = NEW.course_id
-      AND semester_id = NEW.semester_id
-      AND status = 'Enrolled';
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Course % is not offered in semester %',
+                            NEW.course_id, NEW.semester_id;
+        END IF;
+    ELSE
+        SELECT course_id, semester_id INTO NEW.course_id, NEW.semester_id
+        FROM course_offerings
+        WHERE offering_id = NEW.offering_id;
+    END IF;
 
-    IF v_current_count >= v_capacity THEN
-        RAISE EXCEPTION 'Course is full';
+    IF NEW.status = 'Enrolled' THEN
+        PERFORM reserve_course_seat(NEW.offering_id);
     END IF;
 
     RETURN NEW;
@@ -405,35 +664,397 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER trg_enforce_course_capacity
 BEFORE INSERT ON enrollments
 FOR EACH ROW
-WHEN (NEW.status = 'Enrolled')
 EXECUTE FUNCTION enforce_course_capacity();
 
 ------------------------------------------------------------
--- 21. Trigger: GPA update after grade assigned
+-- 21. Trigger: GPA update after grades change
+-- Statement-level triggers with transition tables. Every row entering
+-- 'Completed' with a mapped grade adds credits x points to its student's
+-- running totals, and every row leaving (regrade, un-complete, delete)
+-- subtracts its old contribution. The deltas are summed per student, so a
+-- statement touching many rows still updates each student once, and no
+-- enrollment history is re-read.
 ------------------------------------------------------------
-CREATE OR REPLACE FUNCTION update_student_gpa_after_grade()
+CREATE OR REPLACE FUNCTION refresh_gpa_after_statement()
 RETURNS TRIGGER AS $$
 DECLARE
-    v_new_gpa NUMERIC(3,2);
+    v_student_ids INTEGER[];
+    v_quality     NUMERIC[];
+    v_credits     INTEGER[];
 BEGIN
-    IF NEW.status = 'Completed' AND NEW.grade IS NOT NULL THEN
-        SELECT calculate_student_gpa(NEW.student_id)
-        INTO v_new_gpa;
+    IF TG_OP = 'INSERT' THEN
+        SELECT ARRAY_AGG(d.student_id), ARRAY_AGG(d.quality), ARRAY_AGG(d.credits)
+        INTO v_student_ids, v_quality, v_credits
+        FROM (
+            SELECT n.student_id,
+                   SUM(c.credits * gp.points) AS quality,
+                   SUM(c.credits)::INTEGER AS credits
+            FROM new_rows n
+            JOIN courses c ON c.course_id = n.course_id
+            JOIN grade_points gp ON gp.grade = n.grade
+            WHERE n.status = 'Completed'
+            GROUP BY n.student_id
+        ) d;
 
-        UPDATE students
-        SET gpa = v_new_gpa
-        WHERE student_id = NEW.student_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT ARRAY_AGG(d.student_id), ARRAY_AGG(d.quality), ARRAY_AGG(d.credits)
+        INTO v_student_ids, v_quality, v_credits
+        FROM (
+            SELECT o.student_id,
+                   -SUM(c.credits * gp.points) AS quality,
+                   -SUM(c.credits)::INTEGER AS credits
+            FROM old_rows o
+            JOIN courses c ON c.course_id = o.course_id
+            JOIN grade_points gp ON gp.grade = o.grade
+            WHERE o.status = 'Completed'
+            GROUP BY o.student_id
+        ) d;
+
+    ELSE
+        SELECT ARRAY_AGG(d.student_id), ARRAY_AGG(d.quality), ARRAY_AGG(d.credits)
+        INTO v_student_ids, v_quality, v_credits
+        FROM (
+            SELECT x.student_id,
+                   SUM(x.quality) AS quality,
+                   SUM(x.credits)::INTEGER AS credits
+            FROM (
+                SELECT n.student_id, c.credits * gp.points AS quality, c.credits
+                FROM new_rows n
+                JOIN courses c ON c.course_id = n.course_id
+                JOIN grade_points gp ON gp.grade = n.grade
+                WHERE n.status = 'Completed'
+                UNION ALL
+                SELECT o.student_id, -(c.credits * gp.points), -c.credits
+                FROM old_rows o
+                JOIN courses c ON c.course_id = o.course_id
+                JOIN grade_points gp ON gp.grade = o.grade
+                WHERE o.status = 'Completed'
+            ) x
+            GROUP BY x.student_id
+            HAVING SUM(x.quality) <> 0 OR SUM(x.credits) <> 0
+        ) d;
     END IF;
 
-    RETURN NEW;
+    IF v_student_ids IS NOT NULL THEN
+        PERFORM apply_gpa_deltas(v_student_ids, v_quality, v_credits);
+    END IF;
+
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trg_update_gpa
+CREATE TRIGGER trg_gpa_after_insert
+AFTER INSERT ON enrollments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_gpa_after_statement();
+
+CREATE TRIGGER trg_gpa_after_update
 AFTER UPDATE ON enrollments
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_gpa_after_statement();
+
+CREATE TRIGGER trg_gpa_after_delete
+AFTER DELETE ON enrollments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_gpa_after_statement();
+
+------------------------------------------------------------
+-- 21.1 Trigger: GPA update after a course's credits change
+-- Re-weights the completed grades of that course by the credit delta.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION adjust_gpa_after_credit_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_student_ids INTEGER[];
+    v_quality     NUMERIC[];
+    v_credits     INTEGER[];
+BEGIN
+    SELECT ARRAY_AGG(d.student_id), ARRAY_AGG(d.quality), ARRAY_AGG(d.credits)
+    INTO v_student_ids, v_quality, v_credits
+    FROM (
+        SELECT e.student_id,
+               SUM((NEW.credits - OLD.credits) * gp.points) AS quality,
+               SUM(NEW.credits - OLD.credits)::INTEGER AS credits
+        FROM enrollments e
+        JOIN grade_points gp ON gp.grade = e.grade
+        WHERE e.course_id = NEW.course_id
+          AND e.status = 'Completed'
+        GROUP BY e.student_id
+    ) d;
+
+    IF v_student_ids IS NOT NULL THEN
+        PERFORM apply_gpa_deltas(v_student_ids, v_quality, v_credits);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_gpa_after_credit_change
+AFTER UPDATE OF credits ON courses
+FOR EACH ROW
+WHEN (OLD.credits IS DISTINCT FROM NEW.credits)
+EXECUTE FUNCTION adjust_gpa_after_credit_change();
+
+------------------------------------------------------------
+-- 22. Trigger: maintain course_offerings.enrolled_count
+-- Inserts are counted by trg_enforce_course_capacity when the seat is
+-- reserved. Every other transition into or out of 'Enrolled' (status
+-- change, offering change, delete) adjusts the counter here, so pages can
+-- read course_offerings.enrolled_count instead of counting enrollments.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION maintain_course_enrolled_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.status = 'Enrolled' THEN
+        UPDATE course_offerings
+        SET enrolled_count = enrolled_count - 1
+        WHERE offering_id = OLD.offering_id;
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.status = 'Enrolled' THEN
+            -- moving back into 'Enrolled' needs a free seat as well
+            PERFORM reserve_course_seat(NEW.offering_id);
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_enrolled_count_delete
+AFTER DELETE ON enrollments
+FOR EACH ROW
+EXECUTE FUNCTION maintain_course_enrolled_count();
+
+CREATE TRIGGER trg_enrolled_count_update
+AFTER UPDATE OF status, offering_id ON enrollments
 FOR EACH ROW
-WHEN (NEW.status = 'Completed')
-EXECUTE FUNCTION update_student_gpa_after_grade();
+WHEN (OLD.status IS DISTINCT FROM NEW.status
+      OR OLD.offering_id IS DISTINCT FROM NEW.offering_id)
+EXECUTE FUNCTION maintain_course_enrolled_count();
+
+------------------------------------------------------------
+-- 23. Function: verify_offering_enrolled_counts
+-- Returns every offering whose stored counter differs from a fresh count.
+-- With p_repair = TRUE the counters are rewritten while writers on
+-- enrollments are blocked, so the recount is exact.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION verify_offering_enrolled_counts(p_repair BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (
+    offering_id   INTEGER,
+    course_code   VARCHAR,
+    term          VARCHAR,
+    year          INTEGER,
+    stored_count  INTEGER,
+    actual_count  INTEGER
+) AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_repair THEN
+        LOCK TABLE enrollments IN SHARE MODE;
+    END IF;
+
+    RETURN QUERY
+    SELECT o.offering_id, c.course_code, sm.term, sm.year, o.enrolled_count, a.cnt
+    FROM course_offerings o
+    JOIN courses c ON c.course_id = o.course_id
+    JOIN semesters sm ON sm.semester_id = o.semester_id
+    JOIN (
+        SELECT o2.offering_id, COUNT(e.enrollment_id)::INTEGER AS cnt
+        FROM course_offerings o2
+        LEFT JOIN enrollments e
+               ON e.offering_id = o2.offering_id AND e.status = 'Enrolled'
+        GROUP BY o2.offering_id
+    ) a ON a.offering_id = o.offering_id
+    WHERE o.enrolled_count <> a.cnt
+    ORDER BY sm.year, sm.term, c.course_code;
+
+    IF p_repair THEN
+        UPDATE course_offerings o
+        SET enrolled_count = a.cnt
+        FROM (
+            SELECT o2.offering_id, COUNT(e.enrollment_id)::INTEGER AS cnt
+            FROM course_offerings o2
+            LEFT JOIN enrollments e
+                   ON e.offering_id = o2.offering_id AND e.status = 'Enrolled'
+            GROUP BY o2.offering_id
+        ) a
+        WHERE a.offering_id = o.offering_id
+          AND o.enrolled_count <> a.cnt;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- initialize counters for the sample enrollments loaded above
+SELECT * FROM verify_offering_enrolled_counts(TRUE);
+
+------------------------------------------------------------
+-- 24. View: open_semesters
+-- Terms that are still running or upcoming, plus always the most recent
+-- term. Enrollment pages only look at offerings in these terms, so past
+-- terms do not add to their cost.
+------------------------------------------------------------
+CREATE OR REPLACE VIEW open_semesters AS
+SELECT semester_id, term, year, start_date, end_date
+FROM semesters
+WHERE end_date >= CURRENT_DATE
+   OR semester_id = (
+        SELECT semester_id FROM semesters ORDER BY start_date DESC LIMIT 1
+   );
+
+------------------------------------------------------------
+-- 25. Trigger: cache invalidation notifications
+-- Every statement that writes a table the app caches (departments,
+-- semesters, instructors) sends one NOTIFY on the 'cache_invalidation'
+-- channel with the table name and the time of the write, which the app's
+-- listeners use to report invalidation lag. NOTIFY is delivered at
+-- commit, so rolled-back writes never evict anything. Tables the app does
+-- not cache get no trigger: pg_notify serializes committing transactions
+-- on a global lock, which hot tables such as enrollments should not pay.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM old_rows LIMIT 1;
+    ELSE
+        PERFORM 1 FROM new_rows LIMIT 1;
+    END IF;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM pg_notify('cache_invalidation', jsonb_build_object(
+        'table', TG_TABLE_NAME,
+        'at',    EXTRACT(EPOCH FROM clock_timestamp())
+    )::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- one trigger per table and operation (a trigger with transition tables
+-- can only fire on one event)
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['departments', 'semesters', 'instructors'] LOOP
+        EXECUTE format('CREATE TRIGGER trg_%1$s_notify_insert
+                        AFTER INSERT ON %1$I
+                        REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION notify_cache_invalidation()', t);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_notify_update
+                        AFTER UPDATE ON %1$I
+                        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION notify_cache_invalidation()', t);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_notify_delete
+                        AFTER DELETE ON %1$I
+                        REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION notify_cache_invalidation()', t);
+    END LOOP;
+END;
+$$;
+
+------------------------------------------------------------
+-- 26. Trigger: data versions for conditional GET
+-- One statement-level trigger per table and operation bumps the table's
+-- version shard and, for each "entity:column" argument, the version of
+-- every student / course the statement touched. Entity rows are upserted
+-- in id order so concurrent statements lock them in the same order.
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION bump_data_versions()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_mapping TEXT;
+    v_column  TEXT;
+    v_ids     TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM 1 FROM old_rows LIMIT 1;
+    ELSE
+        PERFORM 1 FROM new_rows LIMIT 1;
+    END IF;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE table_versions
+    SET version = version + 1,
+        updated_at = clock_timestamp()
+    WHERE table_name = TG_TABLE_NAME
+      AND shard = pg_backend_pid() % 16;
+
+    -- TG_ARGV is NULL for a trigger created without arguments
+    FOREACH v_mapping IN ARRAY COALESCE(TG_ARGV, ARRAY[]::TEXT[]) LOOP
+        v_column := split_part(v_mapping, ':', 2);
+        v_ids := CASE TG_OP
+                     WHEN 'INSERT' THEN format('SELECT %I AS id FROM new_rows', v_column)
+                     WHEN 'DELETE' THEN format('SELECT %I AS id FROM old_rows', v_column)
+                     ELSE format('SELECT %1$I AS id FROM old_rows'
+                                 ' UNION SELECT %1$I FROM new_rows', v_column)
+                 END;
+
+        EXECUTE format('
+            INSERT INTO entity_versions (entity, entity_id, version, updated_at)
+            SELECT %L, id, 1, clock_timestamp()
+            FROM (SELECT DISTINCT id FROM (%s) r) d
+            ORDER BY id
+            ON CONFLICT (entity, entity_id) DO UPDATE
+            SET version = entity_versions.version + 1,
+                updated_at = EXCLUDED.updated_at',
+            split_part(v_mapping, ':', 1), v_ids);
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t RECORD;
+BEGIN
+    FOR t IN
+        SELECT * FROM (VALUES
+            ('departments',      ''),
+            ('semesters',        ''),
+            ('instructors',      ''),
+            ('students',         '''student:student_id'''),
+            ('courses',          '''course:course_id'''),
+            ('course_offerings', '''course:course_id'''),
+            ('enrollments',      '''student:student_id'', ''course:course_id''')
+        ) AS v(table_name, mappings)
+    LOOP
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_insert
+                        AFTER INSERT ON %1$I
+                        REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION bump_data_versions(%2$s)',
+                       t.table_name, t.mappings);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_update
+                        AFTER UPDATE ON %1$I
+                        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION bump_data_versions(%2$s)',
+                       t.table_name, t.mappings);
+        EXECUTE format('CREATE TRIGGER trg_%1$s_version_delete
+                        AFTER DELETE ON %1$I
+                        REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT
+                        EXECUTE FUNCTION bump_data_versions(%2$s)',
+                       t.table_name, t.mappings);
+    END LOOP;
+END;
+$$;
 
 ------------------------------------------------------------
 -- End of final_project.sql
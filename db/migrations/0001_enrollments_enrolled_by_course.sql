@@ -0,0 +1,12 @@
+-- migrate: no-transaction
+------------------------------------------------------------
+-- 0001: active enrollments by course and term
+-- Partial index over the 'Enrolled' rows only (a small slice of a table
+-- that is mostly Completed history). Serves every "who is currently in
+-- this course" predicate: force_delete_course and delete_instructor
+-- (course_id ... AND status = 'Enrolled'), the default course roster
+-- export, and per-offering lookups by (course_id, semester_id).
+------------------------------------------------------------
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_enrollments_enrolled_course_semester
+    ON enrollments (course_id, semester_id)
+    WHERE status = 'Enrolled';
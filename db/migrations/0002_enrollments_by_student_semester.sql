@@ -0,0 +1,15 @@
+-- migrate: no-transaction
+------------------------------------------------------------
+-- 0002: enrollments by student and term
+-- student_detail and the transcript export read one student's rows
+-- (optionally for one semester_id). UNIQUE(student_id, course_id,
+-- semester_id) also leads with student_id, but its course_id column sits
+-- between the two predicates; this index answers the per-term filter
+-- directly and is narrower. It also serves every lookup by student_id
+-- alone, so idx_enrollments_student (student_id) is dropped once it is
+-- built and writes maintain one index less.
+------------------------------------------------------------
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_enrollments_student_semester
+    ON enrollments (student_id, semester_id);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_enrollments_student;
@@ -0,0 +1,12 @@
+-- migrate: no-transaction
+------------------------------------------------------------
+-- 0004: courses by instructor
+-- instructor_detail, confirm_delete_instructor and delete_instructor all
+-- filter courses on instructor_id and status. The new index covers
+-- lookups by instructor_id alone (and the foreign key checks) as well,
+-- so idx_courses_instructor (instructor_id) is dropped once it is built.
+------------------------------------------------------------
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_instructor_status
+    ON courses (instructor_id, status);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_courses_instructor;
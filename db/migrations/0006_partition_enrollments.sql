@@ -0,0 +1,357 @@
+------------------------------------------------------------
+-- 0006: partition enrollments by semester
+-- enrollments becomes a LIST-partitioned table with one partition per
+-- semester (enrollments_<year>_<term>), so queries that filter on
+-- semester_id only read that term's partition and closed terms can be
+-- detached into enrollments_archive (flask partitions archive).
+--
+-- The primary key has to include the partition key, so it becomes
+-- (enrollment_id, semester_id); enrollment_id still comes from the same
+-- sequence and stays unique. UNIQUE(student_id, course_id, semester_id)
+-- already contains semester_id and is kept as is.
+--
+-- Rows are routed to their partition before BEFORE ROW triggers run, so
+-- inserts must carry semester_id (every insert path in the app does):
+-- trg_enforce_course_capacity now checks it against the offering instead
+-- of filling it in. Statement-level GPA and version triggers stay
+-- on the parent and see the rows of every partition.
+--
+-- Runs in one transaction and holds an exclusive lock on enrollments
+-- while the rows are copied; plan a maintenance window on large tables.
+-- Needs PostgreSQL 14 or later. Indexes created on enrollments by hand
+-- (outside final_project.sql and 0001 / 0002) are not carried over.
+------------------------------------------------------------
+LOCK TABLE enrollments IN ACCESS EXCLUSIVE MODE;
+
+------------------------------------------------------------
+-- One partition per semester, created with the semester
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION enrollment_partition_name(p_term VARCHAR, p_year INTEGER)
+RETURNS TEXT AS $$
+    SELECT format('enrollments_%s_%s', p_year,
+                  regexp_replace(lower(p_term), '[^a-z0-9]+', '_', 'g'));
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Creates the semester's partition unless it exists (live or archived);
+-- returns its name. The empty table is attached rather than created with
+-- PARTITION OF: ATTACH only takes a SHARE UPDATE EXCLUSIVE lock on
+-- enrollments, so it does not wait for or block reads and writes.
+CREATE OR REPLACE FUNCTION create_enrollment_partition(p_semester_id INTEGER)
+RETURNS TEXT AS $$
+DECLARE
+    v_name TEXT;
+BEGIN
+    SELECT enrollment_partition_name(term, year) INTO v_name
+    FROM semesters
+    WHERE semester_id = p_semester_id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Semester % does not exist', p_semester_id;
+    END IF;
+
+    IF to_regclass(v_name) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I (LIKE enrollments INCLUDING DEFAULTS)', v_name);
+        EXECUTE format('ALTER TABLE enrollments ATTACH PARTITION %I FOR VALUES IN (%s)',
+                       v_name, p_semester_id);
+    END IF;
+
+    RETURN v_name;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_semester_enrollment_partition()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM create_enrollment_partition(NEW.semester_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+------------------------------------------------------------
+-- Rebuild the table as a partitioned one
+------------------------------------------------------------
+ALTER TABLE enrollments RENAME TO enrollments_unpartitioned;
+ALTER INDEX enrollments_pkey RENAME TO enrollments_unpartitioned_pkey;
+ALTER INDEX enrollments_student_id_course_id_semester_id_key
+    RENAME TO enrollments_unpartitioned_student_id_course_id_semester_id_key;
+
+-- keys and foreign keys are added after the copy, so they are built and
+-- validated in one pass instead of row by row
+CREATE TABLE enrollments (
+    enrollment_id   INTEGER NOT NULL DEFAULT nextval('enrollments_enrollment_id_seq'),
+    student_id      INTEGER NOT NULL,
+    course_id       INTEGER NOT NULL,
+    semester_id     INTEGER NOT NULL,
+    offering_id     INTEGER NOT NULL,
+    enrollment_date DATE NOT NULL DEFAULT CURRENT_DATE,
+    status          VARCHAR(20) NOT NULL DEFAULT 'Enrolled',
+    grade           VARCHAR(5)
+) PARTITION BY LIST (semester_id);
+
+ALTER SEQUENCE enrollments_enrollment_id_seq OWNED BY enrollments.enrollment_id;
+
+SELECT create_enrollment_partition(semester_id) FROM semesters ORDER BY semester_id;
+
+INSERT INTO enrollments
+    (enrollment_id, student_id, course_id, semester_id, offering_id,
+     enrollment_date, status, grade)
+SELECT enrollment_id, student_id, course_id, semester_id, offering_id,
+       enrollment_date, status, grade
+FROM enrollments_unpartitioned;
+
+DROP TABLE enrollments_unpartitioned;
+
+ALTER TABLE enrollments
+    ADD PRIMARY KEY (enrollment_id, semester_id),
+    ADD UNIQUE (student_id, course_id, semester_id),
+    ADD FOREIGN KEY (student_id) REFERENCES students(student_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    ADD FOREIGN KEY (course_id) REFERENCES courses(course_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    ADD FOREIGN KEY (semester_id) REFERENCES semesters(semester_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    ADD FOREIGN KEY (offering_id) REFERENCES course_offerings(offering_id)
+        ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- final_project.sql section 7, 0001 and 0002 (which replaced
+-- idx_enrollments_student); created on every partition
+CREATE INDEX idx_enrollments_course ON enrollments(course_id, enrollment_id);
+CREATE INDEX idx_enrollments_semester ON enrollments(semester_id, enrollment_id);
+CREATE INDEX idx_enrollments_status ON enrollments(status, enrollment_id);
+CREATE INDEX idx_enrollments_offering_status ON enrollments(offering_id, status);
+CREATE INDEX idx_enrollments_enrolled_course_semester
+    ON enrollments (course_id, semester_id)
+    WHERE status = 'Enrolled';
+CREATE INDEX idx_enrollments_student_semester ON enrollments (student_id, semester_id);
+
+CREATE TRIGGER trg_semesters_enrollment_partition
+AFTER INSERT ON semesters
+FOR EACH ROW
+EXECUTE FUNCTION create_semester_enrollment_partition();
+
+------------------------------------------------------------
+-- Triggers (recreated on the new table)
+------------------------------------------------------------
+CREATE OR REPLACE FUNCTION enforce_course_capacity()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_course_id   INTEGER;
+    v_semester_id INTEGER;
+BEGIN
+    IF NEW.offering_id IS NULL THEN
+        SELECT offering_id INTO NEW.offering_id
+        FROM course_offerings
+        WHERE course_id = NEW.course_id
+          AND semester_id = NEW.semester_id;
+
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Course % is not offered in semester %',
+                            NEW.course_id, NEW.semester_id;
+        END IF;
+    ELSE
+        SELECT course_id, semester_id INTO v_course_id, v_semester_id
+        FROM course_offerings
+        WHERE offering_id = NEW.offering_id;
+
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Course offering % does not exist', NEW.offering_id;
+        END IF;
+
+        -- the row is already in the partition of NEW.semester_id
+        IF v_semester_id <> NEW.semester_id THEN
+            RAISE EXCEPTION 'Offering % is in semester %, not %',
+                            NEW.offering_id, v_semester_id, NEW.semester_id;
+        END IF;
+        NEW.course_id := v_course_id;
+    END IF;
+
+    IF NEW.status = 'Enrolled' THEN
+        PERFORM reserve_course_seat(NEW.offering_id);
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_enforce_course_capacity
+BEFORE INSERT ON enrollments
+FOR EACH ROW
+EXECUTE FUNCTION enforce_course_capacity();
+
+CREATE TRIGGER trg_gpa_after_insert
+AFTER INSERT ON enrollments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_gpa_after_statement();
+
+CREATE TRIGGER trg_gpa_after_update
+AFTER UPDATE ON enrollments
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_gpa_after_statement();
+
+CREATE TRIGGER trg_gpa_after_delete
+AFTER DELETE ON enrollments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_gpa_after_statement();
+
+CREATE TRIGGER trg_enrolled_count_delete
+AFTER DELETE ON enrollments
+FOR EACH ROW
+EXECUTE FUNCTION maintain_course_enrolled_count();
+
+CREATE TRIGGER trg_enrolled_count_update
+AFTER UPDATE OF status, offering_id ON enrollments
+FOR EACH ROW
+WHEN (OLD.status IS DISTINCT FROM NEW.status
+      OR OLD.offering_id IS DISTINCT FROM NEW.offering_id)
+EXECUTE FUNCTION maintain_course_enrolled_count();
+
+CREATE TRIGGER trg_enrollments_version_insert
+AFTER INSERT ON enrollments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_data_versions('student:student_id', 'course:course_id');
+
+CREATE TRIGGER trg_enrollments_version_update
+AFTER UPDATE ON enrollments
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_data_versions('student:student_id', 'course:course_id');
+
+CREATE TRIGGER trg_enrollments_version_delete
+AFTER DELETE ON enrollments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_data_versions('student:student_id', 'course:course_id');
+
+------------------------------------------------------------
+-- Archive of detached closed-term partitions
+-- Archived rows leave the live table but still count towards GPA:
+-- students' running totals keep them, and every full recomputation reads
+-- enrollment_history (live + archived) so it agrees with those totals.
+------------------------------------------------------------
+CREATE TABLE enrollments_archive (LIKE enrollments)
+PARTITION BY LIST (semester_id);
+
+-- same definitions as on the live partitions, so a detached partition's
+-- indexes are attached instead of rebuilt
+CREATE INDEX idx_enrollments_archive_student_semester ON enrollments_archive(student_id, semester_id);
+CREATE INDEX idx_enrollments_archive_course ON enrollments_archive(course_id, enrollment_id);
+
+CREATE OR REPLACE VIEW enrollment_history AS
+SELECT enrollment_id, student_id, course_id, semester_id, offering_id,
+       enrollment_date, status, grade
+FROM enrollments
+UNION ALL
+SELECT enrollment_id, student_id, course_id, semester_id, offering_id,
+       enrollment_date, status, grade
+FROM enrollments_archive;
+
+CREATE OR REPLACE FUNCTION calculate_student_gpa(p_student_id INTEGER)
+RETURNS NUMERIC(3,2) AS $$
+DECLARE
+    calculated_gpa NUMERIC(3,2);
+BEGIN
+    -- credit-weighted, recomputed from the full history
+    SELECT ROUND(SUM(c.credits * gp.points) / NULLIF(SUM(c.credits), 0), 2)
+    INTO calculated_gpa
+    FROM enrollment_history e
+    JOIN courses c ON c.course_id = e.course_id
+    JOIN grade_points gp ON gp.grade = e.grade
+    WHERE e.student_id = p_student_id
+      AND e.status = 'Completed'
+      AND e.grade IS NOT NULL;
+
+    RETURN COALESCE(calculated_gpa, 0.00);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_gpa_totals(p_repair BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (
+    student_id        INTEGER,
+    stored_points     NUMERIC,
+    actual_points     NUMERIC,
+    stored_credits    INTEGER,
+    actual_credits    INTEGER,
+    stored_gpa        NUMERIC,
+    actual_gpa        NUMERIC
+) AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_repair THEN
+        LOCK TABLE enrollments, enrollments_archive IN SHARE MODE;
+        LOCK TABLE courses IN SHARE MODE;
+    END IF;
+
+    CREATE TEMP TABLE gpa_rebuild AS
+    SELECT s.student_id,
+           COALESCE(t.points, 0)::NUMERIC(8,1) AS points,
+           COALESCE(t.credits, 0)::INTEGER AS credits,
+           CASE WHEN t.credits > 0 THEN ROUND(t.points / t.credits, 2) END AS gpa
+    FROM students s
+    LEFT JOIN (
+        SELECT e.student_id,
+               SUM(c.credits * gp.points) AS points,
+               SUM(c.credits) AS credits
+        FROM enrollment_history e
+        JOIN courses c ON c.course_id = e.course_id
+        JOIN grade_points gp ON gp.grade = e.grade
+        WHERE e.status = 'Completed'
+        GROUP BY e.student_id
+    ) t ON t.student_id = s.student_id;
+
+    RETURN QUERY
+    SELECT s.student_id, s.quality_points, r.points,
+           s.attempted_credits, r.credits, s.gpa, r.gpa
+    FROM students s
+    JOIN gpa_rebuild r ON r.student_id = s.student_id
+    WHERE (s.quality_points, s.attempted_credits, s.gpa)
+          IS DISTINCT FROM (r.points, r.credits, r.gpa)
+    ORDER BY s.student_id;
+
+    IF p_repair THEN
+        UPDATE students s
+        SET quality_points = r.points,
+            attempted_credits = r.credits,
+            gpa = r.gpa
+        FROM gpa_rebuild r
+        WHERE r.student_id = s.student_id
+          AND (s.quality_points, s.attempted_credits, s.gpa)
+              IS DISTINCT FROM (r.points, r.credits, r.gpa);
+    END IF;
+
+    DROP TABLE gpa_rebuild;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION adjust_gpa_after_credit_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_student_ids INTEGER[];
+    v_quality     NUMERIC[];
+    v_credits     INTEGER[];
+BEGIN
+    SELECT ARRAY_AGG(d.student_id), ARRAY_AGG(d.quality), ARRAY_AGG(d.credits)
+    INTO v_student_ids, v_quality, v_credits
+    FROM (
+        SELECT e.student_id,
+               SUM((NEW.credits - OLD.credits) * gp.points) AS quality,
+               SUM(NEW.credits - OLD.credits)::INTEGER AS credits
+        FROM enrollment_history e
+        JOIN grade_points gp ON gp.grade = e.grade
+        WHERE e.course_id = NEW.course_id
+          AND e.status = 'Completed'
+        GROUP BY e.student_id
+    ) d;
+
+    IF v_student_ids IS NOT NULL THEN
+        PERFORM apply_gpa_deltas(v_student_ids, v_quality, v_credits);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+ANALYZE enrollments;
@@ -0,0 +1,20 @@
+-- migrate: no-transaction
+------------------------------------------------------------
+-- 0007: trigram search on students, courses and instructors
+-- /search and /api/search match a lower-cased document per row against
+-- the query with LIKE '%q%' (substrings) and <% (word similarity, for
+-- typos). Both are answered from a GIN gin_trgm_ops index on the exact
+-- document expression used in app/search.py. pg_trgm ships with
+-- PostgreSQL and is a trusted extension (13+), so the database owner can
+-- create it.
+------------------------------------------------------------
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_students_search_trgm
+    ON students USING GIN (lower(first_name || ' ' || last_name || ' ' || email) gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_search_trgm
+    ON courses USING GIN (lower(course_code || ' ' || course_name) gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_instructors_search_trgm
+    ON instructors USING GIN (lower(first_name || ' ' || last_name) gin_trgm_ops);
@@ -0,0 +1,111 @@
+------------------------------------------------------------
+-- 0008: precomputed report views
+-- Summaries for the /reports pages, kept as materialized views so a
+-- report reads a few hundred precomputed rows instead of joining and
+-- aggregating enrollments on every request:
+--   report_course_fill         seats taken / capacity per offering
+--   report_grade_distribution  grade histogram per course
+--   report_department_gpa      GPA percentiles per department and
+--                              enrollment year
+-- Each has a unique index on plain columns, which REFRESH MATERIALIZED
+-- VIEW CONCURRENTLY needs: refreshes (flask reports refresh, and the
+-- refresher the app runs after grades are posted) do not block readers.
+-- Enrollments are read through enrollment_history (0006), so archived
+-- terms stay in the reports. report_refreshes records when each view was
+-- last refreshed; the report pages send it as Last-Modified.
+------------------------------------------------------------
+CREATE TABLE report_refreshes (
+    view_name     VARCHAR(60) PRIMARY KEY,
+    refreshed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    duration_ms   INTEGER NOT NULL DEFAULT 0,
+    row_count     BIGINT NOT NULL DEFAULT 0
+);
+
+------------------------------------------------------------
+-- Fill rate per course offering. Seats taken are Enrolled and
+-- Completed rows (a closed term's seats end up Completed); Withdrawn and
+-- Dropped rows are counted apart, cancelled ones not at all.
+------------------------------------------------------------
+CREATE MATERIALIZED VIEW report_course_fill AS
+SELECT o.offering_id,
+       o.course_id,
+       c.course_code,
+       c.course_name,
+       c.department_id,
+       o.semester_id,
+       sm.term,
+       sm.year,
+       sm.start_date,
+       o.capacity,
+       COALESCE(e.seats_taken, 0) AS seats_taken,
+       COALESCE(e.withdrawn, 0) AS withdrawn,
+       ROUND(COALESCE(e.seats_taken, 0)::NUMERIC / o.capacity, 3) AS fill_rate
+FROM course_offerings o
+JOIN courses c ON c.course_id = o.course_id
+JOIN semesters sm ON sm.semester_id = o.semester_id
+LEFT JOIN (
+    SELECT offering_id,
+           COUNT(*) FILTER (WHERE status IN ('Enrolled', 'Completed')) AS seats_taken,
+           COUNT(*) FILTER (WHERE status IN ('Withdrawn', 'Dropped')) AS withdrawn
+    FROM enrollment_history
+    GROUP BY offering_id
+) e ON e.offering_id = o.offering_id;
+
+CREATE UNIQUE INDEX idx_report_course_fill_offering ON report_course_fill (offering_id);
+CREATE INDEX idx_report_course_fill_semester ON report_course_fill (semester_id, department_id);
+
+------------------------------------------------------------
+-- Grade histogram per course over every term, Completed rows with a
+-- grade. `points` is NULL for grades that do not count towards GPA.
+------------------------------------------------------------
+CREATE MATERIALIZED VIEW report_grade_distribution AS
+SELECT e.course_id,
+       c.course_code,
+       c.course_name,
+       c.department_id,
+       e.grade,
+       gp.points,
+       COUNT(*) AS students,
+       ROUND(COUNT(*)::NUMERIC / SUM(COUNT(*)) OVER (PARTITION BY e.course_id), 3) AS share
+FROM enrollment_history e
+JOIN courses c ON c.course_id = e.course_id
+LEFT JOIN grade_points gp ON gp.grade = e.grade
+WHERE e.status = 'Completed'
+  AND e.grade IS NOT NULL
+GROUP BY e.course_id, c.course_code, c.course_name, c.department_id, e.grade, gp.points;
+
+CREATE UNIQUE INDEX idx_report_grade_distribution_course_grade
+    ON report_grade_distribution (course_id, grade);
+CREATE INDEX idx_report_grade_distribution_department
+    ON report_grade_distribution (department_id, course_code);
+
+------------------------------------------------------------
+-- GPA percentiles per department and enrollment year, over students
+-- with graded credits (students.gpa is maintained by the GPA triggers).
+------------------------------------------------------------
+CREATE MATERIALIZED VIEW report_department_gpa AS
+SELECT s.department_id,
+       d.department_name,
+       s.enrollment_year,
+       COUNT(*) AS students,
+       ROUND(AVG(s.gpa), 2) AS avg_gpa,
+       ROUND(PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY s.gpa)::NUMERIC, 2) AS p25_gpa,
+       ROUND(PERCENTILE_CONT(0.50) WITHIN GROUP (ORDER BY s.gpa)::NUMERIC, 2) AS median_gpa,
+       ROUND(PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY s.gpa)::NUMERIC, 2) AS p75_gpa,
+       ROUND(PERCENTILE_CONT(0.90) WITHIN GROUP (ORDER BY s.gpa)::NUMERIC, 2) AS p90_gpa
+FROM students s
+JOIN departments d ON d.department_id = s.department_id
+WHERE s.attempted_credits > 0
+  AND s.gpa IS NOT NULL
+  AND s.enrollment_year IS NOT NULL
+GROUP BY s.department_id, d.department_name, s.enrollment_year;
+
+CREATE UNIQUE INDEX idx_report_department_gpa_department_year
+    ON report_department_gpa (department_id, enrollment_year);
+
+INSERT INTO report_refreshes (view_name, row_count)
+SELECT 'report_course_fill', COUNT(*) FROM report_course_fill
+UNION ALL
+SELECT 'report_grade_distribution', COUNT(*) FROM report_grade_distribution
+UNION ALL
+SELECT 'report_department_gpa', COUNT(*) FROM report_department_gpa;
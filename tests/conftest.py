@@ -0,0 +1,217 @@
+"""
+Session fixtures: a scratch database created on the configured server
+(DB_HOST / DB_USER / DB_PASSWORD from the environment or .env; the user
+needs CREATEDB), loaded from db/final_project.sql, migrated, and dropped
+when the session ends. The app under test connects to it through DB_NAME,
+so nothing touches the database .env points at.
+"""
+import io
+import os
+import uuid
+from datetime import datetime
+
+import psycopg2
+import pytest
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = os.path.join(ROOT, "db", "final_project.sql")
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("budgets", "route budget checks")
+    group.addoption("--scale", type=int, default=40,
+                    help="students and courses in the large fixtures (at least 5)")
+    group.addoption("--repeat", type=int, default=5,
+                    help="GET requests per case; the median is compared with the ceiling")
+    group.addoption("--latency-factor", type=float, default=1.0,
+                    help="multiply every latency ceiling (slow machines, CI)")
+
+
+def _server_connection():
+    conn = psycopg2.connect(host=os.getenv("DB_HOST"), user=os.getenv("DB_USER"),
+                            password=os.getenv("DB_PASSWORD"),
+                            dbname=os.getenv("TEST_DB_MAINTENANCE", "postgres"))
+    conn.autocommit = True
+    return conn
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Name of the scratch database, with the schema and every migration applied."""
+    load_dotenv()
+    try:
+        server = _server_connection()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no PostgreSQL server for a scratch database: {str(e).strip()}")
+
+    from app import migrations, models
+
+    name = f"course_enrollment_test_{uuid.uuid4().hex[:8]}"
+    previous = os.environ.get("DB_NAME")
+    server.cursor().execute(f'CREATE DATABASE "{name}"')
+    os.environ["DB_NAME"] = name
+    try:
+        conn = psycopg2.connect(**models._connect_kwargs())
+        with open(SCHEMA, encoding="utf-8") as fh:
+            conn.cursor().execute(fh.read())
+        conn.commit()
+        conn.close()
+
+        conn = migrations.connect()
+        migrations.migrate(conn, echo=lambda message: None)
+        conn.close()
+
+        yield name
+    finally:
+        if models._pool is not None and not models._pool.closed:
+            models._pool.closeall()
+        if previous is None:
+            os.environ.pop("DB_NAME", None)
+        else:
+            os.environ["DB_NAME"] = previous
+        server.cursor().execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        server.close()
+
+
+def _create_app(**config):
+    from app import create_app
+
+    return create_app(dict({
+        "SECRET_KEY": "budget-check",
+        "QUERY_METRICS": True,
+        "SLOW_QUERY_MS": 0,
+        "CACHE_INVALIDATION_LISTENER": False,
+        "REPORTS_REFRESH_AFTER_GRADES": False,
+        "REPORTS_REFRESH_INTERVAL": 0,
+    }, **config))
+
+
+@pytest.fixture(scope="session")
+def app(database):
+    """The app with the default config (prepared statements on)."""
+    return _create_app()
+
+
+@pytest.fixture(scope="session")
+def plain_app(database):
+    """
+    The app with PREPARED_STATEMENTS off: its statements are plain SQL,
+    which the plan checks can EXPLAIN on a connection of their own.
+    """
+    return _create_app(PREPARED_STATEMENTS=False)
+
+
+@pytest.fixture(scope="session")
+def db(database):
+    """A connection of the tests' own (RealDictCursor), outside the app's pool."""
+    from app.models import _connect_kwargs
+
+    conn = psycopg2.connect(**_connect_kwargs(), cursor_factory=RealDictCursor)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def fx(db, request):
+    """
+    Two instructors, `--scale` courses offered in the newest open term and
+    `--scale` students. Student 0 takes every course and every student takes
+    course 0, so student 0 / course 0 / instructor "big" are the large
+    entities and student 1 / course 1 / instructor "small" the small ones.
+    """
+    scale = request.config.getoption("--scale")
+    if scale < 5:
+        pytest.fail("--scale must be at least 5")
+    tag = "T"
+    cur = db.cursor()
+
+    cur.execute("SELECT department_id FROM instructors ORDER BY instructor_id LIMIT 1")
+    department_id = cur.fetchone()["department_id"]
+
+    cur.execute("SELECT semester_id FROM open_semesters ORDER BY start_date DESC LIMIT 1")
+    semester_id = cur.fetchone()["semester_id"]
+
+    cur.execute("""
+        INSERT INTO instructors (department_id, first_name, last_name, email, title)
+        SELECT %s, 'Budget', name, 'budget-' || %s || '-' || name || '@bench.invalid', 'Lecturer'
+        FROM UNNEST(ARRAY['big', 'small']) AS name
+        RETURNING instructor_id
+    """, (department_id, tag))
+    big_instructor, small_instructor = [r["instructor_id"] for r in cur.fetchall()]
+
+    # the last course belongs to the small instructor
+    cur.execute("""
+        INSERT INTO courses
+            (course_code, course_name, credits, level, capacity, department_id, instructor_id, status)
+        SELECT 'BG' || %s || LPAD(n::TEXT, 3, '0'), 'Budget Course ' || n, 3, 'Undergraduate',
+               %s, %s, CASE WHEN n = %s THEN %s ELSE %s END, 'Active'
+        FROM generate_series(0, %s - 1) AS n
+        ORDER BY n
+        RETURNING course_id
+    """, (tag, scale + 10, department_id, scale - 1, small_instructor, big_instructor, scale))
+    course_ids = [r["course_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO course_offerings (course_id, semester_id, instructor_id, capacity)
+        SELECT c.course_id, %s, c.instructor_id, c.capacity
+        FROM courses c
+        WHERE c.course_id = ANY(%s)
+        ORDER BY c.course_id
+        RETURNING offering_id
+    """, (semester_id, course_ids))
+    offering_ids = [r["offering_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO students (first_name, last_name, email, department_id, enrollment_year, status)
+        SELECT 'Budget', 'Student ' || n, 'budget-' || %s || '-' || n || '@bench.invalid',
+               %s, %s, 'Active'
+        FROM generate_series(0, %s - 1) AS n
+        ORDER BY n
+        RETURNING student_id
+    """, (tag, department_id, datetime.now().year, scale))
+    student_ids = [r["student_id"] for r in cur.fetchall()]
+
+    cur.execute("""
+        INSERT INTO enrollments (student_id, offering_id, course_id, semester_id, status)
+        SELECT v.student_id, v.offering_id, o.course_id, o.semester_id, 'Enrolled'
+        FROM (
+            SELECT %s AS student_id, o AS offering_id FROM UNNEST(%s::INTEGER[]) AS o
+            UNION
+            SELECT s, %s FROM UNNEST(%s::INTEGER[]) AS s
+        ) v
+        JOIN course_offerings o ON o.offering_id = v.offering_id
+        RETURNING enrollment_id, student_id, offering_id
+    """, (student_ids[0], offering_ids, offering_ids[0], student_ids))
+    enrollments = {(r["student_id"], r["offering_id"]): r["enrollment_id"]
+                   for r in cur.fetchall()}
+
+    cur.execute("ANALYZE")
+    db.commit()
+    cur.close()
+
+    s, o = student_ids, offering_ids
+    return dict(tag=tag, department_id=department_id, semester_id=semester_id,
+                i=(big_instructor, small_instructor), c=course_ids, o=offering_ids, s=student_ids,
+                graded=enrollments[(s[1], o[0])], imported=enrollments[(s[2], o[0])])
+
+
+@pytest.fixture(scope="session")
+def statements(app):
+    """Every statement the app runs, as sent (the slow-query hook at a zero threshold)."""
+    from app.instrumentation import set_slow_query_hook
+
+    seen = []
+
+    def capture(cursor, query, vars, duration):
+        seen.append(cursor.mogrify(query, vars).decode())
+
+    set_slow_query_hook(0.0, capture)
+    yield seen
+    set_slow_query_hook(float("inf"), capture)
+
+
+def upload(text, filename):
+    """A multipart file field; built per request, since the client consumes it."""
+    return (io.BytesIO(text.encode()), filename)
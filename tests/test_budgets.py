@@ -0,0 +1,410 @@
+"""
+Per-route statement and latency budgets, plus index checks for hot queries.
+
+Every route of the main and reports blueprints is requested through the
+Flask app against the scratch database (see conftest.py), and a route
+fails when it
+
+  * runs more SQL statements than its budget,
+  * runs a different number of statements for a small and a large
+    student / course / instructor (an N+1 pattern),
+  * is slower than its latency ceiling (median of --repeat GETs), or
+  * reads enrollments with a sequential scan in one of the hot queries
+    (enrollments by student, by course and by status), checked with
+    EXPLAIN on the exact statements the route ran.
+
+Routes without a budget or a case fail too, so new routes have to be
+given one. Statements are counted through the query instrumentation,
+after one warm-up pass so cached reference data is not counted. Budgets
+assume the default config: QUERY_METRICS and CONDITIONAL_GET on (the
+conditional pages spend one statement on the version lookup). The GETs
+run twice, with PREPARED_STATEMENTS on (the default) and off, against the
+same budgets; the writes run once, under the default config, and each
+one checks its redirect, its flash and the rows it changed.
+
+The scratch database is small, where the planner rightly prefers
+sequential scans, so plans are checked with enable_seqscan off: that
+still fails when no usable index exists. Plans are checked in the plain
+run only: the EXECUTEs of the prepared run name statements that exist on
+the app's connection alone.
+
+    python -m pytest tests --scale 40 --repeat 5
+"""
+import statistics
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import pytest
+
+from conftest import upload
+
+# (endpoint, method) -> (max statements, latency ceiling in ms)
+BUDGETS = {
+    ("main.index", "GET"): (1, 100),
+    ("main.student_detail", "GET"): (3, 100),
+    ("main.add_student", "GET"): (0, 50),
+    ("main.add_student", "POST"): (1, 100),
+    ("main.edit_student", "GET"): (1, 50),
+    ("main.edit_student", "POST"): (1, 100),
+    ("main.delete_student", "POST"): (1, 100),
+    ("main.course_list", "GET"): (2, 100),
+    ("main.course_detail", "GET"): (4, 100),
+    ("main.save_offering", "POST"): (1, 100),
+    ("main.add_course", "GET"): (0, 50),
+    ("main.add_course", "POST"): (1, 100),
+    ("main.edit_course", "GET"): (1, 50),
+    ("main.edit_course", "POST"): (1, 100),
+    ("main.delete_course", "POST"): (1, 100),
+    ("main.confirm_course_delete", "GET"): (0, 50),
+    ("main.force_delete_course", "POST"): (1, 100),
+    ("main.enroll_page", "GET"): (2, 150),
+    ("main.enroll_submit", "POST"): (1, 100),
+    ("main.instructor_list", "GET"): (1, 100),
+    ("main.add_instructor", "GET"): (0, 50),
+    ("main.add_instructor", "POST"): (1, 100),
+    ("main.edit_instructor", "GET"): (1, 50),
+    ("main.edit_instructor", "POST"): (1, 100),
+    ("main.instructor_detail", "GET"): (2, 100),
+    ("main.confirm_delete_instructor", "GET"): (3, 100),
+    ("main.delete_instructor", "POST"): (1, 100),
+    ("main.enrollment_list", "GET"): (2, 150),
+    ("main.grade_enrollment", "GET"): (1, 50),
+    ("main.grade_enrollment", "POST"): (1, 100),
+    ("main.import_grades", "GET"): (0, 50),
+    ("main.import_grades", "POST"): (8, 500),
+    ("main.bulk_enroll", "GET"): (1, 150),
+    ("main.bulk_enroll", "POST"): (5, 500),
+    ("main.export_enrollments", "GET"): (1, 250),
+    ("main.export_course_roster", "GET"): (1, 250),
+    ("main.export_transcript", "GET"): (1, 250),
+    ("main.search_page", "GET"): (4, 50),
+    ("main.search_api", "GET"): (4, 20),
+    ("main.cache_stats", "GET"): (0, 50),
+    ("reports.report_index", "GET"): (1, 50),
+    ("reports.show_report", "GET"): (2, 100),
+    ("reports.what_if", "GET"): (0, 250),
+    ("main.slow_queries", "GET"): (0, 250),
+}
+
+# a hot-query plan must not read these relations sequentially
+HOT_RELATION = "enrollments"
+
+# PREPARED_STATEMENTS on (the default config) and off
+MODES = ("prepared", "plain")
+
+
+# -----------------------------
+# Cases
+# -----------------------------
+def student_form(fx, **changes):
+    return dict(dict(first_name="Budget", last_name="Student 2",
+                     email=f"budget-{fx['tag']}-2@bench.invalid",
+                     department_id=fx["department_id"],
+                     enrollment_year=datetime.now().year, status="Active"), **changes)
+
+
+def course_form(fx, **changes):
+    return dict(dict(course_code=f"BG{fx['tag']}001", course_name="Budget Course 1", credits=3,
+                     level="Undergraduate", capacity=len(fx["s"]) + 10,
+                     department_id=fx["department_id"], instructor_id=fx["i"][0]), **changes)
+
+
+def instructor_form(fx, **changes):
+    return dict(dict(department_id=fx["department_id"], first_name="Budget",
+                     last_name="small", email=f"budget-{fx['tag']}-small@bench.invalid",
+                     title="Lecturer"), **changes)
+
+
+def expect(location, flash, check):
+    """
+    What a write must leave behind: a redirect to `location` (None: a
+    200 page), the category of the message it flashes (None: no message)
+    and a query whose single column `ok` is true once the rows changed.
+    `location` and `check` are formatted like case urls.
+    """
+    return location, flash, check
+
+
+def case(endpoint, method, url, data=None, hot=False, outcome=None):
+    """
+    `url` is formatted with the fixtures (s, c, o, i: students, courses,
+    offerings, instructors; graded, imported: enrollment ids; tag,
+    department_id, semester_id) and `data`, if given, is called with them.
+    Writes give their `outcome` (see expect).
+    """
+    return pytest.param(endpoint, method, url, data, hot, outcome, id=f"{method} {url}")
+
+
+# GETs first; the writes run once each, in an order that keeps the fixtures valid
+CASES = [
+    case("main.index", "GET", "/"),
+    case("main.student_detail", "GET", "/students/{s[0]}", hot=True),
+    case("main.student_detail", "GET", "/students/{s[1]}", hot=True),
+    case("main.add_student", "GET", "/students/add"),
+    case("main.edit_student", "GET", "/students/{s[2]}/edit"),
+    case("main.course_list", "GET", "/courses"),
+    case("main.course_detail", "GET", "/courses/{c[0]}", hot=True),
+    case("main.course_detail", "GET", "/courses/{c[1]}", hot=True),
+    case("main.add_course", "GET", "/courses/add"),
+    case("main.edit_course", "GET", "/courses/{c[1]}/edit"),
+    case("main.confirm_course_delete", "GET", "/courses/{c[1]}/delete/confirm?enrolled=1"),
+    case("main.enroll_page", "GET", "/students/{s[1]}/enroll"),
+    case("main.instructor_list", "GET", "/instructors"),
+    case("main.add_instructor", "GET", "/instructors/add"),
+    case("main.edit_instructor", "GET", "/instructors/{i[1]}/edit"),
+    case("main.instructor_detail", "GET", "/instructors/{i[0]}"),
+    case("main.instructor_detail", "GET", "/instructors/{i[1]}"),
+    case("main.confirm_delete_instructor", "GET", "/instructors/{i[0]}/confirm_delete"),
+    case("main.confirm_delete_instructor", "GET", "/instructors/{i[1]}/confirm_delete"),
+    case("main.enrollment_list", "GET", "/enrollments", hot=True),
+    case("main.enrollment_list", "GET", "/enrollments?view=all&status=Completed", hot=True),
+    case("main.grade_enrollment", "GET", "/enrollments/{graded}/grade"),
+    case("main.import_grades", "GET", "/enrollments/grades/import"),
+    case("main.bulk_enroll", "GET", "/enrollments/bulk"),
+    case("main.export_enrollments", "GET", "/enrollments/export.csv?course=BG{tag}000"),
+    case("main.export_course_roster", "GET", "/courses/{c[0]}/roster.csv", hot=True),
+    case("main.export_course_roster", "GET", "/courses/{c[1]}/roster.csv", hot=True),
+    case("main.export_transcript", "GET", "/students/{s[0]}/transcript.csv", hot=True),
+    case("main.export_transcript", "GET", "/students/{s[1]}/transcript.csv", hot=True),
+    case("main.search_page", "GET", "/search?q=budget+student"),
+    case("main.search_api", "GET", "/api/search?q=budgt+studnt+1"),
+    case("main.cache_stats", "GET", "/cache/stats"),
+    case("reports.report_index", "GET", "/reports/"),
+    case("reports.what_if", "GET", "/reports/what-if?pending=B&threshold=2.0"),
+    case("reports.show_report", "GET", "/reports/fill-rates"),
+    case("reports.show_report", "GET", "/reports/grades"),
+    case("reports.show_report", "GET", "/reports/department-gpa?department_id={department_id}"),
+    case("main.slow_queries", "GET", "/admin/slow-queries"),
+
+    case("main.add_student", "POST", "/students/add",
+         lambda fx: student_form(fx, email=f"budget-{fx['tag']}-new@bench.invalid"),
+         outcome=expect("/", "success", """
+             SELECT COUNT(*) = 1 AS ok FROM students
+             WHERE email = 'budget-{tag}-new@bench.invalid' AND status = 'Active'
+         """)),
+    case("main.edit_student", "POST", "/students/{s[2]}/edit",
+         lambda fx: student_form(fx, last_name="Student 2 edited"),
+         outcome=expect("/students/{s[2]}", "success", """
+             SELECT last_name = 'Student 2 edited' AS ok FROM students WHERE student_id = {s[2]}
+         """)),
+    case("main.enroll_submit", "POST", "/students/{s[1]}/enroll/submit",
+         lambda fx: dict(offering_id=fx["o"][2]),
+         outcome=expect("/students/{s[1]}", "success", """
+             SELECT e.status = 'Enrolled' AND o.enrolled_count = 2 AS ok
+             FROM enrollments e JOIN course_offerings o ON o.offering_id = e.offering_id
+             WHERE e.student_id = {s[1]} AND e.offering_id = {o[2]}
+         """)),
+    case("main.grade_enrollment", "POST", "/enrollments/{graded}/grade",
+         lambda fx: dict(grade="B+"),
+         outcome=expect("/enrollments", "success", """
+             SELECT grade = 'B+' AND status = 'Completed' AS ok
+             FROM enrollments WHERE enrollment_id = {graded}
+         """)),
+    case("main.import_grades", "POST", "/enrollments/grades/import",
+         lambda fx: dict(file=upload(f"enrollment_id,grade\n{fx['imported']},A-\n",
+                                     "grades.csv")),
+         outcome=expect(None, None, """
+             SELECT grade = 'A-' AS ok FROM enrollments WHERE enrollment_id = {imported}
+         """)),
+    case("main.bulk_enroll", "POST", "/enrollments/bulk",
+         lambda fx: dict(offering_id=fx["o"][2], source="csv",
+                         file=upload(f"student_id\n{fx['s'][3]}\n{fx['s'][4]}\n", "cohort.csv")),
+         outcome=expect(None, None, """
+             SELECT COUNT(*) = 2 AS ok FROM enrollments
+             WHERE offering_id = {o[2]} AND student_id IN ({s[3]}, {s[4]}) AND status = 'Enrolled'
+         """)),
+    case("main.save_offering", "POST", "/courses/{c[1]}/offerings",
+         lambda fx: dict(semester_id=fx["semester_id"], capacity=len(fx["s"]) + 20),
+         outcome=expect("/courses/{c[1]}", "success", """
+             SELECT capacity = {scale} + 20 AS ok FROM course_offerings
+             WHERE course_id = {c[1]} AND semester_id = {semester_id}
+         """)),
+    case("main.save_offering", "POST", "/courses/0/offerings",
+         lambda fx: dict(semester_id=fx["semester_id"], capacity=10),
+         outcome=expect("/courses", "danger", """
+             SELECT NOT EXISTS (SELECT 1 FROM course_offerings WHERE course_id = 0) AS ok
+         """)),
+    case("main.add_course", "POST", "/courses/add",
+         lambda fx: course_form(fx, course_code=f"BG{fx['tag']}NEW",
+                                course_name="Budget Course new"),
+         outcome=expect("/courses", "success", """
+             SELECT COUNT(*) = 1 AS ok FROM courses
+             WHERE course_code = 'BG{tag}NEW' AND course_name = 'Budget Course new'
+         """)),
+    case("main.edit_course", "POST", "/courses/{c[1]}/edit",
+         lambda fx: course_form(fx, course_name="Budget Course 1 edited"),
+         outcome=expect("/courses/{c[1]}", "success", """
+             SELECT course_name = 'Budget Course 1 edited' AS ok FROM courses
+             WHERE course_id = {c[1]}
+         """)),
+    # student 0 is enrolled, so this only asks for confirmation
+    case("main.delete_course", "POST", "/courses/{c[1]}/delete",
+         outcome=expect("/courses/{c[1]}/delete/confirm", None, """
+             SELECT status = 'Active' AS ok FROM courses WHERE course_id = {c[1]}
+         """)),
+    case("main.force_delete_course", "POST", "/courses/{c[1]}/delete/force",
+         outcome=expect("/courses", "warning", """
+             SELECT c.status = 'Inactive' AND e.status = 'Course_Cancelled' AS ok
+             FROM courses c JOIN enrollments e ON e.course_id = c.course_id
+             WHERE c.course_id = {c[1]} AND e.student_id = {s[0]}
+         """)),
+    case("main.delete_student", "POST", "/students/{s[3]}/delete",
+         outcome=expect("/", "success", """
+             SELECT status = 'Inactive' AS ok FROM students WHERE student_id = {s[3]}
+         """)),
+    case("main.add_instructor", "POST", "/instructors/add",
+         lambda fx: instructor_form(fx, last_name="new",
+                                    email=f"budget-{fx['tag']}-new@bench.invalid"),
+         outcome=expect("/instructors", "success", """
+             SELECT COUNT(*) = 1 AS ok FROM instructors
+             WHERE email = 'budget-{tag}-new@bench.invalid'
+         """)),
+    case("main.edit_instructor", "POST", "/instructors/{i[1]}/edit",
+         lambda fx: instructor_form(fx, first_name="Budgeted"),
+         outcome=expect("/instructors", "success", """
+             SELECT first_name = 'Budgeted' AS ok FROM instructors WHERE instructor_id = {i[1]}
+         """)),
+    case("main.delete_instructor", "POST", "/instructors/{i[1]}/delete",
+         outcome=expect("/instructors", "success", """
+             SELECT status = 'Inactive' AS ok FROM instructors WHERE instructor_id = {i[1]}
+         """)),
+]
+
+# the same route for a large and a small entity: the statement counts must match
+PAIRS = [
+    pytest.param("/students/{s[0]}", "/students/{s[1]}", id="student"),
+    pytest.param("/courses/{c[0]}", "/courses/{c[1]}", id="course"),
+    pytest.param("/instructors/{i[0]}", "/instructors/{i[1]}", id="instructor"),
+    pytest.param("/instructors/{i[0]}/confirm_delete", "/instructors/{i[1]}/confirm_delete",
+                 id="instructor_delete"),
+    pytest.param("/courses/{c[0]}/roster.csv", "/courses/{c[1]}/roster.csv", id="roster"),
+    pytest.param("/students/{s[0]}/transcript.csv", "/students/{s[1]}/transcript.csv",
+                 id="transcript"),
+]
+
+
+def by_mode(cases):
+    """The GETs under every mode; the writes once, under the default config."""
+    return [pytest.param(mode, *param.values, id=f"{mode} {param.id}")
+            for param in cases
+            for mode in (MODES if param.values[1] == "GET" else MODES[:1])]
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+@pytest.fixture(scope="session")
+def call(app, plain_app, fx, statements):
+    """
+    Request a case's url under a mode; returns (response, seconds,
+    statements run, categories of the messages flashed).
+    """
+    apps = dict(zip(MODES, (app, plain_app)))
+
+    def call(mode, method, url, data=None):
+        client = apps[mode].test_client()
+        statements.clear()
+        start = time.perf_counter()
+        resp = client.open(url.format(**fx), method=method, data=data(fx) if data else {})
+        resp.get_data()  # exports stream their rows while the body is read
+        seconds, ran = time.perf_counter() - start, list(statements)
+        with client.session_transaction() as session:
+            flashed = [category for category, _ in session.get("_flashes", [])]
+        return resp, seconds, ran, flashed
+
+    return call
+
+
+@pytest.fixture(scope="session")
+def warm(call):
+    """One pass over the GETs in every mode, filling the reference cache and the pool."""
+    for param in CASES:
+        endpoint, method, url, *_ = param.values
+        if method == "GET":
+            for mode in MODES:
+                call(mode, method, url)
+
+
+def seq_scanned(plan, prefix):
+    """Relations starting with `prefix` that a JSON plan reads with a Seq Scan."""
+    found, nodes = [], [plan]
+    while nodes:
+        node = nodes.pop()
+        relation = node.get("Relation Name", "")
+        if node["Node Type"] == "Seq Scan" and relation.startswith(prefix):
+            found.append(relation)
+        nodes.extend(node.get("Plans", []))
+    return found
+
+
+def seq_scans(cur, statements):
+    """EXPLAIN the statements that read enrollments; returns the offending ones."""
+    bad = []
+    for sql in statements:
+        if HOT_RELATION not in sql or sql.lstrip().split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+            continue
+        cur.execute("SET LOCAL enable_seqscan = off")
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+        scanned = seq_scanned(cur.fetchone()["QUERY PLAN"][0]["Plan"], HOT_RELATION)
+        cur.connection.rollback()
+        if scanned:
+            bad.append((" ".join(sql.split())[:120], sorted(set(scanned))))
+    return bad
+
+
+# -----------------------------
+# Tests
+# -----------------------------
+def test_every_route_has_a_budget_and_a_case(app):
+    routes = {(rule.endpoint, method)
+              for rule in app.url_map.iter_rules()
+              if rule.endpoint.split(".")[0] in ("main", "reports")
+              for method in rule.methods - {"HEAD", "OPTIONS"}}
+    covered = {(param.values[0], param.values[1]) for param in CASES}
+    assert all((param.values[1] == "GET") == (param.values[5] is None) for param in CASES), \
+        "every write, and only writes, give an outcome"
+
+    assert sorted(routes - set(BUDGETS)) == [], "routes without a budget"
+    assert sorted(routes - covered) == [], "routes no case requests"
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("large, small", PAIRS)
+def test_statement_count_independent_of_size(call, warm, mode, large, small):
+    _, _, large_ran, _ = call(mode, "GET", large)
+    _, _, small_ran, _ = call(mode, "GET", small)
+
+    assert len(large_ran) == len(small_ran), "statement count depends on data size (N+1)"
+
+
+@pytest.mark.parametrize("mode, endpoint, method, url, data, hot, outcome", by_mode(CASES))
+def test_route_within_budget(request, call, warm, db, fx, mode, endpoint, method, url, data,
+                             hot, outcome):
+    max_statements, ceiling = BUDGETS[(endpoint, method)]
+    ceiling *= request.config.getoption("--latency-factor")
+
+    repeat = request.config.getoption("--repeat") if method == "GET" else 1
+    runs = [call(mode, method, url, data) for _ in range(repeat)]
+    resp, _, ran, flashed = runs[-1]
+    median = statistics.median(run[1] for run in runs) * 1000
+
+    if outcome is None:
+        assert resp.status_code == 200
+    else:
+        location, flash, check = outcome
+        if location is None:
+            assert resp.status_code == 200
+        else:
+            assert resp.status_code == 302
+            assert urlsplit(resp.location).path == location.format(**fx)
+        assert flashed == ([flash] if flash else [])
+        cur = db.cursor()
+        cur.execute(check.format(scale=len(fx["s"]), **fx))
+        assert cur.fetchone() == {"ok": True}, " ".join(check.split())
+        db.rollback()
+
+    assert len(ran) <= max_statements, "\n".join(ran)
+    assert median <= ceiling, f"{median:.1f} ms, ceiling {ceiling:.0f} ms"
+    if hot and mode == "plain":
+        assert seq_scans(db.cursor(), ran) == []